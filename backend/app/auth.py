@@ -3,13 +3,18 @@ import logging
 from datetime import datetime, timedelta, timezone 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
+from jose import jwt
 from passlib.context import CryptContext
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 from pydantic import BaseModel, EmailStr 
-from app.deps import get_db
+from app.deps import get_async_db, get_principal_optional, run_write, Principal
 from app.models import User, School
+from app.limiter import Overloaded
+from app.pwhash import password_hasher
+from app.registry import school_registry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,6 +23,8 @@ load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me-please-make-this-long-and-random") 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 
+STREAM_TOKEN_SCOPE = "ticket_events"
+STREAM_TOKEN_TTL_S = int(os.getenv("STREAM_TOKEN_TTL_S", "60"))  # chỉ cần sống tới lúc mở stream
 
 security = HTTPBearer()
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -43,6 +50,29 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         print(f"WARN: Password verification failed: {e}")
         return False
 
+# Bản async cho request handler: chạy ở process pool riêng (app/pwhash.py), queue đầy -> 503 ngay
+def _busy(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=503, detail="Server is busy, please retry shortly.",
+                         headers={"Retry-After": e.retry_after_header})
+
+async def hash_password_async(pw: str) -> str:
+    try:
+        return await password_hasher.hash(pw)
+    except Overloaded as e:
+        raise _busy(e)
+    except Exception as e:
+        print(f"ERROR: Password hashing failed: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error during password processing.")
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except Overloaded as e:
+        raise _busy(e)
+    except Exception as e:
+        print(f"WARN: Password verification failed: {e}")
+        return False
+
 # TOKEN
 def create_token(sub: str, role: str, school_id: int, expires_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES):
     """Creates a JWT access token."""
@@ -56,10 +86,25 @@ def create_token(sub: str, role: str, school_id: int, expires_minutes: int = ACC
     encoded_jwt = jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_stream_token(principal: Principal) -> str:
+    """Short-lived JWT that can only open ticket event streams (EventSource cannot send an Authorization header)."""
+    payload = {
+        "sub": principal.email,
+        "role": principal.role,
+        "school_id": principal.school_id,
+        "scope": STREAM_TOKEN_SCOPE,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=STREAM_TOKEN_TTL_S),
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
+
 # Dependency for Role-Based Access Control ---
 def require_roles(*roles: str): 
     """Dependency to verify JWT and check user roles."""
-    async def verifier(creds: HTTPAuthorizationCredentials = Depends(security)):
+    # Principal được resolve 1 lần/request (deps.get_principal_optional) và cache theo token -> không query users
+    async def verifier(
+        creds: HTTPAuthorizationCredentials = Depends(security),
+        principal: Principal | None = Depends(get_principal_optional),
+    ):
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -69,23 +114,19 @@ def require_roles(*roles: str):
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Operation not permitted for your role",
         )
-        try:
-            payload = jwt.decode(creds.credentials, JWT_SECRET, algorithms=[ALGORITHM])
-            user_email: str | None = payload.get("sub")
-            user_role: str | None = payload.get("role")
-            if user_email is None or user_role is None:
-                print("WARN: Token missing required claims (sub, role)")
-                raise credentials_exception
-        except JWTError as e:
-            print(f"WARN: JWT Decode Error: {e}")
+        if principal is None:
+            print("WARN: Invalid token or missing 'sub' claim")
             raise credentials_exception
-        
-        # Check if the user's role is in the allowed roles
-        if roles and user_role not in roles:
-            print(f"WARN: Forbidden access for role '{user_role}'. Required: {roles}")
+        if principal.role is None:
+            print("WARN: Token missing required claims (sub, role)")
+            raise credentials_exception
+
+        # Role = role thấp hơn giữa claim trong token và role hiện tại trong DB (deps.stricter_role)
+        if roles and principal.role not in roles:
+            print(f"WARN: Forbidden access for role '{principal.role}'. Required: {roles}")
             raise forbidden_exception
-            
-        return payload 
+
+        return principal.as_payload()
     return verifier
 
 # Authentication Endpoints 
@@ -95,11 +136,11 @@ class LoginRequest(BaseModel): # pydantic
     password: str
 
 @router.post("/login")
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
+async def login(payload: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     """Logs in a user and returns JWT, role, AND school slug."""
     logger.info(f"Login attempt for email: {payload.email}") # Log attempt start
 
-    user = db.query(User).filter(User.email == payload.email).first()
+    user = (await db.execute(select(User).where(User.email == payload.email))).scalars().first()
 
     if not user:
         logger.warning(f"Login failed: User not found for email {payload.email}")
@@ -107,19 +148,18 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
 
     logger.info(f"User found: ID={user.id}, Role={user.role}, SchoolID={user.school_id}") # Log user details
 
-    if not verify_password(payload.password, user.password_hash):
+    if not await verify_password_async(payload.password, user.password_hash):
         logger.warning(f"Login failed: Incorrect password for email {payload.email}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
 
     # Query for School Slug with explicit checks
     school_slug: str | None = None
     if user.school_id is not None: # Check if school_id exists
-        logger.info(f"Querying school slug for school_id: {user.school_id}")
-        # Use scalar() to directly get the slug value or None
-        school_slug_result = db.query(School.slug).filter(School.id == user.school_id).scalar()
+        # Registry trong RAM (chỉ query DB nếu trường chưa có trong registry)
+        school_info = await school_registry.aby_id(user.school_id, db)
 
-        if school_slug_result:
-            school_slug = school_slug_result
+        if school_info:
+            school_slug = school_info.slug
             logger.info(f"Found school slug: '{school_slug}' for school_id {user.school_id}")
         else:
             # Log if the school ID exists on the user but not in the schools table
@@ -153,15 +193,16 @@ class StudentRegisterRequest(BaseModel):
      role: str
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_student(payload: StudentRegisterRequest, db: Session = Depends(get_db)):
+async def register_student(payload: StudentRegisterRequest, db: AsyncSession = Depends(get_async_db)):
     """Registers a new student for a specific school."""
     # 1. Tìm trường học
-    school = db.query(School).filter(School.slug == payload.school_slug).first()
+    school = await school_registry.aget(payload.school_slug, db)
     if not school:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"School '{payload.school_slug}' not found.")
 
     # 2. Kiểm tra email đã tồn tại cho trường này chưa
-    existing_user = db.query(User).filter(User.email == payload.email, User.school_id == school.id).first()
+    existing_user = (await db.execute(
+        select(User.id).where(User.email == payload.email, User.school_id == school.id))).first()
     if existing_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered for this school.")
     
@@ -171,24 +212,26 @@ def register_student(payload: StudentRegisterRequest, db: Session = Depends(get_
         raise HTTPException(status_code=400, detail=f"Invalid role provided. Must be one of: {allowed_roles}")
 
     # 3. Tạo user student mới
-    try:
-        new_student = User(
+    password_hash = await hash_password_async(payload.password) # Argon2 (process pool)
+    def _create(s: Session):
+        s.add(User(
             email=payload.email,
-            password_hash=hash_password(payload.password), # Argon2
-            role=payload.role, 
+            password_hash=password_hash,
+            role=payload.role,
             school_id=school.id
-        )
-        db.add(new_student)
-        db.commit()
-        db.refresh(new_student)
+        ))
+
+    try:
+        await run_write(db, _create)
 
         # 4. Tạo token và trả về
-        token = create_token(sub=new_student.email, role=new_student.role, school_id=school.id)
-        print(f"Student registered successfully: {new_student.email} for school {school.slug}")
-        return {"token": token, "role": new_student.role}
+        token = create_token(sub=payload.email, role=payload.role, school_id=school.id)
+        print(f"Student registered successfully: {payload.email} for school {school.slug}")
+        return {"token": token, "role": payload.role}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         print(f"ERROR: Student registration failed: {e}")
         raise HTTPException(status_code=500, detail="Could not register student due to an internal error.")
 
@@ -198,9 +241,9 @@ class MagicRequest(BaseModel):
     school_slug: str
 
 @router.post("/magic")
-def magic(payload: MagicRequest, db: Session = Depends(get_db)):
+async def magic(payload: MagicRequest, db: AsyncSession = Depends(get_async_db)):
     """Generates a temporary 'applicant' token (demo purposes)."""
-    school = db.query(School).filter(School.slug==payload.school_slug).first()
+    school = await school_registry.aget(payload.school_slug, db)
     if not school:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="School not found")
     
@@ -0,0 +1,131 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from app.limiter import Overloaded, is_throttle_error
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))                     # số call gần nhất dùng để tính tỉ lệ lỗi
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))                # cần ít nhất chừng này call mới xét trip
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "0"))              # giây; >0: call chậm hơn cũng tính là lỗi
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))       # thời gian mở trước khi thử half-open
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "2"))  # số probe thành công liên tiếp để đóng lại
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    """The breaker is open (or its half-open probes are busy): do not call the dependency."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open when the failure ratio over the last `window` calls reaches `failure_ratio`
+    (failures = errors or calls slower than `slow_call`). After `open_seconds` it lets probe
+    calls through one at a time (half-open); `half_open_probes` consecutive successes close it,
+    any failure opens it again. Throttling and local queue timeouts are neither successes nor
+    failures: the AIMD limiter handles those.
+    """
+
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, slow_call: float = BREAKER_SLOW_CALL,
+                 open_seconds: float = BREAKER_OPEN_SECONDS, half_open_probes: int = BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)   # True = lỗi
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"[{self.name}] circuit {self.state} -> {state}")
+            self.state = state
+
+    def _trip(self):
+        self._set_state(OPEN)
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._probe_successes = 0
+        self.trips += 1
+
+    def before_call(self) -> bool:
+        """Raises CircuitOpen if the call must not go out; returns True if the call is a half-open probe."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit is {self.state}")
+
+    def after_call(self, probe: bool, failed: bool | None):
+        """failed=None: outcome says nothing about the dependency's health (throttle, local timeout)."""
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+                if failed:
+                    self._trip()
+                elif failed is False:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._set_state(CLOSED)
+                return
+            if failed is None or self.state != CLOSED:
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) / len(self._outcomes) >= self.failure_ratio:
+                self._trip()
+
+    @contextmanager
+    def guard(self):
+        """
+        Wraps one dependency call. Yields `started()`: call it right before the actual request when the
+        block first waits locally (e.g. for a limiter slot) so that wait does not count as a slow call.
+        """
+        probe = self.before_call()
+        start = time.monotonic()
+        failed = None
+
+        def started():
+            nonlocal start
+            start = time.monotonic()
+
+        try:
+            yield started
+            failed = self.slow_call > 0 and time.monotonic() - start > self.slow_call
+        except Exception as e:
+            failed = None if isinstance(e, Overloaded) or is_throttle_error(e) else True
+            raise
+        finally:
+            self.after_call(probe, failed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "recent_failure_ratio": round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "recent_calls": len(self._outcomes),
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "open_for_s": round(time.monotonic() - self._opened_at, 1) if self.state != CLOSED else 0.0,
+            }
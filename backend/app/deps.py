@@ -1,13 +1,24 @@
 import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, TypeVar
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import create_engine, event, inspect, select
+from sqlalchemy.orm import sessionmaker, Session, object_session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 
 from app.models import User
+from app.limiter import Overloaded
+from app.sqlite_profile import (
+    SQLITE_PROFILE, SQLITE_WRITER, SQLiteWriter, is_sqlite_file, install_pragmas, install_immediate_begin,
+)
 
 load_dotenv()
 
@@ -19,15 +30,90 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://") and "+psycopg" not in DATABASE_URL:
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
     
-ENGINE = create_engine(DATABASE_URL, pool_pre_ping=True)
+# Async driver cho router: psycopg (async) với Postgres, aiosqlite với SQLite
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1) if DATABASE_URL.startswith("sqlite://") else DATABASE_URL
+)
+
+# Pool: mỗi worker process giữ tối đa DB_POOL_SIZE + DB_MAX_OVERFLOW connection
+# (Postgres: nhân với số worker, phải nhỏ hơn max_connections / giới hạn của pgbouncer)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))       # giây chờ connection rảnh trước khi báo lỗi
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))       # đóng connection cũ hơn N giây (LB / NAT cắt idle)
+
+def _pool_kwargs(url: str) -> dict:
+    if url.startswith("sqlite") and not is_sqlite_file(url):
+        return {}   # SQLite in-memory: pool mặc định (1 connection), không có khái niệm size
+    kwargs = {}
+    if url.startswith("sqlite+aiosqlite"):
+        # SQLAlchemy 2.0.35 mặc định NullPool cho aiosqlite -> mỗi request mở file + thread mới
+        kwargs["poolclass"] = AsyncAdaptedQueuePool
+    return {
+        **kwargs,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+# Engine sync: migration, create_all, registry.load lúc startup, scripts
+ENGINE = create_engine(DATABASE_URL, **_pool_kwargs(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=ENGINE)
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Engine async: toàn bộ router. expire_on_commit=False để đọc object sau commit không phát sinh lazy load
+ASYNC_ENGINE = create_async_engine(ASYNC_DATABASE_URL, **_pool_kwargs(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(ASYNC_ENGINE, autoflush=False, expire_on_commit=False)
+
+# SQLite file: WAL + pragmas trên mọi connection, write đi qua 1 writer (app/sqlite_profile.py)
+db_writer: SQLiteWriter | None = None
+if SQLITE_PROFILE and is_sqlite_file(DATABASE_URL):
+    install_pragmas(ENGINE)
+    install_pragmas(ASYNC_ENGINE.sync_engine)
+    if SQLITE_WRITER:
+        WRITE_ENGINE = create_engine(DATABASE_URL, pool_size=1, max_overflow=0, pool_recycle=DB_POOL_RECYCLE)
+        install_pragmas(WRITE_ENGINE)
+        install_immediate_begin(WRITE_ENGINE)
+        db_writer = SQLiteWriter(WRITE_ENGINE)
+
+async def get_async_db():
+    # AsyncSession chỉ lấy connection từ pool ở query đầu tiên -> request đọc cache không giữ connection
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+T = TypeVar("T")
+
+async def run_write(db: AsyncSession, fn: Callable[[Session], T]) -> T:
+    """
+    Runs fn(session) as one write transaction and commits; returns fn's result (plain values or detached rows).
+    SQLite: on the single writer thread (db_writer); other databases: on the request's own session.
+    """
+    if db_writer is None:
+        try:
+            result = await db.run_sync(fn)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return result
+    try:
+        result = await db_writer.run(fn)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly.",
+                            headers={"Retry-After": e.retry_after_header})
+    await db.commit()  # đóng read transaction (nếu có) của request -> query sau đó thấy dữ liệu vừa ghi
+    return result
+
+def pool_stats() -> dict:
+    pool = ASYNC_ENGINE.pool
+    stats = {"class": type(pool).__name__, "size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW,
+             "timeout_s": DB_POOL_TIMEOUT, "recycle_s": DB_POOL_RECYCLE}
+    if hasattr(pool, "checkedout"):
+        stats.update(checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow())
+    if db_writer is not None:
+        stats["sqlite_writer"] = db_writer.stats()
+    return stats
 
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
 
@@ -36,38 +122,208 @@ JWT_SECRET = os.getenv("JWT_SECRET", "change-me-please-make-this-long-and-random
 ALGORITHM = "HS256"
 bearer = HTTPBearer(auto_error=False)
 
-def _email_from_token(creds: HTTPAuthorizationCredentials | None) -> str | None:
-    if not creds:
-        return None
+# Token đã verify -> principal, giữ trong RAM để request có auth không phải query bảng users
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))          # giây; cũng là độ trễ tối đa giữa các worker process
+PRINCIPAL_CACHE_MAX = int(os.getenv("PRINCIPAL_CACHE_MAX", "10000"))
+
+
+# Quyền từ cao xuống thấp. Role không có trong bảng -> thấp nhất (không khớp require_roles nào)
+ROLE_RANK = {"owner": 4, "admin": 3, "dept_admin": 2, "student": 1, "applicant": 0, "parent": 0}
+
+def stricter_role(claim: str | None, current: str | None) -> str | None:
+    """The less privileged of the token's role claim and the user's current role (never more than the claim)."""
+    if claim is None or current is None or claim == current:
+        return claim
+    return current if ROLE_RANK.get(current, -1) < ROLE_RANK.get(claim, -1) else claim
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated caller: JWT claims, narrowed by the current users row (if the account exists)."""
+    email: str
+    role: str
+    school_id: int | None
+    id: int | None = None            # None: token hợp lệ nhưng chưa có user (applicant từ /auth/magic)
+    department: str | None = None
+    claims: dict = field(default_factory=dict, compare=False)
+
+    def as_payload(self) -> dict:
+        """Dict in the shape require_roles always returned (JWT payload), plus user_id."""
+        return {**self.claims, "sub": self.email, "role": self.role, "school_id": self.school_id, "user_id": self.id}
+
+
+class PrincipalCache:
+    """
+    LRU of verified token -> Principal. Entries live PRINCIPAL_CACHE_TTL seconds (never past the token's exp)
+    and are dropped as soon as the user's row changes in this process (see the User mapper events below).
+    """
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_entries: int = PRINCIPAL_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[Principal, float]]" = OrderedDict()
+        self._by_email: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Principal | None:
+        with self._lock:
+            hit = self._entries.get(token)
+            if hit and hit[1] > time.time():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return hit[0]
+            if hit:
+                self._drop(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, principal: Principal, token_exp: float | None = None):
+        expires = time.time() + self.ttl
+        if token_exp:
+            expires = min(expires, token_exp)
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (principal, expires)
+            self._by_email.setdefault(principal.email, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, email: str | None):
+        if not email:
+            return
+        with self._lock:
+            tokens = self._by_email.pop(email, set())
+            for t in tokens:
+                self._entries.pop(t, None)
+            self.invalidations += len(tokens)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_email.clear()
+
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry:
+            tokens = self._by_email.get(entry[0].email)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_email[entry[0].email]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+principal_cache = PrincipalCache()
+
+
+# ====== Invalidate cache SAU khi commit ======
+# Mapper event (after_update...) chạy lúc flush, trước commit: nếu xoá cache ngay, request khác vẫn đọc
+# được row cũ (chưa commit) và cache lại nó tới hết TTL. Nên chỉ ghi nhận callback, chạy khi commit xong.
+_ON_COMMIT_KEY = "on_commit_callbacks"
+
+def on_commit(target, callback: Callable[[], None]):
+    """Runs callback once the session that flushed `target` commits (dropped if it rolls back)."""
+    session = object_session(target)
+    if session is None:
+        callback()
+        return
+    session.info.setdefault(_ON_COMMIT_KEY, []).append(callback)
+
+@event.listens_for(Session, "after_commit")
+def _run_on_commit(session):
+    for callback in session.info.pop(_ON_COMMIT_KEY, ()):
+        callback()
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_on_commit(session, transaction):
+    # Transaction ngoài cùng kết thúc mà không commit (rollback / close) -> bỏ callback còn treo
+    if transaction.parent is None:
+        session.info.pop(_ON_COMMIT_KEY, None)
+
+
+# Role / school / email đổi (hoặc user mới được tạo cho email của token magic) -> bỏ principal cũ khi commit xong.
+# Process khác chỉ thấy thay đổi sau tối đa PRINCIPAL_CACHE_TTL giây.
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    # Lấy email (cả email cũ) lúc flush: sau commit history đã bị reset
+    emails = [target.email, *(inspect(target).attrs.email.history.deleted or ())]
+    def _invalidate():
+        for email in emails:
+            principal_cache.invalidate_user(email)
+    on_commit(target, _invalidate)
+
+
+def _decode_token(token: str, scope: str | None = None) -> dict | None:
     try:
-        payload = jwt.decode(creds.credentials, JWT_SECRET, algorithms=[ALGORITHM])
-        return payload.get("sub")  # email
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    if not payload.get("sub"):
+        return None
+    # Token có scope (vd. stream token của /tickets/stream-token) chỉ dùng được đúng việc đó, không gọi API khác
+    if payload.get("scope") != scope:
+        return None
+    return payload
 
-def get_current_user_optional(
-    creds: HTTPAuthorizationCredentials = Depends(bearer),
-    db: Session = Depends(get_db),
-) -> User | None:
-    email = _email_from_token(creds)
-    if not email:
+async def resolve_principal(token: str, db: AsyncSession, scope: str | None = None) -> Principal | None:
+    """Verified principal for a bearer token (or a token of the given scope); hits the users table only on a cache miss."""
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return cached if cached.claims.get("scope") == scope else None
+    payload = _decode_token(token, scope)
+    if payload is None:
         return None
-    return db.query(User).filter(User.email == email).first()
+    user = (await db.execute(select(User).where(User.email == payload["sub"]))).scalars().first()
+    claim_school = payload.get("school_id")
+    if user is not None and (claim_school is None or claim_school == user.school_id):
+        # Token chỉ thu hẹp được quyền: user bị hạ role -> mất quyền ngay, nhưng token /auth/magic
+        # (không cần mật khẩu) cho email của owner vẫn chỉ là "applicant"
+        principal = Principal(email=user.email, role=stricter_role(payload.get("role"), user.role),
+                              school_id=user.school_id, id=user.id, department=user.department, claims=payload)
+    else:
+        # Chưa có user, hoặc user thuộc trường khác trường của token -> không gắn với account đó
+        principal = Principal(email=payload["sub"], role=payload.get("role"),
+                              school_id=payload.get("school_id"), claims=payload)
+    principal_cache.put(token, principal, token_exp=payload.get("exp"))
+    return principal
 
-def get_current_user(
+async def get_principal_optional(
     creds: HTTPAuthorizationCredentials = Depends(bearer),
-    db: Session = Depends(get_db),
-) -> User:
-    email = _email_from_token(creds)
-    if not email:
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal | None:
+    """Resolved once per request: FastAPI caches this dependency for every other dependency that uses it."""
+    if not creds:
+        return None
+    return await resolve_principal(creds.credentials, db)
+
+async def get_current_user_optional(principal: Principal | None = Depends(get_principal_optional)) -> Principal | None:
+    if principal is None or principal.id is None:
+        return None
+    return principal
+
+async def get_current_user(principal: Principal | None = Depends(get_principal_optional)) -> Principal:
+    if principal is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
+    if principal.id is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
-
-
+    return principal
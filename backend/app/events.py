@@ -0,0 +1,227 @@
+import os
+import json
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Push ticket / message updates tới client (SSE hoặc WebSocket, xem app/routers/tickets.py) thay vì client
+# gọi lại GET /tickets/{id}, /admin/tickets theo chu kỳ. Event chỉ được publish SAU khi write đã commit.
+#   ticket:{id}                 -> trang chi tiết ticket (student của ticket đó, staff)
+#   dept:{school_id}:{dept}     -> hàng đợi của phòng ban (ticket mới, đổi status, message mới)
+# EVENTS_BROKER=memory: pub/sub trong process (1 worker). Nhiều worker: EVENTS_BROKER=postgres dùng
+# LISTEN/NOTIFY của chính DB Postgres làm broker -> event từ worker nào cũng tới subscriber ở mọi worker.
+
+# ====== Config ======
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "memory")             # memory | postgres
+EVENTS_QUEUE_MAX = int(os.getenv("EVENTS_QUEUE_MAX", "100"))     # event chờ gửi / subscriber
+EVENTS_HEARTBEAT_S = float(os.getenv("EVENTS_HEARTBEAT_S", "15"))  # ping khi im lặng (proxy cắt kết nối idle)
+EVENTS_PG_CHANNEL = os.getenv("EVENTS_PG_CHANNEL", "ticket_events")
+_PG_NOTIFY_MAX_BYTES = 7900   # payload NOTIFY tối đa 8000 byte
+
+STAFF_ROLES = ("owner", "admin", "dept_admin")
+
+
+def ticket_topic(ticket_id: int) -> str:
+    return f"ticket:{ticket_id}"
+
+def department_topic(school_id: int, department: str) -> str:
+    return f"dept:{school_id}:{department}"
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Subscription:
+    """
+    One client's view of a set of topics. Events wait in a bounded queue; a client that falls more than
+    max_queued events behind loses them and gets a single {"type": "resync"} so it re-fetches once.
+    Internal (staff-only) events are never queued for non-staff subscribers.
+    """
+
+    def __init__(self, topics: Iterable[str], staff: bool, max_queued: int = EVENTS_QUEUE_MAX):
+        self.topics = frozenset(topics)
+        self.staff = staff
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_queued))
+        self.dropped = 0
+
+    def offer(self, event: dict) -> bool:
+        if event.get("internal") and not self.staff:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "reason": "slow_consumer"})
+            return False
+
+    async def get(self, timeout: float = EVENTS_HEARTBEAT_S) -> Optional[dict]:
+        """Next event, or None after `timeout` seconds without one (time to send a heartbeat)."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """Topic -> subscribers map for this process. publish()/subscribe() must be called on the event loop."""
+
+    name = "memory"
+
+    def __init__(self, max_queued: int = EVENTS_QUEUE_MAX):
+        self.max_queued = max_queued
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._seq = itertools.count(1)
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topics: Iterable[str], staff: bool = False) -> Subscription:
+        sub = Subscription(topics, staff, self.max_queued)
+        for topic in sub.topics:
+            self._subs.setdefault(topic, set()).add(sub)
+        self.subscribers += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscribers -= 1
+        for topic in sub.topics:
+            subs = self._subs.get(topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[topic]
+
+    async def publish(self, topic: str, event: dict):
+        self._dispatch(topic, event)
+
+    def _dispatch(self, topic: str, event: dict):
+        self.published += 1
+        subs = self._subs.get(topic)
+        if not subs:
+            return
+        event = {**event, "seq": next(self._seq)}
+        for sub in list(subs):
+            dropped = sub.dropped
+            if sub.offer(event):
+                self.delivered += 1
+            self.dropped += sub.dropped - dropped
+
+    def stats(self) -> dict:
+        # Chỉ đọc counter: /health/metrics chạy ở threadpool, không duyệt _subs khi loop đang sửa
+        return {
+            "broker": self.name,
+            "topics": len(self._subs),
+            "subscribers": self.subscribers,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    Multi-worker broker on Postgres LISTEN/NOTIFY: publish() sends NOTIFY, and every worker (this one
+    included) dispatches what it hears on EVENTS_PG_CHANNEL to its local subscribers.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, channel: str = EVENTS_PG_CHANNEL, max_queued: int = EVENTS_QUEUE_MAX):
+        super().__init__(max_queued)
+        self.dsn = dsn
+        self.channel = channel
+        self._notify_conn = None
+        self._notify_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.notify_errors = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._notify_conn is not None:
+            await self._notify_conn.close()
+            self._notify_conn = None
+
+    async def _listen(self):
+        import psycopg
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {self.channel}")
+                    logger.info(f"Event broker listening on Postgres channel '{self.channel}'.")
+                    async for note in conn.notifies():
+                        try:
+                            msg = json.loads(note.payload)
+                            self._dispatch(msg["topic"], msg["event"])
+                        except (ValueError, KeyError) as e:
+                            logger.warning(f"Ignoring malformed ticket event: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Mất kết nối: subscriber không nhận event trong lúc này -> client resync khi reconnect
+                logger.error(f"Event broker LISTEN connection lost: {e}; reconnecting in 1s")
+                await asyncio.sleep(1)
+
+    async def publish(self, topic: str, event: dict):
+        import psycopg
+        payload = json.dumps({"topic": topic, "event": event}, default=str)
+        if len(payload.encode()) > _PG_NOTIFY_MAX_BYTES:
+            # Message quá dài cho NOTIFY -> báo client tải lại ticket thay vì gửi nội dung
+            payload = json.dumps({"topic": topic, "event": {"type": "resync", "ticket_id": event.get("ticket_id"),
+                                                            "internal": event.get("internal", False)}})
+        try:
+            async with self._notify_lock:
+                if self._notify_conn is None or self._notify_conn.closed:
+                    self._notify_conn = await psycopg.AsyncConnection.connect(self.dsn, autocommit=True)
+                await self._notify_conn.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+        except Exception as e:
+            # Write đã commit; không làm hỏng request vì event -> ít nhất subscriber của worker này vẫn nhận
+            self.notify_errors += 1
+            logger.error(f"NOTIFY failed ({e}); delivering ticket event locally only.")
+            self._dispatch(topic, event)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "channel": self.channel, "notify_errors": self.notify_errors}
+
+
+def _make_broker() -> InProcessBroker:
+    if EVENTS_BROKER == "postgres":
+        from app.deps import DATABASE_URL
+        if DATABASE_URL.startswith("postgresql"):
+            return PostgresBroker(DATABASE_URL.replace("postgresql+psycopg://", "postgresql://", 1))
+        logger.warning("EVENTS_BROKER=postgres needs a Postgres DATABASE_URL; using the in-process broker.")
+    return InProcessBroker()
+
+
+ticket_events = _make_broker()
+
+
+async def publish_ticket_event(event: dict, school_id: Optional[int], department: Optional[str]):
+    """Publishes a committed change on its ticket's topic and on its department queue."""
+    await ticket_events.publish(ticket_topic(event["ticket_id"]), event)
+    if school_id is not None and department:
+        await ticket_events.publish(department_topic(school_id, department), event)
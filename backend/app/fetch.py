@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from html import unescape
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import httpx
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+_MODULE_DIR = os.path.dirname(__file__)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(_MODULE_DIR))
+FETCH_CACHE_DIR = os.path.abspath(os.getenv("FETCH_CACHE_DIR", os.path.join(_PROJECT_ROOT, ".cache", "fetch")))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "20"))                        # giây, cho cả request
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(50 * 1024 * 1024)))     # 50 MB
+FETCH_CACHE_TTL = int(os.getenv("FETCH_CACHE_TTL", "0"))                       # >0: trong TTL không gọi lại upstream
+UA = "ScholaskCrawler/0.1 (+https://scholask.com)"
+
+
+class FetchError(Exception):
+    """URL could not be fetched (bad scheme, HTTP error, timeout, too large)."""
+
+
+@dataclass
+class FetchResult:
+    url: str
+    sha256: str          # hash of the body -> cache key
+    content_type: str
+    path: str            # cached body on disk
+    size: int
+    downloaded: bool     # False khi dùng lại cache (304 hoặc còn trong TTL)
+
+    @property
+    def is_pdf(self) -> bool:
+        return "application/pdf" in self.content_type or urlparse(self.url).path.lower().endswith(".pdf")
+
+    @property
+    def is_text(self) -> bool:
+        return self.content_type.startswith("text/plain") or urlparse(self.url).path.lower().endswith((".txt", ".md"))
+
+
+# ====== Text cleaning (dùng chung với scripts/ingest_crawl.py) ======
+def clean_html(html_bytes):
+    soup = BeautifulSoup(html_bytes, "html.parser")
+    for s in soup(["script","style","noscript","header","footer","nav","form"]):
+        s.decompose()
+    text = soup.get_text("\n")
+    text = re.sub(r"\n{2,}", "\n\n", text)
+    return unescape(text).strip()
+
+
+# ====== Shared HTTP client ======
+_client: httpx.AsyncClient | None = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide pooled AsyncClient (keep-alive reused across requests)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(FETCH_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            follow_redirects=True,
+            headers={"User-Agent": UA},
+        )
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# ====== Content-addressed cache ======
+# FETCH_CACHE_DIR/
+#   blobs/<sha256>          body đã tải
+#   urls/<sha1(url)>.json   {url, sha256, etag, last_modified, content_type, fetched_at, indexed: {school: sha256}}
+def _blob_path(sha: str) -> str:
+    return os.path.join(FETCH_CACHE_DIR, "blobs", sha)
+
+def _record_path(url: str) -> str:
+    return os.path.join(FETCH_CACHE_DIR, "urls", hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+def _load_record(url: str) -> dict:
+    try:
+        with open(_record_path(url), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def _save_record(url: str, record: dict):
+    path = _record_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def _result_from_record(record: dict) -> FetchResult | None:
+    sha = record.get("sha256")
+    if not sha or not os.path.exists(_blob_path(sha)):
+        return None
+    return FetchResult(
+        url=record["url"],
+        sha256=sha,
+        content_type=record.get("content_type", ""),
+        path=_blob_path(sha),
+        size=os.path.getsize(_blob_path(sha)),
+        downloaded=False,
+    )
+
+
+async def fetch_url(url: str) -> FetchResult:
+    """
+    Fetches a URL through the local cache.
+    Sends a conditional GET (ETag / Last-Modified) when a cached copy exists, so an
+    unchanged page costs one 304 and no download. Bodies are streamed to disk with
+    a hard size cap and stored under their SHA-256.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        raise FetchError(f"Unsupported URL: {url}")
+
+    record = _load_record(url)
+    cached = _result_from_record(record) if record else None
+    if cached and FETCH_CACHE_TTL > 0 and time.time() - record.get("fetched_at", 0) < FETCH_CACHE_TTL:
+        logger.info(f"Fetch cache hit (fresh) for {url}")
+        return cached
+
+    headers = {}
+    if cached:
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+
+    os.makedirs(os.path.join(FETCH_CACHE_DIR, "blobs"), exist_ok=True)
+    client = get_http_client()
+    try:
+        async with client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code == 304 and cached:
+                logger.info(f"Fetch cache hit (304 Not Modified) for {url}")
+                record["fetched_at"] = time.time()
+                _save_record(url, record)
+                return cached
+            if resp.status_code != 200:
+                raise FetchError(f"GET {url} returned HTTP {resp.status_code}")
+
+            declared = resp.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > FETCH_MAX_BYTES:
+                raise FetchError(f"{url} is larger than the {FETCH_MAX_BYTES} byte limit")
+
+            digest = hashlib.sha256()
+            size = 0
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(FETCH_CACHE_DIR, "blobs"), suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    async for block in resp.aiter_bytes():
+                        size += len(block)
+                        if size > FETCH_MAX_BYTES:
+                            raise FetchError(f"{url} is larger than the {FETCH_MAX_BYTES} byte limit")
+                        digest.update(block)
+                        out.write(block)
+                sha = digest.hexdigest()
+                os.replace(tmp_path, _blob_path(sha))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            content_type = resp.headers.get("content-type", "").lower()
+            etag = resp.headers.get("etag")
+            last_modified = resp.headers.get("last-modified")
+    except httpx.HTTPError as e:
+        raise FetchError(f"Failed to fetch {url}: {e}") from e
+
+    new_record = {
+        "url": url,
+        "sha256": sha,
+        "etag": etag,
+        "last_modified": last_modified,
+        "content_type": content_type,
+        "fetched_at": time.time(),
+        "indexed": record.get("indexed", {}),
+    }
+    _save_record(url, new_record)
+    logger.info(f"Fetched {url} ({size} bytes, sha256={sha[:12]}, type={content_type or 'unknown'})")
+    return FetchResult(url=url, sha256=sha, content_type=content_type, path=_blob_path(sha), size=size, downloaded=True)
+
+
+def is_indexed(school: str, fetched: FetchResult) -> bool:
+    """True if this exact body (same SHA-256) was already embedded into the school's index."""
+    return _load_record(fetched.url).get("indexed", {}).get(school) == fetched.sha256
+
+def mark_indexed(school: str, fetched: FetchResult):
+    record = _load_record(fetched.url)
+    if not record:
+        return
+    record.setdefault("indexed", {})[school] = fetched.sha256
+    _save_record(fetched.url, record)
@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable
+from dotenv import load_dotenv
+from app.limiter import BEDROCK_MAX_CONCURRENCY
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+# CLAUDE_HEDGE_DELAY: số giây, "p95" (theo latency quan sát được) hoặc "0" (tắt hedging)
+CLAUDE_HEDGE_DELAY = os.getenv("CLAUDE_HEDGE_DELAY", "0").strip().lower()
+CLAUDE_HEDGE_MIN_SAMPLES = int(os.getenv("CLAUDE_HEDGE_MIN_SAMPLES", "20"))   # cần đủ mẫu mới hedge theo p95
+CLAUDE_DEADLINE = float(os.getenv("CLAUDE_DEADLINE", "0"))                    # giây; >0: quá hạn -> trả lời degraded
+# Mỗi answer worker (app.limiter.bedrock_workers) có tối đa 2 attempt (gốc + hedge) -> pool không phải nơi xếp hàng;
+# xếp hàng ở đây sẽ bị tính vào CLAUDE_DEADLINE
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", str(2 * BEDROCK_MAX_CONCURRENCY)))
+
+
+class DeadlineExceeded(Exception):
+    """No attempt finished before the hard deadline; the caller should serve a degraded answer."""
+
+
+class LatencyWindow:
+    """Sliding window of recent successful call latencies (seconds)."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        with self._lock:
+            vals = sorted(self._samples)
+        if not vals:
+            return None
+        return vals[min(len(vals) - 1, int(round(p / 100.0 * (len(vals) - 1))))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class Hedger:
+    """
+    Runs a blocking call with an optional hedge: if the first attempt has not returned after
+    `hedge_delay`, a second identical attempt is started and whichever succeeds first wins.
+    Past `deadline` the call raises DeadlineExceeded; attempts still running are left to finish
+    in the pool (a boto3 call cannot be cancelled) and their results are dropped.
+    """
+
+    def __init__(self, name: str, hedge_delay: str = CLAUDE_HEDGE_DELAY, deadline: float = CLAUDE_DEADLINE,
+                 min_samples: int = CLAUDE_HEDGE_MIN_SAMPLES, pool_size: int = HEDGE_POOL_SIZE):
+        self.name = name
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+        self.min_samples = min_samples
+        self.latency = LatencyWindow()
+        self.pool_size = pool_size
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=f"hedge-{name}")
+        self._lock = threading.Lock()   # call() chạy đồng thời ở nhiều worker thread
+        self.calls = 0
+        self.hedges = 0          # số lần gửi request thứ 2
+        self.hedge_wins = 0      # request thứ 2 về trước
+        self.deadline_misses = 0
+
+    def current_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None if hedging is off / not enough samples yet."""
+        if self.hedge_delay in ("", "0", "off"):
+            return None
+        if self.hedge_delay.startswith("p"):
+            if len(self.latency) < self.min_samples:
+                return None
+            return self.latency.percentile(float(self.hedge_delay[1:]))
+        return float(self.hedge_delay)
+
+    def _timed(self, fn: Callable[[], Any]):
+        start = time.monotonic()
+        result = fn()
+        self.latency.add(time.monotonic() - start)
+        return result
+
+    def call(self, fn: Callable[[], Any], can_hedge: Callable[[], bool] = lambda: True) -> Any:
+        with self._lock:
+            self.calls += 1
+        delay = self.current_delay()
+        if delay is None and self.deadline <= 0:
+            return self._timed(fn)   # không hedge, không deadline: giữ nguyên hành vi cũ
+
+        start = time.monotonic()
+        hard_stop = start + self.deadline if self.deadline > 0 else None
+        primary = self._pool.submit(self._timed, fn)
+        pending = {primary}
+        hedged = False
+        error = None
+
+        while True:
+            now = time.monotonic()
+            waits = []
+            if not hedged and delay is not None:
+                waits.append(start + delay - now)
+            if hard_stop is not None:
+                waits.append(hard_stop - now)
+            timeout = max(0.0, min(waits)) if waits else None
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is not primary:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return f.result()
+                error = f.exception()
+
+            if hard_stop is not None and time.monotonic() >= hard_stop:
+                break
+            # Hedge khi attempt đầu chậm quá delay (hoặc lỗi sớm mà vẫn còn thời gian)
+            if not hedged and delay is not None and (error is not None or time.monotonic() - start >= delay):
+                hedged = True
+                if can_hedge():
+                    with self._lock:
+                        self.hedges += 1
+                    logger.info(f"[{self.name}] hedging after {(time.monotonic() - start) * 1000:.0f} ms")
+                    pending.add(self._pool.submit(self._timed, fn))
+            if not pending:
+                raise error
+
+        with self._lock:
+            self.deadline_misses += 1
+        raise DeadlineExceeded(f"{self.name} did not finish within {self.deadline:.1f}s")
+
+    def stats(self) -> dict:
+        delay = self.current_delay()
+        p50, p95 = self.latency.percentile(50), self.latency.percentile(95)
+        with self._lock:
+            counts = {"calls": self.calls, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                      "deadline_misses": self.deadline_misses}
+        return {
+            **counts,
+            "pool_size": self.pool_size,
+            "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+            "deadline_s": self.deadline or None,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
@@ -0,0 +1,141 @@
+import re
+import time
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+from app import rag, transit, structured
+
+logger = logging.getLogger(__name__)
+
+# ====== Lexicons ======
+# Chỉ match nguyên token/cụm token (\b...\b): "stop" không khớp "nonstop", "route" không khớp "routed".
+# Từ đa nghĩa ("stop", "schedule", "route", "term", "start", "end") chỉ dùng trong cụm có ngữ cảnh.
+_TERM_NOUNS = ["quarter", "semester", "term", "classes", "school"]
+_TERM_VERBS = ["start", "starts", "begin", "begins", "end", "ends"]
+INTENT_LEXICONS: Dict[str, List[str]] = {
+    "transit": [
+        "bus", "buses", "transit", "metro", "light rail", "link light rail", "streetcar", "orca card", "orca",
+        "bus stop", "bus stops", "transit stop", "bus route", "bus routes", "next bus", "bus schedule",
+        "arrival times", "departure times",
+    ],
+    "calendar": [
+        "calendar", "academic calendar", "quarter", "quarters", "semester", "semesters",
+        "this term", "next term", "start date", "end date", "start of the quarter", "end of the quarter",
+        "deadline", "deadlines", "holiday", "holidays", "spring break", "winter break", "finals week", "final exams",
+        "first day", "last day", "registration opens",
+        "commencement", "graduation ceremony", "no classes", "closed on", "when does", "when is",
+        "is there school", "classes on", "open on", "orientation",
+        # "quarter starts", "classes begin", "term ends"...
+        *[f"{noun} {verb}" for noun in _TERM_NOUNS for verb in _TERM_VERBS],
+        # Tên tháng đầy đủ (trừ "may" - quá dễ nhầm với động từ); tên viết tắt / "may" chỉ khi có ngày, xem INTENT_PATTERNS
+        "january", "february", "march", "april", "june", "july", "august", "september", "october",
+        "november", "december",
+    ],
+    "buildings": [
+        "building", "buildings", "bldg", "where is", "where's", "located", "location of", "campus map",
+        "how do i get to", "which floor", "floor", "room", "hall", "library", "parking",
+    ],
+}
+# Regex thô cho những gì lexicon (cụm từ cố định) không diễn đạt được
+INTENT_PATTERNS: Dict[str, List[str]] = {
+    # Tháng + ngày: "Dec 12", "mar. 3rd", "May 5" ("dec", "mar", "may" đứng một mình thì không tính)
+    "calendar": [r"(?:jan|feb|mar|apr|may|jun|jul|aug|sept?|oct|nov|dec)\.?\s+\d{1,2}(?:st|nd|rd|th)?"],
+}
+# Thứ tự ưu tiên khi số match bằng nhau
+INTENT_PRIORITY = ["transit", "buildings", "calendar"]
+
+
+def _compile(lexicons: Dict[str, List[str]], patterns: Dict[str, List[str]]) -> re.Pattern:
+    groups = []
+    for intent, terms in lexicons.items():
+        # Cụm dài trước để "link light rail" thắng "light rail"; khoảng trắng trong cụm khớp \s+
+        alts = sorted({r"\s+".join(re.escape(w) for w in t.split()) for t in terms}, key=len, reverse=True)
+        groups.append(f"(?P<{intent}>" + "|".join(patterns.get(intent, []) + alts) + ")")
+    return re.compile(r"\b(?:" + "|".join(groups) + r")\b", re.IGNORECASE)
+
+_INTENT_RGX = _compile(INTENT_LEXICONS, INTENT_PATTERNS)
+
+
+@dataclass
+class Route:
+    intents: List[str]                          # theo thứ tự thử handler (nhiều match trước)
+    matches: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def primary(self) -> str:
+        return self.intents[0] if self.intents else "rag"
+
+
+def route_question(question: str) -> Route:
+    """One regex pass over the question; intents ranked by number of lexicon hits, then priority."""
+    matches: Dict[str, List[str]] = {}
+    for m in _INTENT_RGX.finditer(question or ""):
+        matches.setdefault(m.lastgroup, []).append(m.group(0).lower())
+    ranked = sorted(matches, key=lambda i: (-len(matches[i]), INTENT_PRIORITY.index(i)))
+    return Route(intents=ranked, matches=matches)
+
+
+# ====== Dispatch ======
+Handler = Callable[[str, str, Route], Awaitable[Optional[dict]]]
+_HANDLERS: Dict[str, Handler] = {}
+routing_stats = Counter()   # "<intent>" -> số câu hỏi, "handled:<intent>" -> số câu trả lời không cần LLM
+
+def register(intent: str):
+    """Decorator: handler(school, question, route) -> answer dict, or None to fall through to RAG."""
+    def wrap(fn: Handler) -> Handler:
+        _HANDLERS[intent] = fn
+        return fn
+    return wrap
+
+@register("transit")
+async def _transit_handler(school: str, question: str, route: Route) -> Optional[dict]:
+    coords = transit.CAMPUS_COORDINATES.get(school)
+    if not coords:
+        logger.warning(f"No coordinates configured for school {school}, falling back to RAG for transit question.")
+        return None
+    transit_answer = await transit.get_transit_info(latitude=coords[0], longitude=coords[1])
+    if not transit_answer:
+        return None  # API lỗi hoặc không cấu hình -> fallback về RAG
+    return {"answer": transit_answer, "sources": [{"type": "api", "name": "Transit API"}]}
+
+
+# Structured data (data/<school>/normalized/*.json): đọc từ RAM, không cần retrieval/LLM
+@register("calendar")
+async def _calendar_handler(school: str, question: str, route: Route) -> Optional[dict]:
+    return structured.answer_calendar(school, question)
+
+@register("buildings")
+async def _buildings_handler(school: str, question: str, route: Route) -> Optional[dict]:
+    return structured.answer_building(school, question)
+
+
+async def answer(school: str, question: str) -> dict:
+    """Routes the question to the first intent handler that can answer it, otherwise to the RAG pipeline."""
+    t0 = time.perf_counter()
+    route = route_question(question)
+    routing_stats[route.primary] += 1
+    for intent in route.intents:
+        handler = _HANDLERS.get(intent)
+        if handler is None:
+            continue
+        result = await handler(school, question, route)
+        if result is not None:
+            routing_stats[f"handled:{intent}"] += 1
+            logger.info(f"[router] school={school} intent={intent} matches={route.matches} "
+                        f"handled_without_llm=True {(time.perf_counter() - t0) * 1000:.1f} ms")
+            return result
+    routing_stats["handled:rag"] += 1
+    logger.info(f"[router] school={school} intent={route.primary} matches={route.matches} handled_without_llm=False")
+    return await rag.answer_verified_async(school, question)
+
+
+def stats() -> dict:
+    total = sum(v for k, v in routing_stats.items() if not k.startswith("handled:"))
+    skipped = sum(v for k, v in routing_stats.items() if k.startswith("handled:") and k != "handled:rag")
+    return {
+        "questions": total,
+        "by_intent": {k: v for k, v in routing_stats.items() if not k.startswith("handled:")},
+        "handled_by": {k.split(":", 1)[1]: v for k, v in routing_stats.items() if k.startswith("handled:")},
+        "skipped_llm_ratio": round(skipped / total, 3) if total else 0.0,
+    }
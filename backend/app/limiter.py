@@ -0,0 +1,250 @@
+import os
+import time
+import math
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+BEDROCK_INITIAL_CONCURRENCY = int(os.getenv("BEDROCK_INITIAL_CONCURRENCY", "8"))
+BEDROCK_MIN_CONCURRENCY = int(os.getenv("BEDROCK_MIN_CONCURRENCY", "1"))
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", "64"))
+BEDROCK_LATENCY_TARGET = float(os.getenv("BEDROCK_LATENCY_TARGET", "0"))   # giây; >0: chậm hơn mức này cũng tính là quá tải
+BEDROCK_QUEUE_DEADLINE = float(os.getenv("BEDROCK_QUEUE_DEADLINE", "10"))  # giây chờ tối đa trước khi trả 503
+SCHOOL_RATE = float(os.getenv("SCHOOL_RATE", "5"))                         # request Bedrock / giây / trường
+SCHOOL_BURST = float(os.getenv("SCHOOL_BURST", "20"))
+
+_THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+                   "ModelNotReadyException", "ServiceQuotaExceededException"}
+
+
+class Overloaded(Exception):
+    """Request could not be admitted before its deadline -> caller should answer 503 + Retry-After."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def is_throttle_error(exc: Exception) -> bool:
+    """botocore ClientError for Bedrock throttling / capacity errors."""
+    response = getattr(exc, "response", None) or {}
+    code = response.get("Error", {}).get("Code")
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in _THROTTLE_CODES or status in (429, 503)
+
+
+class AIMDLimiter:
+    """
+    Client-side concurrency limit that adapts like TCP congestion control:
+    +1/limit per successful call made while the limit was in use (about +1 per round
+    of calls), x0.5 on a throttle or a call slower than the latency target, at most once
+    per observed call latency so one burst of throttles counts as a single signal.
+    Thread-safe: Bedrock calls run in worker threads.
+    """
+
+    def __init__(self, initial: int = BEDROCK_INITIAL_CONCURRENCY, min_limit: int = BEDROCK_MIN_CONCURRENCY,
+                 max_limit: int = BEDROCK_MAX_CONCURRENCY, latency_target: float = BEDROCK_LATENCY_TARGET,
+                 backoff: float = 0.5):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.latency_ewma = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttles = 0
+        self.rejected = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float = BEDROCK_QUEUE_DEADLINE):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise Overloaded("Bedrock concurrency limit reached", retry_after=max(1.0, timeout / 2))
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency: float, throttled: bool = False):
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.latency_ewma = latency if not self.latency_ewma else 0.8 * self.latency_ewma + 0.2 * latency
+            slow = self.latency_target > 0 and latency > self.latency_target
+            now = time.monotonic()
+            if throttled or slow:
+                if throttled:
+                    self.throttles += 1
+                if now - self._last_decrease >= self.latency_ewma:
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self._last_decrease = now
+                    logger.warning(f"Bedrock limiter backing off to {int(self.limit)} "
+                                   f"({'throttled' if throttled else f'slow call {latency:.1f}s'})")
+            elif saturated:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float = BEDROCK_QUEUE_DEADLINE):
+        self.acquire(timeout)
+        start = time.monotonic()
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            self.release(time.monotonic() - start, throttled=throttled)
+
+    def has_headroom(self) -> bool:
+        """True if a call could start right now without queueing (used to decide whether to hedge)."""
+        with self._cond:
+            return self.in_flight < int(self.limit) and not self.waiting
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "latency_ewma_ms": round(self.latency_ewma * 1000, 1),
+                "waiting": self.waiting,
+                "throttles": self.throttles,
+                "rejected": self.rejected,
+            }
+
+
+class BedrockWorkers:
+    """
+    Dedicated threads for blocking request-path Bedrock work (answer_verified), sized to the limiter's max so
+    the AIMD limit - not the loop's default executor (min(32, cpu+4) threads, shared with ingest/embedding) -
+    caps concurrency. Requests beyond the pool wait on the event loop, not in a thread, and get Overloaded
+    after `deadline` seconds.
+    """
+
+    def __init__(self, size: int = BEDROCK_MAX_CONCURRENCY, deadline: float = BEDROCK_QUEUE_DEADLINE):
+        self.size = max(1, size)
+        self.deadline = deadline
+        self._pool = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="bedrock")
+        self._lock = threading.Lock()
+        self._sem: asyncio.Semaphore | None = None
+        self._sem_loop = None
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Semaphore gắn với event loop; TestClient / script có thể chạy nhiều loop lần lượt
+        loop = asyncio.get_running_loop()
+        if self._sem_loop is not loop:
+            self._sem, self._sem_loop = asyncio.Semaphore(self.size), loop
+        return self._sem
+
+    async def run(self, fn, *args):
+        sem = self._semaphore()
+        with self._lock:
+            self.waiting += 1
+        try:
+            await asyncio.wait_for(sem.acquire(), self.deadline)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded("Bedrock workers busy", retry_after=max(1.0, self.deadline / 2))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.running += 1
+        try:
+            ctx = contextvars.copy_context()   # như asyncio.to_thread
+            return await asyncio.get_running_loop().run_in_executor(self._pool, ctx.run, fn, *args)
+        finally:
+            with self._lock:
+                self.running -= 1
+            sem.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "running": self.running, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Takes one token (possibly going into debt) and returns how long to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class SchoolAdmission:
+    """Per-school token buckets so one tenant's burst cannot use up Bedrock capacity for everyone."""
+
+    def __init__(self, rate: float = SCHOOL_RATE, burst: float = SCHOOL_BURST, deadline: float = BEDROCK_QUEUE_DEADLINE):
+        self.rate = rate
+        self.burst = burst
+        self.deadline = deadline
+        self._buckets: dict[str, TokenBucket] = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    async def admit(self, school: str):
+        """Waits for the school's token; raises Overloaded if the wait would exceed the deadline."""
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(school)
+        if bucket is None:
+            bucket = self._buckets[school] = TokenBucket(self.rate, self.burst)
+        wait = bucket.reserve()
+        if wait > self.deadline:
+            bucket.refund()
+            self.rejected += 1
+            raise Overloaded(f"Too many requests for school '{school}'", retry_after=wait)
+        self.admitted += 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "tokens": {school: round(b.tokens, 2) for school, b in self._buckets.items()},
+        }
+
+
+# Dùng chung cho toàn process
+bedrock_limiter = AIMDLimiter()
+bedrock_workers = BedrockWorkers()
+school_admission = SchoolAdmission()
@@ -1,8 +1,13 @@
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.deps import ENGINE, ALLOWED_ORIGINS
-from app.models import Base
+from app.deps import ENGINE, ASYNC_ENGINE, ALLOWED_ORIGINS, db_writer
+from app.fetch import close_http_client
+from app.transit import start_transit_refresher, stop_transit_refresher
+from app.pwhash import password_hasher
+from app.events import ticket_events
+from app.registry import school_registry
+from app.migrations import init_schema
 from app.auth import router as auth_router
 from app.routers.admin import router as admin_router
 from app.routers.forms import router as forms_router
@@ -12,8 +17,6 @@ from app.routers.health import router as health_router
 from app.routers import schools
 from app.routers import dev
 
-Base.metadata.create_all(bind=ENGINE)
-
 app = FastAPI(title="Scholask Backend")
 
 app.add_middleware(
@@ -22,6 +25,7 @@ app.add_middleware(
     allow_credentials=True,   
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # cursor trang tiếp theo của các API danh sách
 )
 
 app.include_router(health_router)
@@ -33,6 +37,27 @@ app.include_router(tickets_router)
 app.include_router(schools.router)
 app.include_router(dev.router)
 
+@app.on_event("startup")
+async def _startup():
+    # Tạo bảng + versioned migrations (app/migrations.py) lúc startup, không phải lúc import module
+    init_schema(ENGINE)
+    school_registry.load()
+    await start_transit_refresher()
+    password_hasher.start()
+    if db_writer is not None:
+        db_writer.start()
+    await ticket_events.start()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await ticket_events.stop()
+    await stop_transit_refresher()
+    await close_http_client()
+    password_hasher.shutdown()
+    if db_writer is not None:
+        db_writer.shutdown()
+    await ASYNC_ENGINE.dispose()
+
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
@@ -0,0 +1,150 @@
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Sequence
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Versioned schema migrations, chạy được trên cả SQLite lẫn Postgres (không dùng PRAGMA).
+# create_all() chỉ tạo bảng/index còn thiếu cho DB mới; DB đã có dữ liệu được nâng cấp ở đây.
+# Mỗi migration idempotent (IF NOT EXISTS / kiểm tra qua inspector) và được ghi vào schema_migrations.
+#   python -m app.migrations            # áp dụng migration còn thiếu
+#   python -m app.migrations status
+# App chạy init_schema() lúc startup (không phải lúc import app.main: import không được sửa DB).
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    up: Callable[[Connection], None]
+
+
+def _columns(conn: Connection, table: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        logger.info(f"Added column {table}.{column}")
+
+def _create_index(conn: Connection, name: str, table: str, cols: Sequence[str]):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(cols)})"))
+
+def _drop_index(conn: Connection, name: str):
+    conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+# ====== Migrations ======
+def _0001_ticket_links(conn: Connection):
+    """Columns that one_off_migrate.py used to add to pre-existing service_tickets tables."""
+    _add_column(conn, "service_tickets", "user_id", "INTEGER")
+    _add_column(conn, "service_tickets", "form_submission_id", "INTEGER")
+    _add_column(conn, "service_tickets", "updated_at", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+
+
+# Index khớp đúng access path của các API danh sách: filter bằng nhau trước, rồi (created_at, id) cho keyset.
+# Giữ đồng bộ với __table_args__ trong app/models.py.
+COMPOSITE_INDEXES = [
+    # /admin/tickets (school [+ status] [+ department]), /tickets/{department}
+    ("ix_service_tickets_school_created", "service_tickets", ["school_id", "created_at", "id"]),
+    ("ix_service_tickets_school_status_created", "service_tickets", ["school_id", "status", "created_at", "id"]),
+    ("ix_service_tickets_school_dept_created", "service_tickets", ["school_id", "department", "created_at", "id"]),
+    ("ix_service_tickets_school_status_dept_created", "service_tickets", ["school_id", "status", "department", "created_at", "id"]),
+    # /admin/documents
+    ("ix_documents_school_created", "documents", ["school_id", "created_at", "id"]),
+    # /forms/my-submissions (có user / ẩn danh)
+    ("ix_form_submissions_school_user_created", "form_submissions", ["school_id", "user_id", "created_at", "id"]),
+    ("ix_form_submissions_school_created", "form_submissions", ["school_id", "created_at", "id"]),
+    # ticket detail: messages theo ticket, thứ tự id
+    ("ix_messages_ticket_id_id", "messages", ["ticket_id", "id"]),
+]
+# Index 1 cột đã nằm trong prefix của index composite ở trên -> chỉ tốn ghi
+SUPERSEDED_INDEXES = [
+    "ix_service_tickets_school_id", "ix_service_tickets_status", "ix_service_tickets_department",
+    "ix_documents_school_id", "ix_form_submissions_school_id", "ix_messages_ticket_id",
+]
+
+def _0002_composite_indexes(conn: Connection):
+    for name, table, cols in COMPOSITE_INDEXES:
+        _create_index(conn, name, table, cols)
+    for name in SUPERSEDED_INDEXES:
+        _drop_index(conn, name)
+    # users.email: UNIQUE đã tạo index (sqlite_autoindex / users_email_key), không cần thêm
+
+
+def _0003_submission_client_key(conn: Connection):
+    """Idempotency key for /forms/offline/sync: one submission per (school, client_key)."""
+    _add_column(conn, "form_submissions", "client_key", "VARCHAR(128)")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_form_submissions_school_client_key "
+        "ON form_submissions (school_id, client_key)"
+    ))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "ticket_links", _0001_ticket_links),
+    Migration(2, "composite_indexes", _0002_composite_indexes),
+    Migration(3, "submission_client_key", _0003_submission_client_key),
+]
+
+
+# ====== Runner ======
+def _ensure_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+
+def applied_versions(engine: Engine) -> set:
+    _ensure_table(engine)
+    with engine.connect() as conn:
+        return {r[0] for r in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def upgrade(engine: Engine) -> List[int]:
+    """Applies pending migrations in version order, each in its own transaction. Returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for m in sorted(MIGRATIONS, key=lambda m: m.version):
+        if m.version in done:
+            continue
+        try:
+            with engine.begin() as conn:
+                if conn.dialect.name == "postgresql":
+                    # Nhiều worker khởi động cùng lúc -> chỉ 1 worker chạy migration này
+                    conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": 0x5C401A5C})
+                    if conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = :v"), {"v": m.version}).first():
+                        continue
+                m.up(conn)
+                conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                             {"v": m.version, "n": m.name})
+        except IntegrityError:
+            # SQLite: worker khác vừa ghi cùng version (DDL đều idempotent)
+            logger.info(f"Migration {m.version:04d}_{m.name} already applied by another process.")
+            continue
+        logger.info(f"Applied migration {m.version:04d}_{m.name}")
+        applied.append(m.version)
+    return applied
+
+
+def init_schema(engine: Engine) -> List[int]:
+    """create_all() for a new DB, then the pending migrations. Returns the versions applied."""
+    from app.models import Base  # app.models import module này (COMPOSITE_INDEXES)
+    Base.metadata.create_all(bind=engine)
+    return upgrade(engine)
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    from app.deps import ENGINE
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        done = applied_versions(ENGINE)
+        for m in MIGRATIONS:
+            print(f"{m.version:04d}_{m.name:24} {'applied' if m.version in done else 'pending'}")
+    else:
+        print("Applied:", init_schema(ENGINE) or "nothing (up to date)")
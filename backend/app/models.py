@@ -1,6 +1,7 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Text, JSON, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, JSON, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.sql import func
+from app.migrations import COMPOSITE_INDEXES
 
 Base = declarative_base()
 
@@ -38,7 +39,7 @@ class User(Base):
 class Document(Base):
     __tablename__ = "documents"
     id = Column(Integer, primary_key=True)
-    school_id = Column(Integer, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False, index=True)
+    school_id = Column(Integer, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False)
     
     file_name = Column(String) 
     source_type = Column(String, nullable=False)
@@ -83,11 +84,17 @@ class FormSubmission(Base): # Thêm relationship ngược lại User, School, Fo
     id = Column(Integer, primary_key=True)
     form_id = Column(Integer, ForeignKey("forms.id", ondelete="SET NULL"), nullable=True) 
     user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True) 
-    school_id = Column(Integer, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False, index=True) 
+    school_id = Column(Integer, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False) 
     payload_json = Column(JSON, nullable=False)
     status = Column(String, default="submitted", index=True)
+    client_key = Column(String(128), nullable=True)   # idempotency key do client sinh (offline sync), NULL = form thường
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # NULL không đụng nhau -> chỉ ràng buộc các submission có client_key
+        Index("ux_form_submissions_school_client_key", "school_id", "client_key", unique=True),
+    )
+
     # Relationships
     form = relationship("Form", back_populates="submissions")
     submitter = relationship("User", back_populates="submissions")
@@ -97,13 +104,13 @@ class FormSubmission(Base): # Thêm relationship ngược lại User, School, Fo
 class ServiceTicket(Base): # Thêm relationship ngược lại User, School, FormSubmission
     __tablename__ = "service_tickets"
     id = Column(Integer, primary_key=True)
-    school_id = Column(Integer, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False, index=True)
+    school_id = Column(Integer, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True) # ID người tạo
     form_submission_id = Column(Integer, ForeignKey("form_submissions.id", ondelete="SET NULL"), unique=True, nullable=True, index=True) # Liên kết submission (cho phép null)
 
-    department = Column(String, index=True)
+    department = Column(String)
     title = Column(String)
-    status = Column(String, default="Open", index=True)
+    status = Column(String, default="Open")
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
@@ -117,7 +124,7 @@ class ServiceTicket(Base): # Thêm relationship ngược lại User, School, For
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True)
-    ticket_id = Column(Integer, ForeignKey("service_tickets.id", ondelete="CASCADE"), nullable=False, index=True)
+    ticket_id = Column(Integer, ForeignKey("service_tickets.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False) # ID của người gửi (student hoặc staff)
     text = Column(Text, nullable=False)
     is_internal = Column(Boolean, default=False) 
@@ -126,3 +133,8 @@ class Message(Base):
     # Relationships
     ticket = relationship("ServiceTicket", back_populates="messages")
     author = relationship("User", back_populates="messages_sent") 
+
+# Composite index theo access path của các API danh sách (school_id, [filter], created_at, id).
+# Định nghĩa 1 lần ở app/migrations.py: create_all dùng cho DB mới, migration 0002 cho DB đã có.
+for _name, _table, _cols in COMPOSITE_INDEXES:
+    Index(_name, *(Base.metadata.tables[_table].c[c] for c in _cols))
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from app.limiter import Overloaded
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+# Argon2 cố ý tốn CPU: chạy ở process pool riêng để login storm không chiếm CPU của chat
+PWHASH_WORKERS = int(os.getenv("PWHASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PWHASH_MAX_PENDING = int(os.getenv("PWHASH_MAX_PENDING", "32"))   # số job chờ tối đa (ngoài số đang chạy) trước khi trả 503
+PWHASH_RETRY_AFTER = float(os.getenv("PWHASH_RETRY_AFTER", "2"))
+
+# ====== Worker side (chạy trong process con) ======
+_ctx = None
+
+def _context():
+    global _ctx
+    if _ctx is None:
+        from passlib.context import CryptContext
+        _ctx = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+    return _ctx
+
+def _warm() -> int:
+    _context()
+    return os.getpid()
+
+def _hash_job(pw: str) -> Tuple[str, float, float]:
+    started = time.time()
+    result = _context().hash(pw)
+    return result, started, time.time() - started
+
+def _verify_job(pw: str, hashed: str) -> Tuple[bool, float, float]:
+    started = time.time()
+    try:
+        ok = _context().verify(pw, hashed)
+    except Exception:
+        ok = False   # hash hỏng / scheme lạ -> coi như sai mật khẩu
+    return ok, started, time.time() - started
+
+
+# ====== Caller side ======
+class PasswordHasher:
+    """
+    Size-limited ProcessPoolExecutor with admission control: at most `workers` jobs run and
+    `max_pending` wait; beyond that callers get Overloaded immediately instead of queueing.
+    """
+
+    def __init__(self, workers: int = PWHASH_WORKERS, max_pending: int = PWHASH_MAX_PENDING):
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.outstanding = 0
+        self.completed = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=500)     # giây chờ trong queue
+        self._services = deque(maxlen=500)  # giây chạy Argon2
+        self._done_at = deque(maxlen=500)   # thời điểm hoàn thành (tính throughput)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: không fork process đang có thread (uvicorn, boto3, ...)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def start(self):
+        """Spawns and warms the workers so the first login does not pay process start-up."""
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(_warm)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.outstanding >= self.workers + self.max_pending:
+                self.rejected += 1
+                raise Overloaded("Password hashing queue is full", retry_after=PWHASH_RETRY_AFTER)
+            self.outstanding += 1
+        submitted = time.time()
+        pool = self._get_pool()
+        try:
+            result, started, service = await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # Worker chết (OOM, bị kill...) -> bỏ pool hỏng, lần gọi sau spawn pool mới
+            logger.error("Password hashing pool is broken, recreating it on next use.")
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            with self._lock:
+                self.outstanding -= 1
+        with self._lock:
+            self.completed += 1
+            self._waits.append(max(0.0, started - submitted))
+            self._services.append(service)
+            self._done_at.append(time.monotonic())
+        return result
+
+    async def hash(self, pw: str) -> str:
+        return await self._run(_hash_job, pw)
+
+    async def verify(self, pw: str, hashed: str) -> bool:
+        return await self._run(_verify_job, pw, hashed)
+
+    def stats(self) -> dict:
+        def pct(vals, p):
+            vals = sorted(vals)
+            return round(vals[min(len(vals) - 1, int(round(p / 100 * (len(vals) - 1))))] * 1000, 1) if vals else None
+        with self._lock:
+            waits, services, done = list(self._waits), list(self._services), list(self._done_at)
+            running = min(self.outstanding, self.workers)
+            out = {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "running": running,
+                "queued": self.outstanding - running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+        span = done[-1] - done[0] if len(done) > 1 else 0
+        out.update({
+            "wait_p50_ms": pct(waits, 50), "wait_p95_ms": pct(waits, 95),
+            "service_p50_ms": pct(services, 50), "service_p95_ms": pct(services, 95),
+            "throughput_per_s": round((len(done) - 1) / span, 2) if span > 0 else None,
+        })
+        return out
+
+
+password_hasher = PasswordHasher()
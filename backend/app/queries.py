@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import base64
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, func, tuple_, case, event, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import ServiceTicket, FormSubmission, User, Message
+from app.deps import on_commit
+
+# Read-side queries dùng chung giữa các router (AsyncSession, xem deps.get_async_db).
+# Chỉ select đúng các cột cần trả về (không load ORM object / lazy relationship) -> số query cố định.
+
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+
+async def ticket_detail(db: AsyncSession, ticket_id: int, school_id: Optional[int] = None) -> Optional[Tuple[Optional[int], dict]]:
+    """
+    (requester user_id, detail dict) for one ticket in exactly two queries: the ticket joined with its
+    requester email and submission payload, then its messages. None if the ticket does not exist.
+    """
+    q = (
+        select(
+            ServiceTicket.id, ServiceTicket.user_id, ServiceTicket.title, ServiceTicket.department,
+            ServiceTicket.status, ServiceTicket.created_at, ServiceTicket.updated_at,
+            User.email.label("requester_email"), FormSubmission.payload_json,
+        )
+        .outerjoin(User, User.id == ServiceTicket.user_id)
+        .outerjoin(FormSubmission, FormSubmission.id == ServiceTicket.form_submission_id)
+        .where(ServiceTicket.id == ticket_id)
+    )
+    if school_id is not None:
+        q = q.where(ServiceTicket.school_id == school_id)
+    t = (await db.execute(q)).first()
+    if t is None:
+        return None
+
+    messages = (await db.execute(
+        select(Message.id, Message.user_id, Message.text, Message.is_internal, Message.created_at)
+        .where(Message.ticket_id == ticket_id)
+        .order_by(Message.id)
+    )).all()
+    return t.user_id, {
+        "id": t.id,
+        "title": t.title,
+        "department": t.department,
+        "status": t.status,
+        "created_at": _iso(t.created_at),
+        "updated_at": _iso(t.updated_at),
+        "requester_email": t.requester_email,
+        "payload_json": t.payload_json,
+        "messages": [{
+            "id": m.id,
+            "user_id": m.user_id,
+            "staff_id": None,  # messages không có cột staff_id; người gửi (student hoặc staff) nằm ở user_id
+            "text": m.text,
+            "is_internal": m.is_internal,
+            "created_at": _iso(m.created_at),
+        } for m in messages],
+    }
+
+
+# ====== Keyset pagination ======
+# Sắp xếp (created_at DESC, id DESC); trang sau = các dòng "nhỏ hơn" dòng cuối trang trước.
+# Không dùng OFFSET -> trang thứ 1000 tốn như trang đầu (với index (…, created_at, id), xem user-045).
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "200"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: Optional[datetime], row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return (datetime.fromisoformat(ts) if ts else None), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+async def paginate(db: AsyncSession, q: Select, created_col, id_col, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """
+    One page of `q` in (created_at DESC, id DESC) order plus the cursor of the next page (None on the last page).
+    `q` may select ORM entities or columns, but each row must expose created_col/id_col by the same names.
+    """
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        # Lấy created_at của dòng mốc ngay trong DB: so sánh với giá trị đúng định dạng DB lưu
+        # (SQLite lưu CURRENT_TIMESTAMP không có microsecond, datetime bind từ Python thì có).
+        # Dòng mốc đã bị xoá -> dùng giá trị trong cursor.
+        anchor = select(created_col).where(id_col == row_id).scalar_subquery()
+        q = q.where(tuple_(created_col, id_col) < tuple_(func.coalesce(anchor, ts), row_id))
+    rows = (await db.execute(q.order_by(created_col.desc(), id_col.desc()).limit(limit + 1))).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(_attr(last, created_col), _attr(last, id_col))
+
+
+def _attr(row, col):
+    # Row của query nhiều entity (FormSubmission, ServiceTicket, ...) -> lấy entity đầu tiên
+    if not hasattr(row, col.key):
+        row = row[0]
+    return getattr(row, col.key)
+
+
+# ====== Ticket facets ======
+# Dashboard cần số ticket theo status / department / độ tuổi: 1 câu GROUP BY (index-only scan trên
+# ix_service_tickets_school_status_dept_created), cache ngắn theo trường, xoá khi ticket được tạo / đổi.
+TICKET_FACETS_TTL = float(os.getenv("TICKET_FACETS_TTL", "30"))
+AGE_BUCKETS = [("0-1d", 1), ("1-7d", 7), ("7-30d", 30)]   # còn lại: "30d+"
+
+
+class FacetCache:
+    def __init__(self, ttl: float = TICKET_FACETS_TTL):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[dict, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, school_id: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(school_id)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, school_id: int, facets: dict):
+        with self._lock:
+            self._entries[school_id] = (facets, time.monotonic())
+
+    def invalidate(self, school_id: Optional[int]):
+        with self._lock:
+            if self._entries.pop(school_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"schools": len(self._entries), "ttl_s": self.ttl, "hits": self.hits,
+                    "misses": self.misses, "invalidations": self.invalidations}
+
+
+ticket_facet_cache = FacetCache()
+
+
+# Ticket mới / đổi status, department / xoá -> counts của trường đó không còn đúng.
+# Xoá cache khi commit xong (deps.on_commit): xoá lúc flush thì request khác có thể cache lại counts cũ
+@event.listens_for(ServiceTicket, "after_insert")
+@event.listens_for(ServiceTicket, "after_update")
+@event.listens_for(ServiceTicket, "after_delete")
+def _invalidate_facets(mapper, connection, target):
+    school_id = target.school_id
+    on_commit(target, lambda: ticket_facet_cache.invalidate(school_id))
+
+
+async def ticket_facets(db: AsyncSession, school_id: int) -> dict:
+    """Counts by status, department and age bucket for one school (cached for TICKET_FACETS_TTL seconds)."""
+    cached = ticket_facet_cache.get(school_id)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    now = datetime.now(timezone.utc)
+    if db.get_bind().dialect.name == "sqlite":
+        now = now.replace(tzinfo=None)   # SQLite lưu CURRENT_TIMESTAMP dạng UTC không timezone
+    age = case(
+        *[(ServiceTicket.created_at >= now - timedelta(days=days), label) for label, days in AGE_BUCKETS],
+        else_="30d+",
+    ).label("age")
+    rows = (await db.execute(
+        select(ServiceTicket.status, ServiceTicket.department, age, func.count().label("n"))
+        .where(ServiceTicket.school_id == school_id)
+        .group_by(ServiceTicket.status, ServiceTicket.department, age)
+    )).all()
+
+    by_status: Dict[str, int] = {}
+    by_department: Dict[str, int] = {}
+    by_age: Dict[str, int] = {label: 0 for label, _ in AGE_BUCKETS}
+    by_age["30d+"] = 0
+    cells = []
+    for status, department, bucket, n in rows:
+        by_status[status] = by_status.get(status, 0) + n
+        by_department[department] = by_department.get(department, 0) + n
+        by_age[bucket] += n
+        cells.append({"status": status, "department": department, "age": bucket, "count": n})
+
+    facets = {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "by_department": by_department,
+        "by_age": by_age,
+        "cells": cells,   # status x department x age: client lọc kết hợp mà không cần gọi lại
+        "computed_at": now.replace(tzinfo=None).isoformat() + "Z",
+    }
+    ticket_facet_cache.put(school_id, facets)
+    return {**facets, "cached": False}
@@ -2,13 +2,25 @@ import os
 import io
 import re
 import json
+import codecs
+import asyncio
 import logging 
+import tempfile
+import threading
+import time
 import numpy as np
-from typing import List, Tuple, Optional
+from collections import Counter
+from typing import List, Tuple, Optional, Iterable, Iterator
 from pypdf import PdfReader
 from dotenv import load_dotenv
 from textwrap import shorten
 from fastapi import HTTPException
+from app import fetch
+from app.singleflight import SingleFlight
+from app.limiter import bedrock_limiter, bedrock_workers, school_admission, Overloaded, BEDROCK_MAX_CONCURRENCY
+from app.hedge import Hedger, DeadlineExceeded
+from app.breaker import CircuitBreaker, CircuitOpen
+from app.registry import school_registry
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO) 
@@ -31,17 +43,25 @@ REGION     = os.getenv("BEDROCK_REGION", "us-west-2")
 EMBED_ID   = os.getenv("BEDROCK_EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
 CLAUDE_ID  = os.getenv("BEDROCK_CLAUDE_MODEL_ID", "anthropic.claude-3-5-sonnet-20240620-v1:0")
 OFFLINE    = os.getenv("OFFLINE_MODE", "0") == "1"
+ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL") or None # vd. http://127.0.0.1:8899 (scripts/fake_bedrock.py)
 
 # Regex để chunk text (giữ nguyên)
 _CHUNK_RGX = re.compile(r"(?s).{1,1200}(?:\n|$)") # Khoảng 1200 ký tự mỗi chunk
 
+# Upload streaming: đọc theo block, spool ra đĩa khi vượt ngưỡng RAM
+UPLOAD_READ_SIZE = int(os.getenv("UPLOAD_READ_SIZE", str(1024 * 1024)))       # 1 MB mỗi lần đọc
+UPLOAD_SPOOL_MAX = int(os.getenv("UPLOAD_SPOOL_MAX", str(8 * 1024 * 1024)))   # > 8 MB thì ghi ra file tạm
+
 # Bedrock client (chỉ khởi tạo nếu không offline)
 _br = None
 if not OFFLINE:
     try:
         import boto3
-        _br = boto3.client("bedrock-runtime", region_name=REGION)
-        logger.info(f"Bedrock client initialized for region {REGION}.")
+        from botocore.config import Config
+        # Pool HTTP phải đủ lớn cho giới hạn concurrency của limiter (mặc định boto3 chỉ 10)
+        _br = boto3.client("bedrock-runtime", region_name=REGION, endpoint_url=ENDPOINT_URL,
+                           config=Config(max_pool_connections=BEDROCK_MAX_CONCURRENCY))
+        logger.info(f"Bedrock client initialized for region {REGION}" + (f" (endpoint {ENDPOINT_URL})." if ENDPOINT_URL else "."))
     except ImportError:
         logger.error("boto3 not installed. Cannot use Bedrock online mode.")
         _br = None # Đảm bảo _br là None nếu import lỗi
@@ -60,23 +80,78 @@ else:
         # Cần xử lý lỗi này nếu offline là bắt buộc
 
 # ====== IO helpers ======
+async def _spool_upload(file) -> tempfile.SpooledTemporaryFile:
+    """Copies an UploadFile into a spooled temp file block by block (never the whole body in RAM)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX)
+    total = 0
+    try:
+        while True:
+            block = await file.read(UPLOAD_READ_SIZE)
+            if not block:
+                break
+            spool.write(block)
+            total += len(block)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    logger.info(f"Spooled upload {getattr(file, 'filename', 'unknown_file')} ({total} bytes).")
+    return spool
+
+def iter_pdf_pages(stream) -> Iterator[str]:
+    """Yields the text of each PDF page, extracting every page exactly once."""
+    reader = PdfReader(stream)
+    for page_no, page in enumerate(reader.pages):
+        try:
+            page_text = page.extract_text() or ""
+        except Exception as e:
+            logger.warning(f"Could not extract text from PDF page {page_no}: {e}")
+            continue
+        if page_text.strip():
+            yield page_text
+
+def iter_text_blocks(stream, encoding: str = "utf-8") -> Iterator[str]:
+    """Decodes a binary stream incrementally, yielding blocks that end on a line break."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+    pending = ""
+    while True:
+        block = stream.read(UPLOAD_READ_SIZE)
+        pending += decoder.decode(block or b"", final=not block)
+        if not block:
+            break
+        cut = pending.rfind("\n")
+        if cut >= 0:
+            yield pending[:cut + 1]
+            pending = pending[cut + 1:]
+        elif len(pending) > 4 * UPLOAD_READ_SIZE:
+            # Không có xuống dòng (file 1 dòng rất dài) -> vẫn phải nhả ra để giới hạn bộ nhớ
+            yield pending
+            pending = ""
+    if pending:
+        yield pending
+
+def _iter_upload_parts(file_name: str, stream) -> Iterator[str]:
+    if file_name.lower().endswith(".pdf"):
+        logger.info("Detected PDF file, extracting text page by page...")
+        return iter_pdf_pages(stream)
+    logger.info("Detected non-PDF file, decoding as UTF-8.")
+    return iter_text_blocks(stream)
+
 async def load_content(file=None, text: str | None = None, url: str | None = None) -> str:
-    """Loads content from file (PDF/text), raw text, or URL (placeholder)."""
+    """Loads content from file (PDF/text), raw text, or URL."""
     if file is not None:
-        file_name = getattr(file, "filename", "unknown_file")
+        file_name = getattr(file, "filename", None) or "unknown_file"
         logger.info(f"Loading content from uploaded file: {file_name}")
         try:
-            data = await file.read()
-            name_lower = file_name.lower()
-            if name_lower.endswith(".pdf"):
-                logger.info("Detected PDF file, extracting text...")
-                reader = PdfReader(io.BytesIO(data))
-                extracted_text = "\n\n".join([p.extract_text() or "" for p in reader.pages if p.extract_text()])
-                logger.info(f"Extracted {len(extracted_text)} characters from PDF.")
-                return extracted_text
-            else: # Treat as plain text
-                 logger.info("Detected non-PDF file, decoding as UTF-8.")
-                 return data.decode("utf-8", errors="ignore")
+            spool = await _spool_upload(file)
+            try:
+                parts = _iter_upload_parts(file_name, spool)
+                sep = "\n\n" if file_name.lower().endswith(".pdf") else "" # Text blocks đã giữ nguyên xuống dòng
+                extracted_text = await asyncio.to_thread(lambda: sep.join(parts))
+            finally:
+                spool.close()
+            logger.info(f"Extracted {len(extracted_text)} characters from {file_name}.")
+            return extracted_text
         except Exception as e:
             logger.error(f"Error processing file {file_name}: {e}")
             return "" # Return empty string on error
@@ -84,27 +159,70 @@ async def load_content(file=None, text: str | None = None, url: str | None = Non
         logger.info(f"Loading content directly from text input (length: {len(text)}).")
         return text
     if url:
-        logger.warning(f"URL ingest ('{url}') is currently a placeholder. Returning URL string.")
-        # TODO: Implement actual URL fetching and parsing here for production
-        # Example using requests and BeautifulSoup (needs install):
-        # try:
-        #     import requests
-        #     from bs4 import BeautifulSoup
-        #     response = requests.get(url, timeout=10)
-        #     response.raise_for_status() # Raise error for bad responses (4xx, 5xx)
-        #     soup = BeautifulSoup(response.content, 'lxml') # or 'html.parser'
-        #     # Extract relevant text (e.g., main content, remove nav/footer)
-        #     main_content = soup.find('main') # Example selector
-        #     text_content = main_content.get_text(separator='\n', strip=True) if main_content else soup.get_text(separator='\n', strip=True)
-        #     logger.info(f"Fetched {len(text_content)} characters from URL.")
-        #     return text_content
-        # except Exception as e:
-        #     logger.error(f"Failed to fetch or parse URL {url}: {e}")
-        #     return ""
-        return f"Content from URL: {url}" # Placeholder
+        logger.info(f"Loading content from URL: {url}")
+        try:
+            fetched = await fetch.fetch_url(url)
+            return await asyncio.to_thread(lambda: "\n\n".join(_iter_fetched_parts(fetched)))
+        except fetch.FetchError as e:
+            logger.error(f"Failed to fetch URL {url}: {e}")
+            return ""
+        except Exception as e:
+            logger.error(f"Failed to parse URL {url}: {e}")
+            return ""
     logger.warning("load_content called with no file, text, or url.")
     return ""
 
+async def load_chunks(file=None, text: str | None = None, url: str | None = None) -> List[str]:
+    """
+    Like load_content + chunk_text, but uploads are streamed: the body is spooled to disk
+    and each PDF page / text block is chunked as soon as it is extracted.
+    """
+    if file is None:
+        return chunk_text(await load_content(text=text, url=url))
+
+    file_name = getattr(file, "filename", None) or "unknown_file"
+    logger.info(f"Streaming chunks from uploaded file: {file_name}")
+    try:
+        spool = await _spool_upload(file)
+        try:
+            parts = _iter_upload_parts(file_name, spool)
+            # Trích xuất PDF là CPU-bound -> chạy ngoài event loop
+            chunks = await asyncio.to_thread(lambda: list(iter_chunks(parts)))
+        finally:
+            spool.close()
+    except Exception as e:
+        logger.error(f"Error processing file {file_name}: {e}")
+        return []
+    logger.info(f"Split {file_name} into {len(chunks)} chunks.")
+    return chunks
+
+def _iter_fetched_parts(fetched: "fetch.FetchResult") -> Iterator[str]:
+    """Text of a cached URL body: PDF page by page, plain text by blocks, otherwise cleaned HTML."""
+    with open(fetched.path, "rb") as f:
+        if fetched.is_pdf:
+            yield from iter_pdf_pages(f)
+        elif fetched.is_text:
+            yield from iter_text_blocks(f)
+        else:
+            yield fetch.clean_html(f.read())
+
+async def load_fetched_chunks(fetched: "fetch.FetchResult") -> List[str]:
+    """Chunks the body of a URL already fetched into the local cache."""
+    chunks = await asyncio.to_thread(lambda: list(iter_chunks(_iter_fetched_parts(fetched))))
+    logger.info(f"Split {fetched.url} into {len(chunks)} chunks.")
+    return chunks
+
+def iter_chunks(parts: Iterable[str]) -> Iterator[str]:
+    """Chunks a stream of text parts (pages/blocks) lazily with the same regex as chunk_text."""
+    for part in parts:
+        part = (part or "").strip()
+        if not part:
+            continue
+        for m in _CHUNK_RGX.finditer(part):
+            chunk = m.group(0).strip()
+            if chunk:
+                yield chunk
+
 def chunk_text(content: str) -> List[str]:
     """Splits content into chunks based on regex."""
     content = (content or "").strip()
@@ -148,6 +266,46 @@ def _faiss_index_add(vectors: List[List[float]]):
         logger.error(f"Error building FAISS index: {e}")
         return None
 
+# Giới hạn tốc độ gọi Titan embed (calls/giây, 0 = không giới hạn) - dùng cho build batch
+EMBED_RATE_LIMIT = float(os.getenv("EMBED_RATE_LIMIT", "0"))
+_embed_rate_lock = threading.Lock()
+_embed_next_slot = 0.0
+
+def set_embed_rate_limit(calls_per_sec: float):
+    global EMBED_RATE_LIMIT
+    EMBED_RATE_LIMIT = max(0.0, float(calls_per_sec))
+
+def _embed_throttle():
+    """Blocks until the next embed call is allowed under EMBED_RATE_LIMIT."""
+    global _embed_next_slot
+    if EMBED_RATE_LIMIT <= 0:
+        return
+    with _embed_rate_lock:
+        now = time.monotonic()
+        slot = max(now, _embed_next_slot)
+        _embed_next_slot = slot + 1.0 / EMBED_RATE_LIMIT
+    if slot > now:
+        time.sleep(slot - now)
+
+bedrock_breaker = CircuitBreaker("bedrock")
+class QueryEmbedFailed(Exception):
+    pass
+
+degraded_answers = Counter()     # lý do -> số câu trả lời trích xuất thay cho Claude (deadline, circuit_open, error)
+retrieval_fallbacks = Counter()  # lý do -> số lần retrieve bằng BM25 thay cho vector search (câu trả lời vẫn có thể từ Claude)
+
+def _invoke_model(model_id: str, body: str) -> dict:
+    """invoke_model through the circuit breaker and the shared AIMD concurrency limiter; returns the decoded JSON body."""
+    with bedrock_breaker.guard() as started, bedrock_limiter.slot():
+        started()  # slow call = chỉ thời gian invoke_model, không tính thời gian chờ slot của limiter
+        response = _br.invoke_model(
+            modelId=model_id,
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+        )
+        return json.loads(response.get("body").read())
+
 def _bedrock_embed(texts: List[str]) -> List[List[float]]:
     """Embeds texts using AWS Bedrock Titan embedding model."""
     if not _br:
@@ -169,13 +327,8 @@ def _bedrock_embed(texts: List[str]) -> List[List[float]]:
                 continue
 
             body = json.dumps({"inputText": text_chunk.strip()}) # Dimensions parameter is often model-specific or optional for newer models
-            response = _br.invoke_model(
-                modelId=EMBED_ID,
-                body=body,
-                contentType="application/json",
-                accept="application/json",
-            )
-            response_body = json.loads(response.get("body").read())
+            _embed_throttle()
+            response_body = _invoke_model(EMBED_ID, body)
             embedding = response_body.get("embedding")
             if not embedding or not isinstance(embedding, list):
                  logger.warning(f"Could not extract embedding for a chunk. Response: {response_body}")
@@ -185,14 +338,17 @@ def _bedrock_embed(texts: List[str]) -> List[List[float]]:
 
         logger.info(f"Successfully embedded {len(vectors)} chunks.")
         return vectors
+    except (Overloaded, CircuitOpen):
+        raise
     except Exception as e:
         logger.error(f"Error during Bedrock embedding: {e}")
         return [] # Return empty list on error
 
-async def embed_and_index(school: str, new_chunks: List[str]):
+async def embed_and_index(school: str, new_chunks: List[str], url: str | None = None):
     """
     Adds new chunks to the school's index.
     Loads existing data, appends new chunks, re-embeds ALL, and saves index and chunk files.
+    `url` (if given) is stored in the metadata of the new chunks so citations can link to it.
     """
     if not new_chunks:
         logger.warning(f"No new chunks provided for indexing school {school}.")
@@ -257,7 +413,7 @@ async def embed_and_index(school: str, new_chunks: List[str]):
     logger.info(f"Appending {len(new_chunks)} new chunks (starting at index {start_index}).")
     all_chunks.extend(new_chunks)
     # Tạo metadata cho các chunk MỚI, bắt đầu từ start_index
-    new_metas = [{"i": start_index + i, "text": chunk[:200], "url": None} # Giữ url=None tạm thời
+    new_metas = [{"i": start_index + i, "text": chunk[:200], "url": url}
                  for i, chunk in enumerate(new_chunks)]
     all_metas.extend(new_metas)
     logger.info(f"Total chunks to process for {school}: {len(all_chunks)}")
@@ -380,8 +536,44 @@ def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     # Compute dot product (cosine similarity for normalized vectors)
     return a_norm @ b_norm.T
 
-def search(school: str, query: str, k: int = 8) -> Tuple[List[str], List[dict]]:
-    """Retrieves top-k relevant chunks for a query from the school's index."""
+# MMR (Maximal Marginal Relevance): chọn k kết quả đa dạng từ fetch_k ứng viên
+SEARCH_MMR = os.getenv("SEARCH_MMR", "0") == "1"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))          # 1.0 = chỉ relevance, 0.0 = chỉ diversity
+MMR_FETCH_FACTOR = int(os.getenv("MMR_FETCH_FACTOR", "4"))  # fetch_k = k * factor
+
+def mmr_select(query_vec: np.ndarray, cand_vecs: np.ndarray, k: int, lam: float = MMR_LAMBDA) -> List[int]:
+    """
+    Greedy MMR over candidate vectors already in memory.
+    Returns positions into cand_vecs, most relevant first. Vectors need not be normalized.
+    One (n x n) similarity matrix, then k vectorized O(n) steps.
+    """
+    n = cand_vecs.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    C = cand_vecs / (np.linalg.norm(cand_vecs, axis=1, keepdims=True) + 1e-9)
+    q = query_vec.reshape(-1) / (np.linalg.norm(query_vec) + 1e-9)
+    relevance = C @ q
+    pairwise = C @ C.T
+
+    selected = [int(np.argmax(relevance))]
+    max_sim = pairwise[selected[0]].copy()  # độ giống lớn nhất với tập đã chọn
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, n) - 1):
+        mmr = lam * relevance - (1.0 - lam) * max_sim
+        mmr[~available] = -np.inf
+        nxt = int(np.argmax(mmr))
+        selected.append(nxt)
+        available[nxt] = False
+        np.maximum(max_sim, pairwise[nxt], out=max_sim)
+    return selected
+
+def search(school: str, query: str, k: int = 8, mmr: bool | None = None) -> Tuple[List[str], List[dict]]:
+    """
+    Retrieves top-k relevant chunks for a query from the school's index.
+    With mmr=True (default: SEARCH_MMR) a wider candidate set is re-ranked with MMR for diversity.
+    """
+    use_mmr = SEARCH_MMR if mmr is None else mmr
     school_index_dir = os.path.join(INDEX_DIR, school)
     chunks_path = os.path.join(school_index_dir, "chunks.json")
 
@@ -404,6 +596,7 @@ def search(school: str, query: str, k: int = 8) -> Tuple[List[str], List[dict]]:
     logger.info(f"Searching index for '{query}' in school {school} (k={k}). Mode: {'Offline' if OFFLINE else 'Online'}")
     
     idx: List[int] = [] # List of indices of the top-k chunks
+    scores: List[float] = [] # Cosine similarity của từng kết quả (cùng thứ tự với idx)
 
     try:
         if OFFLINE:
@@ -430,7 +623,11 @@ def search(school: str, query: str, k: int = 8) -> Tuple[List[str], List[dict]]:
             # Get indices of top-k scores (descending)
             # Ensure k is not larger than the number of chunks
             actual_k = min(k, len(chunks)) 
-            idx = np.argsort(-similarities)[:actual_k].tolist() 
+            fetch_k = min(len(chunks), k * MMR_FETCH_FACTOR) if use_mmr else actual_k
+            idx = np.argsort(-similarities)[:fetch_k].tolist() 
+            if use_mmr and len(idx) > actual_k:
+                idx = [idx[p] for p in mmr_select(query_vector, X[idx], actual_k)]
+            scores = similarities[idx].tolist()
             logger.info(f"Offline search results (indices): {idx}")
 
         else: # Online (FAISS + Bedrock)
@@ -445,17 +642,31 @@ def search(school: str, query: str, k: int = 8) -> Tuple[List[str], List[dict]]:
             query_vector_list = _bedrock_embed([query]) # Embed query
             if not query_vector_list:
                 logger.error("Failed to embed query.")
-                return [], []
+                raise QueryEmbedFailed()
             
             query_vector = np.array(query_vector_list).astype("float32")
             faiss.normalize_L2(query_vector) # Normalize query vector
             
             # Ensure k is not larger than the index size
             actual_k = min(k, index.ntotal) 
-            distances, indices = index.search(query_vector, actual_k) # Perform search
+            fetch_k = min(index.ntotal, k * MMR_FETCH_FACTOR) if use_mmr else actual_k
+            distances, indices = index.search(query_vector, fetch_k) # Perform search
             idx = indices[0].tolist() # Get indices
+            scores = distances[0].tolist() # Inner product trên vector đã normalize = cosine
+            if use_mmr and len(idx) > actual_k:
+                cand_vecs = np.vstack([index.reconstruct(int(i)) for i in idx]) # IndexFlat giữ nguyên vector
+                picked = mmr_select(query_vector, cand_vecs, actual_k)
+                idx = [idx[p] for p in picked]
+                scores = [scores[p] for p in picked]
             logger.info(f"Online search results (indices): {idx}, Distances: {distances[0].tolist()}")
     
+    except (CircuitOpen, QueryEmbedFailed):
+        # Bedrock đang lỗi: không embed được query -> xếp hạng bằng BM25 trên cùng các chunk
+        logger.warning(f"Bedrock unavailable, using local BM25 retrieval for {school}.")
+        idx, scores = bm25_search(school, chunks, query, k)
+        retrieval_fallbacks["bm25"] += 1
+    except Overloaded:
+        raise
     except ImportError as e:
          logger.error(f"Missing library required for search mode ({'Offline' if OFFLINE else 'Online'}): {e}")
          return [], []
@@ -465,11 +676,11 @@ def search(school: str, query: str, k: int = 8) -> Tuple[List[str], List[dict]]:
 
     # Retrieve chunks and metadata based on indices
     hits, sources = [], []
-    for i in idx:
+    for i, score in zip(idx, scores):
         if 0 <= i < len(chunks):
             hits.append(chunks[i])
             # Ensure metadata matches the index structure used in enumerate_context
-            sources.append(metas[i]) 
+            sources.append({**metas[i], "score": round(float(score), 4)})
         else:
              logger.warning(f"Search returned invalid index {i} (out of bounds for {len(chunks)} chunks).")
 
@@ -493,6 +704,161 @@ def _enumerate_context_for_citation(chunks: List[str], metas: List[dict]) -> str
     return "\n\n---\n\n".join(parts) # Use clearer separator
 
 
+# ====== Context Packing (token budget) ======
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))          # 0 = tắt packing, dùng nguyên top-k
+CONTEXT_MIN_SCORE_RATIO = float(os.getenv("CONTEXT_MIN_SCORE_RATIO", "0.6"))    # bỏ chunk có score < top * ratio
+CONTEXT_DEDUP_JACCARD = float(os.getenv("CONTEXT_DEDUP_JACCARD", "0.8"))        # chunk trùng lặp >= ngưỡng này bị bỏ
+CONTEXT_MIN_CHUNK_TOKENS = 60                                                   # không cắt chunk nhỏ hơn mức này
+
+_WORD_RGX = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_SPLIT_RGX = re.compile(r"(?<=[.!?])\s+|\n+")
+_STOPWORDS = frozenset(
+    "a an the and or of to in on for at by with from is are was were be been do does did what when where which who "
+    "how can i my me we our you your it its this that these those as about into there their will would should".split()
+)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for Claude on English text)."""
+    return (len(text) + 3) // 4 if text else 0
+
+def _terms(text: str) -> set:
+    return {w for w in _WORD_RGX.findall(text.lower()) if len(w) > 2 and w not in _STOPWORDS}
+
+def _shingles(text: str, n: int = 5) -> set:
+    words = _WORD_RGX.findall(text.lower())
+    if len(words) <= n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def _trim_to_best_sentences(text: str, query_terms: set, max_tokens: int) -> str:
+    """Keeps the sentences sharing the most terms with the query (in original order) within max_tokens."""
+    sentences = [x.strip() for x in _SENTENCE_SPLIT_RGX.split(text) if x and x.strip()]
+    if len(sentences) <= 1:
+        return text[: max_tokens * 4]
+    ranked = sorted(range(len(sentences)), key=lambda j: (-len(_terms(sentences[j]) & query_terms), j))
+    chosen, used = [], 0
+    for j in ranked:
+        cost = estimate_tokens(sentences[j]) + 1
+        if used + cost > max_tokens:
+            continue
+        chosen.append(j)
+        used += cost
+    if not chosen:
+        return sentences[ranked[0]][: max_tokens * 4]
+    return " ".join(sentences[j] for j in sorted(chosen))
+
+def pack_context(chunks: List[str], metas: List[dict], question: str,
+                 budget_tokens: int | None = None) -> Tuple[List[str], List[dict], dict]:
+    """
+    Shrinks retrieved chunks to fit a token budget:
+      1. drops chunks scoring below CONTEXT_MIN_SCORE_RATIO * best score,
+      2. drops near-duplicate chunks and sentences already present in a kept chunk,
+      3. trims each chunk to its best-matching sentences, sharing the budget evenly.
+    Metadata (and therefore the [#i] citation markers) stays paired with each chunk.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget_tokens is None else budget_tokens
+    tokens_before = sum(estimate_tokens(c) for c in chunks)
+    stats = {"chunks_before": len(chunks), "tokens_before": tokens_before,
+             "chunks_after": len(chunks), "tokens_after": tokens_before}
+    if budget <= 0 or not chunks:
+        return chunks, metas, stats
+
+    # 1) Ngưỡng thích ứng theo score cao nhất (chunk đầu luôn được giữ)
+    scores = [m.get("score") for m in metas]
+    candidates = list(zip(chunks, metas))
+    if all(isinstance(x, (int, float)) for x in scores) and max(scores) > 0:
+        threshold = max(scores) * CONTEXT_MIN_SCORE_RATIO
+        candidates = [cm for j, cm in enumerate(candidates) if j == 0 or scores[j] >= threshold]
+
+    # 2) Bỏ chunk gần trùng + câu lặp lại
+    kept, kept_shingles, seen_sentences = [], [], set()
+    for txt, meta in candidates:
+        sh = _shingles(txt)
+        if any(sh and len(sh & other) / len(sh | other) >= CONTEXT_DEDUP_JACCARD for other in kept_shingles):
+            continue
+        parts, dropped = [], False
+        for sent in (x.strip() for x in _SENTENCE_SPLIT_RGX.split(txt) if x):
+            key = " ".join(_WORD_RGX.findall(sent.lower()))
+            if key and key in seen_sentences:
+                dropped = True
+                continue
+            if key:
+                seen_sentences.add(key)
+                parts.append(sent)
+        if not parts:
+            continue
+        kept_shingles.append(sh)
+        kept.append((" ".join(parts) if dropped else txt, meta))
+
+    # 3) Chia ngân sách token; chunk vượt phần của nó thì cắt còn các câu khớp nhất
+    query_terms = _terms(question)
+    out_chunks, out_metas, remaining = [], [], budget
+    for j, (txt, meta) in enumerate(kept):
+        if remaining < CONTEXT_MIN_CHUNK_TOKENS:
+            break
+        share = max(CONTEXT_MIN_CHUNK_TOKENS, remaining // (len(kept) - j))
+        if estimate_tokens(txt) > share:
+            txt = _trim_to_best_sentences(txt, query_terms, share)
+        out_chunks.append(txt)
+        out_metas.append(meta)
+        remaining -= estimate_tokens(txt)
+
+    stats["chunks_after"] = len(out_chunks)
+    stats["tokens_after"] = sum(estimate_tokens(c) for c in out_chunks)
+    logger.info(f"Context packed: {stats['chunks_before']}->{stats['chunks_after']} chunks, "
+                f"~{stats['tokens_before']}->{stats['tokens_after']} tokens (budget {budget}).")
+    return out_chunks, out_metas, stats
+
+
+# ====== Lexical fallback (BM25) ======
+# Dùng khi Bedrock circuit mở. Index nằm trong RAM, build lại khi chunks.json của trường thay đổi.
+BM25_K1 = 1.5
+BM25_B = 0.75
+_bm25_cache: dict = {}  # school -> (index_version, Bm25Index)
+_bm25_lock = threading.Lock()
+
+def _bm25_terms(text: str) -> List[str]:
+    return [w for w in _WORD_RGX.findall(text.lower()) if w not in _STOPWORDS]
+
+class Bm25Index:
+    def __init__(self, chunks: List[str]):
+        postings: dict = {}
+        self.doc_len = np.zeros(len(chunks), dtype="float32")
+        for i, chunk in enumerate(chunks):
+            terms = _bm25_terms(chunk)
+            self.doc_len[i] = len(terms)
+            counts: dict = {}
+            for t in terms:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                ids, tfs = postings.setdefault(t, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        self.postings = {t: (np.array(ids), np.array(tfs, dtype="float32")) for t, (ids, tfs) in postings.items()}
+        self.n_docs = len(chunks)
+        self.avg_len = float(self.doc_len.mean()) if len(chunks) else 0.0
+
+    def top_k(self, query: str, k: int) -> Tuple[List[int], List[float]]:
+        scores = np.zeros(self.n_docs, dtype="float32")
+        for t in set(_bm25_terms(query)):
+            if t not in self.postings:
+                continue
+            ids, tfs = self.postings[t]
+            idf = np.log(1 + (self.n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[ids] / (self.avg_len or 1.0))
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+        top = [i for i in np.argsort(-scores)[:k].tolist() if scores[i] > 0]
+        return top, scores[top].tolist()
+
+def bm25_search(school: str, chunks: List[str], query: str, k: int) -> Tuple[List[int], List[float]]:
+    version = index_version(school)
+    with _bm25_lock:
+        cached = _bm25_cache.get(school)
+        if cached is None or cached[0] != version:
+            cached = _bm25_cache[school] = (version, Bm25Index(chunks))
+    return cached[1].top_k(query, k)
+
+
 # ====== LLM Generation ======
 
 # --- PERSONA & PROMPT DEFINITIONS ---
@@ -561,19 +927,31 @@ def _offline_verified_answer(chunks: List[str], metas: List[dict], question: str
     return {"answer": answer, "sources": used_metas}
 
 
-def retrieve_verified(school: str, question: str, k: int = 8) -> Tuple[List[str], List[dict], str]:
-    """Retrieves top-k chunks and formats them with citation markers for the LLM."""
+def retrieve_verified(school: str, question: str, k: int = 8,
+                      budget_tokens: int | None = None) -> Tuple[List[str], List[dict], str]:
+    """Retrieves top-k chunks, packs them into the token budget and formats them with citation markers."""
     chunks, metas = search(school, question, k=k)
+    chunks, metas, _ = pack_context(chunks, metas, question, budget_tokens)
     context_str = _enumerate_context_for_citation(chunks, metas)
     return chunks, metas, context_str
 
 
+claude_hedger = Hedger("claude")
+
+def _degraded_answer(chunks: List[str], metas: List[dict], question: str, reason: str) -> dict:
+    """Extractive answer from the retrieved chunks when Claude cannot answer (slow, failing or circuit open)."""
+    degraded_answers[reason] += 1
+    answer = _offline_verified_answer(chunks, metas, question)
+    answer["degraded"] = True
+    return answer
+
 def answer_verified(school: str, question: str) -> dict:
     """Generates an accurate, cited answer using Bedrock or offline fallback."""
-    # Format school name for prompts
-    pretty_school_name = school.replace('-', ' ').title()
+    # Tên trường thật từ registry (fallback: slug viết hoa)
+    pretty_school_name = school_registry.display_name(school)
 
     logger.info(f"Generating verified answer for '{question}' at school {school}.")
+    t_start = time.perf_counter()
     chunks, metas, context_str = retrieve_verified(school=school, question=question, k=8)
 
     if not chunks:
@@ -608,13 +986,8 @@ def answer_verified(school: str, question: str) -> dict:
             # "system": SCHOOL_PERSONA_PROMPT.format(school_name=pretty_school_name) + "\n" + ACCURACY_INSTRUCTIONS
         })
 
-        response = _br.invoke_model(
-            modelId=CLAUDE_ID,
-            body=body,
-            contentType="application/json",
-            accept="application/json",
-        )
-        response_body = json.loads(response.get("body").read())
+        # Hedge theo CLAUDE_HEDGE_DELAY (chỉ khi limiter còn chỗ), quá CLAUDE_DEADLINE -> DeadlineExceeded
+        response_body = claude_hedger.call(lambda: _invoke_model(CLAUDE_ID, body), can_hedge=bedrock_limiter.has_headroom)
         
         # Extract content safely
         answer_content = response_body.get("content", [])
@@ -624,17 +997,52 @@ def answer_verified(school: str, question: str) -> dict:
             logger.warning(f"Bedrock returned empty answer. Response body: {response_body}")
             answer = "I found some relevant information, but I couldn't formulate a specific answer. Please try rephrasing your question or check the sources provided."
 
-        logger.info(f"Generated answer length: {len(answer)}")
+        usage = response_body.get("usage", {})
+        logger.info(f"Generated answer length: {len(answer)}, prompt tokens: {usage.get('input_tokens', estimate_tokens(final_prompt))}, "
+                    f"output tokens: {usage.get('output_tokens', '?')}, latency: {(time.perf_counter() - t_start) * 1000:.0f} ms")
         # Return the answer and the metadata of the chunks used as context
         return {"answer": answer, "sources": metas}
 
+    except DeadlineExceeded as e:
+        # Model quá chậm: trả lời trích xuất từ các chunk đã retrieve thay vì bắt user chờ tiếp
+        logger.warning(f"{e}; serving degraded extractive answer for {school}.")
+        return _degraded_answer(chunks, metas, question, "deadline")
+    except CircuitOpen:
+        logger.warning(f"Bedrock circuit open; serving degraded extractive answer for {school}.")
+        return _degraded_answer(chunks, metas, question, "circuit_open")
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error invoking Bedrock model {CLAUDE_ID}: {e}")
-        # Fallback response on error
-        return {
-            "answer": "Sorry, I encountered an error while processing your request with the AI model. Please try again later.",
-            "sources": [] 
-        }
+        # Đã có chunks -> câu trả lời trích xuất vẫn hơn thông báo lỗi
+        return _degraded_answer(chunks, metas, question, "error")
+
+# ====== Request coalescing ======
+# Nhiều sinh viên hỏi cùng 1 câu cùng lúc (vd. sau thông báo deadline) -> chỉ 1 lần search + Bedrock
+answer_flight = SingleFlight("answer_verified")
+_SPACE_RGX = re.compile(r"\s+")
+
+def normalize_question(question: str) -> str:
+    return _SPACE_RGX.sub(" ", (question or "").lower()).strip().rstrip("?!. ")
+
+def index_version(school: str) -> int:
+    """Changes whenever the school's chunks.json is rewritten (0 if there is no index)."""
+    try:
+        return os.stat(os.path.join(INDEX_DIR, school, "chunks.json")).st_mtime_ns
+    except OSError:
+        return 0
+
+async def answer_verified_async(school: str, question: str) -> dict:
+    """answer_verified off the event loop, with identical concurrent questions sharing one computation."""
+    key = (school, normalize_question(question), index_version(school))
+
+    async def run():
+        if not OFFLINE:
+            await school_admission.admit(school)  # token bucket theo trường (chỉ leader tốn token)
+        # Thread riêng cho Bedrock (app.limiter.bedrock_workers), không chiếm default executor
+        return await bedrock_workers.run(answer_verified, school, question)
+
+    return await answer_flight.do(key, run)
 
 # ====== Compatibility Layer (nếu /chat/ask vẫn cần dùng logic cũ) ======
 async def ask_llm(question: str, context: str) -> str:
@@ -669,8 +1077,7 @@ Answer:"""
                "temperature": 0.2,
                "messages": [{"role": "user", "content": simple_prompt}]
           })
-          resp = _br.invoke_model(modelId=CLAUDE_ID, body=body, contentType="application/json", accept="application/json")
-          payload = json.loads(resp["body"].read())
+          payload = _invoke_model(CLAUDE_ID, body)
           answer = "".join(c.get("text","") for c in payload.get("content",[]) if c.get("type")=="text").strip()
           return answer or "I couldn't generate an answer based on the provided context."
      except Exception as e:
@@ -715,92 +1122,3 @@ def school_facts(school: str) -> List[dict]:
             facts.append({"title": title, "error": "Could not retrieve this information."})
     logger.info(f"Generated {len(facts)} initial facts.")
     return facts
-
-# ====== Transit Information (NEW SECTION) ======
-# Requires installing 'requests': pip install requests
-try:
-    import requests
-    TRANSIT_API_AVAILABLE = True
-except ImportError:
-    TRANSIT_API_AVAILABLE = False
-    logger.warning("`requests` library not installed. Transit API functionality will be disabled.")
-
-# Replace with the actual King County Metro API endpoint and potentially an API key if needed
-TRANSIT_API_URL = "YOUR_KING_COUNT_METRO_API_ENDPOINT" # e.g., GTFS-realtime feed or REST API
-TRANSIT_API_KEY = os.getenv("TRANSIT_API_KEY", None) # Optional: Store API key in .env
-
-# Define keywords to trigger transit lookup
-TRANSIT_KEYWORDS = ["bus", "transit", "route", "stop", "metro", "light rail", "schedule", "arrival", "departure"]
-
-def contains_transit_keyword(question: str) -> bool:
-    """Checks if the question contains transit-related keywords."""
-    return any(keyword in question.lower() for keyword in TRANSIT_KEYWORDS)
-
-def get_transit_info(latitude: float, longitude: float, radius_meters: int = 500) -> Optional[str]:
-    """
-    Fetches nearby transit stops and potentially real-time arrivals using an external API.
-    Replace coordinates with actual campus coordinates.
-    """
-    if not TRANSIT_API_AVAILABLE:
-        logger.warning("Cannot fetch transit info: `requests` library missing.")
-        return None
-    if not TRANSIT_API_URL or TRANSIT_API_URL == "YOUR_KING_COUNT_METRO_API_ENDPOINT":
-         logger.warning("Cannot fetch transit info: Transit API URL not configured.")
-         return None # API not configured
-
-    headers = {}
-    if TRANSIT_API_KEY:
-        headers["Authorization"] = f"Bearer {TRANSIT_API_KEY}" # Or appropriate auth scheme
-
-    # Example: Querying a hypothetical REST API for stops near coordinates
-    # You MUST adapt this to the actual King County Metro API structure
-    params = {
-        "lat": latitude,
-        "lon": longitude,
-        "radius": radius_meters,
-        "realtime": "true" # Optional: Request real-time data if supported
-    }
-    
-    try:
-        logger.info(f"Fetching transit info from API near ({latitude}, {longitude})")
-        response = requests.get(TRANSIT_API_URL, params=params, headers=headers, timeout=5) # 5 second timeout
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        
-        data = response.json()
-        
-        # --- FORMAT THE RESPONSE (CRITICAL - Adapt to actual API data) ---
-        # This is highly dependent on the API's response structure.
-        # Example: Assume API returns a list of stops with routes and arrivals
-        if not data or not isinstance(data, list):
-             return "No nearby transit information found via the API."
-
-        formatted_output = "Nearby Transit Options (Live data via API):\n"
-        for stop in data[:3]: # Limit to first 3 stops for brevity
-             stop_name = stop.get("name", "Unknown Stop")
-             routes = stop.get("routes", [])
-             formatted_output += f"\n📍 **{stop_name}**:\n"
-             if routes:
-                 for route in routes[:3]: # Limit routes per stop
-                     route_name = route.get("name", "N/A")
-                     arrivals = route.get("arrivals", []) # List of arrival times (strings or timestamps)
-                     arrival_times = ", ".join(arrivals[:2]) if arrivals else "No upcoming arrivals"
-                     formatted_output += f"  - Route {route_name}: {arrival_times}\n"
-             else:
-                 formatted_output += "  - No route information available.\n"
-        
-        return formatted_output.strip()
-        # --- END FORMATTING ---
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching transit data: {e}")
-        return "Sorry, I couldn't fetch live transit information at the moment."
-    except Exception as e:
-        logger.error(f"Error processing transit data: {e}")
-        return "Sorry, there was an issue processing the transit information."
-
-# --- Define Campus Coordinates (Example: Seattle Central) ---
-# Replace with accurate coordinates for each school, maybe store in DB or config
-CAMPUS_COORDINATES = {
-    "seattle-central-college-demo": (47.6158, -122.3214), 
-    # Add other schools
-}
\ No newline at end of file
@@ -0,0 +1,179 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.deps import SessionLocal, on_commit
+from app.models import School
+
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+# Slug không tồn tại -> nhớ trong vài giây để request rác không query DB liên tục
+SCHOOL_REGISTRY_MISS_TTL = float(os.getenv("SCHOOL_REGISTRY_MISS_TTL", "5"))
+
+
+@dataclass(frozen=True)
+class SchoolInfo:
+    id: int
+    slug: str
+    name: str
+
+    @property
+    def index_dir(self) -> str:
+        from app.rag import INDEX_DIR  # import muộn: rag cũng import registry
+        return os.path.join(INDEX_DIR, self.slug)
+
+    @classmethod
+    def from_row(cls, row: School) -> "SchoolInfo":
+        return cls(id=row.id, slug=row.slug, name=row.name)
+
+
+class SchoolRegistry:
+    """
+    Read-mostly slug/id -> SchoolInfo map. Loaded in full at startup; a miss falls back to one
+    single-row query (schools provisioned by another worker) and unknown slugs are remembered briefly.
+    Async handlers use aget()/aby_id() so a miss does not block the event loop.
+    """
+
+    def __init__(self, miss_ttl: float = SCHOOL_REGISTRY_MISS_TTL):
+        self.miss_ttl = miss_ttl
+        self._by_slug: Dict[str, SchoolInfo] = {}
+        self._by_id: Dict[int, SchoolInfo] = {}
+        self._misses: Dict[object, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_lookups = 0
+        self.loaded_at: Optional[float] = None
+
+    def load(self, db: Optional[Session] = None):
+        """(Re)loads every school in one query."""
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            rows = [SchoolInfo.from_row(r) for r in db.query(School).all()]
+        finally:
+            if own:
+                db.close()
+        with self._lock:
+            self._by_slug = {s.slug: s for s in rows}
+            self._by_id = {s.id: s for s in rows}
+            self._misses.clear()
+            self.loaded_at = time.time()
+        logger.info(f"School registry loaded: {len(rows)} schools.")
+
+    def put(self, row: School) -> SchoolInfo:
+        """Registers a freshly committed school (called from provisioning)."""
+        info = SchoolInfo.from_row(row)
+        with self._lock:
+            self._by_slug[info.slug] = info
+            self._by_id[info.id] = info
+            self._misses.pop(info.slug, None)
+            self._misses.pop(info.id, None)
+        return info
+
+    def forget(self, school_id: int):
+        with self._lock:
+            info = self._by_id.pop(school_id, None)
+            if info:
+                self._by_slug.pop(info.slug, None)
+
+    def get(self, slug: str, db: Optional[Session] = None) -> Optional[SchoolInfo]:
+        with self._lock:
+            info = self._by_slug.get(slug)
+            if info:
+                self.hits += 1
+                return info
+        return self._lookup(slug, School.slug == slug, db)
+
+    def by_id(self, school_id: Optional[int], db: Optional[Session] = None) -> Optional[SchoolInfo]:
+        if school_id is None:
+            return None
+        with self._lock:
+            info = self._by_id.get(school_id)
+            if info:
+                self.hits += 1
+                return info
+        return self._lookup(school_id, School.id == school_id, db)
+
+    def display_name(self, slug: str) -> str:
+        """Real school name for prompts; falls back to the prettified slug."""
+        info = self.get(slug)
+        return info.name if info else slug.replace('-', ' ').title()
+
+    async def aget(self, slug: str, db: AsyncSession) -> Optional[SchoolInfo]:
+        """get() for async handlers: a miss queries through the request's AsyncSession."""
+        with self._lock:
+            info = self._by_slug.get(slug)
+            if info:
+                self.hits += 1
+                return info
+        if not self._should_lookup(slug):
+            return None
+        row = (await db.execute(select(School).where(School.slug == slug))).scalars().first()
+        return self._remember(slug, row)
+
+    async def aby_id(self, school_id: Optional[int], db: AsyncSession) -> Optional[SchoolInfo]:
+        if school_id is None:
+            return None
+        with self._lock:
+            info = self._by_id.get(school_id)
+            if info:
+                self.hits += 1
+                return info
+        if not self._should_lookup(school_id):
+            return None
+        row = (await db.execute(select(School).where(School.id == school_id))).scalars().first()
+        return self._remember(school_id, row)
+
+    def _should_lookup(self, key) -> bool:
+        with self._lock:
+            missed_at = self._misses.get(key)
+            if missed_at is not None and time.time() - missed_at < self.miss_ttl:
+                return False
+            self.db_lookups += 1
+            return True
+
+    def _remember(self, key, row: Optional[School]) -> Optional[SchoolInfo]:
+        if row is not None:
+            return self.put(row)
+        with self._lock:
+            if len(self._misses) > 10000:
+                self._misses.clear()
+            self._misses[key] = time.time()
+        return None
+
+    def _lookup(self, key, criterion, db: Optional[Session]) -> Optional[SchoolInfo]:
+        if not self._should_lookup(key):
+            return None
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            return self._remember(key, db.query(School).filter(criterion).first())
+        finally:
+            if own:
+                db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "schools": len(self._by_slug),
+                "hits": self.hits,
+                "db_lookups": self.db_lookups,
+                "loaded_at": self.loaded_at,
+            }
+
+
+school_registry = SchoolRegistry()
+
+
+# Đổi slug/tên hoặc xoá trường -> bỏ entry cũ khi commit xong, lần tra cứu sau đọc lại từ DB
+@event.listens_for(School, "after_update")
+@event.listens_for(School, "after_delete")
+def _forget_school(mapper, connection, target):
+    school_id = target.id
+    on_commit(target, lambda: school_registry.forget(school_id))
@@ -10,13 +10,18 @@ from fastapi import (
     HTTPException,
     status,
     Query,  
+    Response,
 )
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr
 
-from app.deps import get_db
-from app.auth import require_roles, hash_password, create_token
-from app import rag
+from app.deps import get_async_db, run_write
+from app.auth import require_roles, hash_password_async, create_token
+from app import rag, fetch
+from app.registry import school_registry, SchoolInfo
+from app.queries import ticket_detail, ticket_facets, paginate, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
 from app.models import School, User, Document, ServiceTicket
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -30,33 +35,40 @@ class ProvisionIn(BaseModel):
 
 
 @router.post("/provision", status_code=status.HTTP_201_CREATED)
-async def provision_school(payload: ProvisionIn, db: Session = Depends(get_db)):
+async def provision_school(payload: ProvisionIn, db: AsyncSession = Depends(get_async_db)):
     # 1) Check tồn tại
-    if db.query(School).filter(School.slug == payload.slug).first():
+    if await school_registry.aget(payload.slug, db):
         raise HTTPException(status_code=400, detail="School slug already taken.")
-    if db.query(User).filter(User.email == payload.owner_email).first():
+    if (await db.execute(select(User.id).where(User.email == payload.owner_email))).first():
         raise HTTPException(status_code=400, detail="Email already registered.")
 
     # 2) Tạo trường + owner
-    try:
+    password_hash = await hash_password_async(payload.owner_password)
+    def _create(s: Session):
         new_school = School(name=payload.school_name, slug=payload.slug)
-        db.add(new_school)
-        db.flush()
+        s.add(new_school)
+        s.flush()
 
         new_owner = User(
             email=payload.owner_email,
-            password_hash=hash_password(payload.owner_password),
+            password_hash=password_hash,
             role="owner",
             school_id=new_school.id,
         )
-        db.add(new_owner)
-        db.commit()
-        db.refresh(new_owner)
+        s.add(new_owner)
+        s.flush()
+        return new_school, new_owner
+
+    try:
+        new_school, new_owner = await run_write(db, _create)
+
+        school_registry.put(new_school)  # slug mới dùng được ngay, không chờ reload
 
         token = create_token(sub=new_owner.email, role=new_owner.role, school_id=new_school.id)
         return {"token": token, "role": new_owner.role, "school_slug": new_school.slug}
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         print(f"Provisioning error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to create school: {e}")
 
@@ -68,16 +80,16 @@ async def ingest(
     text: str | None = Form(None),
     url: str | None = Form(None),
     user_payload: dict = Depends(require_roles("owner", "admin")),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    # Resolve school
-    db_school = db.query(School).filter(School.slug == school).first()
+    # Resolve school (registry trong RAM)
+    db_school = await school_registry.aget(school, db)
     if not db_school:
         raise HTTPException(status_code=404, detail=f"School with slug '{school}' not found.")
     school_id = db_school.id
 
     print(f"Ingesting content for school: {school} (ID: {school_id})")
-    content = ""
+    chunks = []
     source_type = ""
     source_description = ""
     file_name = None
@@ -88,57 +100,83 @@ async def ingest(
             source_type = "upload"
             file_name = file.filename
             source_description = file_name
-            content = await rag.load_content(file=file)
+            # Upload được spool ra đĩa và chunk theo từng trang -> RAM không phụ thuộc kích thước file
+            chunks = await rag.load_chunks(file=file)
+            if not chunks:
+                raise HTTPException(status_code=400, detail="Could not load valid content.")
         elif text:
             source_type = "text"
             source_description = "Pasted Text"
             content = await rag.load_content(text=text)
+            if not content or not content.strip():
+                raise HTTPException(status_code=400, detail="Could not load valid content.")
+
+            print(f"Content loaded ({len(content)} chars). Chunking...")
+            chunks = rag.chunk_text(content)
         elif url:
             source_type = "url"
             source_description = url
-            content = await rag.load_content(url=url)
+            try:
+                fetched = await fetch.fetch_url(url)
+            except fetch.FetchError as e:
+                raise HTTPException(status_code=400, detail=f"Could not fetch URL: {e}")
+
+            # Cùng nội dung (sha256) đã được embed cho trường này -> bỏ qua chunk/embed
+            if fetch.is_indexed(school, fetched):
+                print(f"URL unchanged since last ingest, skipping: {url}")
+                return {
+                    "ok": True,
+                    "document_id": None,
+                    "chunks_created": 0,
+                    "vectors_indexed": 0,
+                    "source": source_description,
+                    "unchanged": True,
+                }
+            chunks = await rag.load_fetched_chunks(fetched)
+            if not chunks:
+                raise HTTPException(status_code=400, detail="Could not load valid content.")
         else:
             raise HTTPException(status_code=400, detail="No content provided.")
 
-        if not content or not content.strip():
-            raise HTTPException(status_code=400, detail="Could not load valid content.")
-
         # Chunk & index
-        print(f"Content loaded ({len(content)} chars). Chunking...")
-        chunks = rag.chunk_text(content)
         if not chunks:
             raise HTTPException(status_code=400, detail="Content resulted in zero chunks.")
 
         print(f"Obtained {len(chunks)} chunks. Embedding and indexing...")
-        indexed_ids = await rag.embed_and_index(school, chunks)
+        indexed_ids = await rag.embed_and_index(school, chunks, url=url if source_type == "url" else None)
+        if source_type == "url":
+            fetch.mark_indexed(school, fetched)
 
         # Save Document record
-        new_doc = Document(
-            school_id=school_id,
-            file_name=file_name,
-            source_type=source_type,
-            source_description=source_description,
-            chunk_count=len(chunks),
-            vector_count=len(indexed_ids),
-        )
-        db.add(new_doc)
-        db.commit()
-        db.refresh(new_doc)
-        print(f"Indexing complete. Saved Document record ID: {new_doc.id}")
+        def _save_document(s: Session) -> int:
+            new_doc = Document(
+                school_id=school_id,
+                file_name=file_name,
+                source_type=source_type,
+                source_description=source_description,
+                chunk_count=len(chunks),
+                vector_count=len(indexed_ids),
+            )
+            s.add(new_doc)
+            s.flush()
+            return new_doc.id
+
+        document_id = await run_write(db, _save_document)
+        print(f"Indexing complete. Saved Document record ID: {document_id}")
 
         return {
             "ok": True,
-            "document_id": new_doc.id,
+            "document_id": document_id,
             "chunks_created": len(chunks),
             "vectors_indexed": len(indexed_ids),
             "source": source_description,
         }
 
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"ERROR during ingest for school {school}: {e}")
         raise HTTPException(status_code=500, detail=f"Ingestion failed: {e}")
 
@@ -146,20 +184,23 @@ async def ingest(
 @router.get("/documents")
 async def list_documents(
     school: str,
+    response: Response,
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
     user_payload: dict = Depends(require_roles("owner", "admin")),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db_school = db.query(School).filter(School.slug == school).first()
+    db_school = await school_registry.aget(school, db)
     if not db_school:
         raise HTTPException(status_code=404, detail="School not found")
 
-    # Order by created_at (ổn định, tránh lỗi thiếu updated_at trong DB)
-    docs = (
-        db.query(Document)
-        .filter(Document.school_id == db_school.id)
-        .order_by(Document.created_at.desc())
-        .all()
+    # Keyset theo (created_at, id) mới nhất trước; trang tiếp theo qua header X-Next-Cursor
+    docs, next_cursor = await paginate(
+        db, select(Document).where(Document.school_id == db_school.id),
+        Document.created_at, Document.id, cursor, limit,
     )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
     return [
         {
@@ -172,17 +213,33 @@ async def list_documents(
             "createdAt": doc.created_at.isoformat() if doc.created_at else None,
             "updatedAt": doc.updated_at.isoformat() if getattr(doc, "updated_at", None) else None,
         }
-        for doc in docs
+        for (doc,) in docs
     ]
 
 
+@router.get("/documents/count")
+async def count_documents(
+    school: str,
+    user_payload: dict = Depends(require_roles("owner", "admin")),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Dashboard chỉ cần số lượng -> COUNT thay vì tải hết các trang của /documents
+    db_school = await school_registry.aget(school, db)
+    if not db_school:
+        raise HTTPException(status_code=404, detail="School not found")
+    count = (await db.execute(
+        select(func.count(Document.id)).where(Document.school_id == db_school.id)
+    )).scalar_one()
+    return {"count": count}
+
+
 @router.delete("/documents/{doc_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_document(
     doc_id: int,
     user_payload: dict = Depends(require_roles("owner", "admin")),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    doc = db.query(Document).filter(Document.id == doc_id).first()
+    doc = await db.get(Document, doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
@@ -191,14 +248,20 @@ async def delete_document(
         raise HTTPException(status_code=403, detail="Forbidden: Cannot delete document from another school")
 
     try:
-        school_slug = db.query(School.slug).filter(School.id == doc.school_id).scalar()
+        school_info = await school_registry.aby_id(doc.school_id, db)
+        school_slug = school_info.slug if school_info else None
 
-        db.delete(doc)
-        db.commit()
+        def _delete(s: Session):
+            row = s.get(Document, doc_id)
+            if row is not None:
+                s.delete(row)
+
+        await run_write(db, _delete)
         print(f"Deleted Document record ID: {doc_id} for school {school_slug}")
         return
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         print(f"ERROR deleting document {doc_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Could not delete document: {e}")
 
@@ -209,7 +272,7 @@ async def reindex(school: str = Form(...), _=Depends(require_roles("owner", "adm
 
 
 @router.get("/insights/summary")
-async def insights_summary(db: Session = Depends(get_db), _=Depends(require_roles("owner", "admin", "analyst"))):
+async def insights_summary(_=Depends(require_roles("owner", "admin", "analyst"))):
     # TODO: replace mock by real metrics
     return {
         "queries_per_day": [{"day": "2025-10-12", "count": 42}, {"day": "2025-10-13", "count": 58}],
@@ -219,32 +282,43 @@ async def insights_summary(db: Session = Depends(get_db), _=Depends(require_role
     }
 
 
-def get_school_or_404(db: Session, school_slug: str) -> School:
-    row = db.query(School).filter(School.slug == school_slug).first()
+async def get_school_or_404(db: AsyncSession, school_slug: str) -> SchoolInfo:
+    row = await school_registry.aget(school_slug, db)
     if not row:
         raise HTTPException(status_code=404, detail=f"School '{school_slug}' not found")
     return row
 
 
 @router.get("/tickets")
-def admin_list_tickets(
+async def admin_list_tickets(
+    response: Response,
     school: str = Query(..., description="School slug, e.g. 'seattle-central-college'"),
     status: Optional[str] = Query(None, description="Filter by status, or 'All'"),
     department: Optional[str] = Query(None, description="Filter by department, or 'All'"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    school_row = get_school_or_404(db, school)
+    school_row = await get_school_or_404(db, school)
 
-    q = db.query(ServiceTicket).filter(ServiceTicket.school_id == school_row.id)
+    # 1 query: cột ticket + email requester (outer join), không lazy-load t.requester từng dòng
+    q = (
+        select(
+            ServiceTicket.id, ServiceTicket.title, ServiceTicket.department, ServiceTicket.status,
+            ServiceTicket.created_at, ServiceTicket.updated_at, User.email.label("user_email"),
+        )
+        .outerjoin(User, User.id == ServiceTicket.user_id)
+        .where(ServiceTicket.school_id == school_row.id)
+    )
     if status and status != "All":
-        q = q.filter(ServiceTicket.status == status)
+        q = q.where(ServiceTicket.status == status)
     if department and department != "All":
-        q = q.filter(ServiceTicket.department == department)
-
-    # An toàn: dùng created_at
-    q = q.order_by(ServiceTicket.created_at.desc())
+        q = q.where(ServiceTicket.department == department)
 
-    tickets = q.all()
+    # Keyset theo (created_at, id) mới nhất trước, không OFFSET
+    tickets, next_cursor = await paginate(db, q, ServiceTicket.created_at, ServiceTicket.id, cursor, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return [
         {
             "id": t.id,
@@ -252,51 +326,34 @@ def admin_list_tickets(
             "department": t.department,
             "status": t.status,
             "created_at": t.created_at.isoformat() if t.created_at else None,
-            "updated_at": t.updated_at.isoformat() if getattr(t, "updated_at", None) else None,
-            "user_email": getattr(getattr(t, "requester", None), "email", None),
+            "updated_at": t.updated_at.isoformat() if t.updated_at else None,
+            "user_email": t.user_email,
         }
         for t in tickets
     ]
 
 
+@router.get("/tickets/facets")
+async def admin_ticket_facets(
+    school: str = Query(..., description="School slug, e.g. 'seattle-central-college'"),
+    _=Depends(require_roles("owner", "admin", "dept_admin", "analyst")),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Khai báo trước "/tickets/{ticket_id}". Đếm ở server (1 GROUP BY, cache ngắn) thay vì tải hết ticket về client
+    school_row = await get_school_or_404(db, school)
+    return await ticket_facets(db, school_row.id)
+
+
 @router.get("/tickets/{ticket_id}")
-def admin_get_ticket(
+async def admin_get_ticket(
     ticket_id: int,
     school: str = Query(..., description="School slug, e.g. 'seattle-central-college'"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    school_row = get_school_or_404(db, school)
+    school_row = await get_school_or_404(db, school)
 
-    t = (
-        db.query(ServiceTicket)
-        .filter(ServiceTicket.id == ticket_id, ServiceTicket.school_id == school_row.id)
-        .first()
-    )
-    if not t:
+    # Ticket + requester + payload + messages: 2 query cố định (app/queries.py)
+    found = await ticket_detail(db, ticket_id, school_id=school_row.id)
+    if not found:
         raise HTTPException(status_code=404, detail="Ticket not found")
-
-    form_payload = getattr(getattr(t, "form_submission", None), "payload_json", None)
-    messages = []
-    for m in getattr(t, "messages", []) or []:
-        messages.append(
-            {
-                "id": m.id,
-                "user_id": getattr(m, "user_id", None),
-                "staff_id": getattr(m, "staff_id", None),
-                "text": m.text,
-                "is_internal": getattr(m, "is_internal", False),
-                "created_at": m.created_at.isoformat() if getattr(m, "created_at", None) else None,
-            }
-        )
-
-    return {
-        "id": t.id,
-        "title": t.title,
-        "department": t.department,
-        "status": t.status,
-        "created_at": t.created_at.isoformat() if t.created_at else None,
-        "updated_at": t.updated_at.isoformat() if getattr(t, "updated_at", None) else None,
-        "requester_email": getattr(getattr(t, "requester", None), "email", None),
-        "payload_json": form_payload,
-        "messages": messages,
-    }
+    return found[1]
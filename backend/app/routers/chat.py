@@ -1,6 +1,7 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException 
 from pydantic import BaseModel
-from app import rag 
+from app import intents
+from app.limiter import Overloaded
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,28 +19,13 @@ async def ask(in_: AskIn):
     if not school_slug or not question:
         raise HTTPException(status_code=400, detail="School slug and question are required.")
 
-    # --- TRANSIT CHECK ---
-    if rag.contains_transit_keyword(question):
-        logger.info(f"Transit keyword detected in question for {school_slug}.")
-        coords = rag.CAMPUS_COORDINATES.get(school_slug)
-        if coords:
-             # Gọi hàm transit API (đồng bộ, có thể đổi sang async nếu cần)
-             transit_answer = rag.get_transit_info(latitude=coords[0], longitude=coords[1])
-             if transit_answer:
-                  # Trả về câu trả lời từ API transit, không cần gọi RAG/LLM
-                  return {"answer": transit_answer, "sources": [{"type": "api", "name": "Transit API"}]} 
-             else:
-                  # API lỗi hoặc không cấu hình -> fallback về RAG
-                  logger.warning("Transit API call failed or disabled, falling back to RAG.")
-        else:
-             logger.warning(f"No coordinates configured for school {school_slug}, falling back to RAG for transit question.")
-    # --- END TRANSIT CHECK ---
-
-    # Nếu không phải câu hỏi transit hoặc transit lỗi -> Dùng RAG pipeline
+    # Intent router: transit / structured data trả lời thẳng, còn lại -> RAG pipeline (answer_verified)
     try:
-        # Sử dụng hàm answer_verified với prompt đã cải thiện
-        verified_response = rag.answer_verified(school_slug, question) 
-        return verified_response
+        return await intents.answer(school_slug, question)
+    except Overloaded as e:
+        logger.warning(f"Rejecting chat request for {school_slug}: {e}")
+        raise HTTPException(status_code=503, detail="Service is busy, please retry shortly.",
+                            headers={"Retry-After": e.retry_after_header})
     except Exception as e:
         # Bắt lỗi chung từ RAG pipeline
         logger.error(f"Error during RAG processing for {school_slug}: {e}")
@@ -47,11 +33,7 @@ async def ask(in_: AskIn):
 
 
 # --- WebSocket Endpoint (Giữ nguyên hoặc cải thiện tương tự) ---
-# Hiện tại WS endpoint đang dùng logic ask_llm cũ. 
-# Cần nâng cấp để:
-# 1. Kiểm tra transit keyword.
-# 2. Nếu là transit, gọi API transit và gửi kết quả.
-# 3. Nếu không, gọi answer_verified và gửi kết quả (không streaming).
+# Dùng chung intent router với /ask, gửi kết quả không streaming.
 # Streaming thực sự với RAG + LLM phức tạp hơn (cần yield từ Bedrock).
 # CHO HACKATHON: Có thể giữ WS trả lời không streaming như hiện tại cho đơn giản.
 
@@ -71,26 +53,11 @@ async def stream(ws: WebSocket):
                     await ws.send_text(json.dumps({"error": "school and question required"}))
                     continue
 
-                # --- ADD TRANSIT CHECK TO WEBSOCKET ---
-                is_transit = rag.contains_transit_keyword(question)
-                transit_answer = None
-                if is_transit:
-                    logger.info(f"WS: Transit keyword detected for {school_slug}.")
-                    coords = rag.CAMPUS_COORDINATES.get(school_slug)
-                    if coords:
-                        transit_answer = rag.get_transit_info(latitude=coords[0], longitude=coords[1])
-                    else:
-                         logger.warning(f"WS: No coordinates for {school_slug}.")
-                
-                if transit_answer:
-                     await ws.send_text(json.dumps({"answer": transit_answer, "sources": [{"type": "api", "name": "Transit API"}]}))
-                     continue # Chuyển sang vòng lặp chờ message tiếp theo
-                # --- END WS TRANSIT CHECK ---
-
-                # Nếu không phải transit -> Gọi RAG (answer_verified)
-                verified_response = rag.answer_verified(school_slug, question)
-                await ws.send_text(json.dumps(verified_response))
+                # Cùng intent router với /ask (transit / structured data / RAG)
+                await ws.send_text(json.dumps(await intents.answer(school_slug, question)))
 
+            except Overloaded as e:
+                 await ws.send_text(json.dumps({"error": "Service is busy, please retry shortly.", "retry_after": e.retry_after_header}))
             except json.JSONDecodeError:
                  await ws.send_text(json.dumps({"error": "Invalid JSON message"}))
             except Exception as e:
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import os
+import uuid
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from pydantic import BaseModel
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.deps import get_db, get_current_user_optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.deps import get_async_db, get_current_user_optional, run_write, Principal
 from app.auth import require_roles
-from app.models import Form, FormSubmission, ServiceTicket, School, User
+from app.registry import school_registry
+from app.queries import paginate, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
+from app.events import publish_ticket_event, now_iso
+from app.models import Form, FormSubmission, ServiceTicket
 from datetime import datetime
 from typing import Optional, Dict, Any
 
@@ -34,17 +43,10 @@ def get_department_from_form_name(form_name: str) -> str:
         return "Admissions"
     return "Student Services"
 
-@router.get("/{school_slug}")
-def list_forms(school_slug: str, db: Session = Depends(get_db)):
-    return [
-        {"id": 1, "name": "Transcript Request",
-         "schema_json": {"fields":[{"name":"student_id"},{"name":"recipient_email"}]}}
-    ]
-
 @router.post("/submit")
-def submit_form(
+async def submit_form(
     payload: dict,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     jwt = Depends(require_roles("student", "applicant"))
 ):
     # Lấy user/email/role/school_id từ JWT
@@ -52,40 +54,45 @@ def submit_form(
     user_role  = jwt["role"]
     school_id  = jwt["school_id"]
 
-    # Tìm User để lấy user_id (nếu có)
-    user = db.query(User).filter(User.email == user_email, User.school_id == school_id).first()
-    user_id = user.id if user else None  # applicant chưa có user có thể None
-
-    # 1) Tạo FormSubmission (payload_json thuộc submission)
-    submission = FormSubmission(
-        form_id=None,                   
-        user_id=user_id,              
-        school_id=school_id,
-        payload_json=payload,            
-        status="submitted"
-    )
-    db.add(submission)
-    db.flush()         # để có submission.id mà chưa commit
-    db.refresh(submission)
-
-    # 2) Tạo ServiceTicket (KHÔNG có payload_json)
-    ticket = ServiceTicket(
-        school_id=school_id,
-        user_id=user_id,                    
-        form_submission_id=submission.id,   
-        department="International",          
-        title=f"International Application - {user_email}",
-        status="Open"
-    )
-    db.add(ticket)
-    db.commit()
-    db.refresh(ticket)
+    # user_id đã có trong principal (require_roles), không cần query users.
+    # Chỉ dùng khi user thuộc đúng trường của token (như query email + school_id trước đây)
+    user_id = jwt.get("user_id") if jwt.get("school_id") == school_id else None  # applicant chưa có user có thể None
 
-    return {
-        "id": submission.id,
-        "status": submission.status,
-        "ticket_id": ticket.id
-    }
+    def _create(s: Session) -> dict:
+        # 1) Tạo FormSubmission (payload_json thuộc submission)
+        submission = FormSubmission(
+            form_id=None,
+            user_id=user_id,
+            school_id=school_id,
+            payload_json=payload,
+            status="submitted"
+        )
+        s.add(submission)
+        s.flush()   # để có submission.id mà chưa commit
+
+        # 2) Tạo ServiceTicket (KHÔNG có payload_json)
+        ticket = ServiceTicket(
+            school_id=school_id,
+            user_id=user_id,
+            form_submission_id=submission.id,
+            department="International",
+            title=f"International Application - {user_email}",
+            status="Open"
+        )
+        s.add(ticket)
+        s.flush()
+        return {
+            "id": submission.id,
+            "status": submission.status,
+            "ticket_id": ticket.id
+        }, ticket.title
+
+    # Submission + ticket trong cùng 1 transaction (SQLite: qua writer, xem deps.run_write)
+    out, title = await run_write(db, _create)
+    await publish_ticket_event({"type": "ticket_created", "ticket_id": out["ticket_id"], "title": title,
+                                "department": "International", "status": "Open", "at": now_iso()},
+                               school_id, "International")
+    return out
 
 def infer_department(form_name: str, payload: Dict[str, Any]) -> str:
     # Map nhanh: tuỳ chỉnh theo nhu cầu
@@ -100,27 +107,28 @@ def infer_department(form_name: str, payload: Dict[str, Any]) -> str:
 async def submit_and_create_ticket(
     data: SubmitPayload,
     user_payload: dict = Depends(require_roles("applicant","student")), # Chỉ applicant/student submit
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Lấy thông tin user từ token payload
-    user_email = user_payload.get("sub") 
-    # Tìm user trong DB để lấy ID (cần thiết cho ForeignKey)
-    db_user = db.query(User).filter(User.email == user_email).first()
-    if not db_user:
-         # Lỗi này không nên xảy ra nếu token hợp lệ
+    # user_id từ principal (require_roles) - cần thiết cho ForeignKey
+    user_id = user_payload.get("user_id")
+    if user_id is None:
          raise HTTPException(status_code=404, detail="Submitting user not found in database.")
-    user_id = db_user.id
 
-    # Tìm school_id từ slug
-    db_school = db.query(School).filter(School.slug == data.school_slug).first()
+    # Tìm school_id từ slug (registry trong RAM)
+    db_school = await school_registry.aget(data.school_slug, db)
     if not db_school: raise HTTPException(status_code=404, detail="School not found")
     school_id = db_school.id
+    # Token của trường A không được nộp form / tạo ticket cho trường B
+    if user_payload.get("school_id") != school_id:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot submit for another school")
 
     # Tìm form_id (tạm thời hardcode)
     form_id = 1 if data.form_name == "International Application" else 2 if data.form_name == "Deferral Request" else 0
     if form_id == 0: raise HTTPException(status_code=400, detail="Invalid form name provided.")
 
-    try:
+    department = get_department_from_form_name(data.form_name)
+
+    def _create(s: Session):
         # 1. Tạo FormSubmission
         fs = FormSubmission(
             form_id=form_id,
@@ -129,32 +137,36 @@ async def submit_and_create_ticket(
             payload_json=data.payload,
             status="Submitted"
         )
-        db.add(fs)
-        db.flush() # Lấy fs.id
+        s.add(fs)
+        s.flush() # Lấy fs.id
 
         # 2. Tạo ServiceTicket
-        department = get_department_from_form_name(data.form_name)
         ticket = ServiceTicket(
             school_id=school_id,
             user_id=user_id, # Lưu user tạo ticket
             form_submission_id=fs.id, # Liên kết với submission
             department=department,
             title=f"{data.form_name} - Submission #{fs.id}",
-            payload_json=data.payload, # Có thể bỏ qua nếu đã có ở submission
-            status="Open" # Trạng thái ban đầu
+            status="Open" # Trạng thái ban đầu (payload nằm ở submission)
         )
-        db.add(ticket)
-        db.commit() # Lưu cả hai
-        db.refresh(fs)
-        db.refresh(ticket)
+        s.add(ticket)
+        s.flush()
+        return fs.id, ticket.id, fs.status, ticket.title
+
+    try:
+        fs_id, ticket_id, fs_status, title = await run_write(db, _create) # Lưu cả hai trong 1 transaction
+        print(f"Form submitted (ID: {fs_id}), Ticket created (ID: {ticket_id}) for dept: {department}")
+        # Hàng đợi của phòng ban thấy ticket mới ngay (app/events.py)
+        await publish_ticket_event({"type": "ticket_created", "ticket_id": ticket_id, "title": title,
+                                    "department": department, "status": "Open", "at": now_iso()},
+                                   school_id, department)
 
-        print(f"Form submitted (ID: {fs.id}), Ticket created (ID: {ticket.id}) for dept: {department}")
-        
         # Trả về các ID cần thiết
-        return {"ok": True, "submission_id": fs.id, "ticket_id": ticket.id, "status": fs.status}
+        return {"ok": True, "submission_id": fs_id, "ticket_id": ticket_id, "status": fs_status}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         print(f"ERROR during form submission/ticket creation: {e}")
         raise HTTPException(status_code=500, detail="Failed to process submission.")
     
@@ -174,20 +186,27 @@ class SubmissionSummary(PydanticBaseModel):
 
 # Endpoint mới cho trang Tracking
 @router.get("/my-submissions")
-def my_submissions(school: str, db: Session = Depends(get_db), user: User | None = Depends(get_current_user_optional)):
+async def my_submissions(school: str, response: Response, cursor: Optional[str] = None,
+                         limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+                         db: AsyncSession = Depends(get_async_db), user: Principal | None = Depends(get_current_user_optional)):
+    school_info = await school_registry.aget(school, db)
+    if not school_info:
+        return []
     q = (
-        db.query(FormSubmission, ServiceTicket, Form, School)
-        .join(School, School.id == FormSubmission.school_id)
+        select(FormSubmission, ServiceTicket, Form)
         .outerjoin(Form, Form.id == FormSubmission.form_id)
         .outerjoin(ServiceTicket, ServiceTicket.form_submission_id == FormSubmission.id)
-        .filter(School.slug == school)
+        .where(FormSubmission.school_id == school_info.id)
     )
     if user:
-        q = q.filter(FormSubmission.user_id == user.id)
+        q = q.where(FormSubmission.user_id == user.id)
 
-    rows = q.all()
+    # Keyset theo (created_at, id) của submission, trang tiếp theo qua header X-Next-Cursor
+    rows, next_cursor = await paginate(db, q, FormSubmission.created_at, FormSubmission.id, cursor, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     out = []
-    for sub, ticket, form, _school in rows:
+    for sub, ticket, form in rows:
         out.append({
             "id": sub.id,
             "ticket_id": ticket.id if ticket else None,
@@ -199,13 +218,101 @@ def my_submissions(school: str, db: Session = Depends(get_db), user: User | None
         })
     return out
 
+OFFLINE_SYNC_MAX_ITEMS = int(os.getenv("OFFLINE_SYNC_MAX_ITEMS", "1000"))
+_SYNC_INSERT_CHUNK = 500   # 500 dòng x 6 cột: dưới giới hạn bind param của SQLite
+
+def _item_error(it, known_forms) -> Optional[str]:
+    if not isinstance(it, dict):
+        return "item must be an object"
+    if not isinstance(it.get("payload"), dict):
+        return "payload is required"
+    key = it.get("client_key")
+    if key is not None and (not isinstance(key, str) or not key.strip() or len(key) > 128):
+        return "client_key must be a non-empty string of at most 128 characters"
+    if it.get("form_id") is not None and it["form_id"] not in known_forms:
+        return "unknown form_id"
+    return None
+
 @router.post("/offline/sync")
-def offline_sync(school_id: int, data: dict, user=Depends(require_roles("applicant","student","parent")), db: Session = Depends(get_db)):
-    items = data.get("items", [])
-    ids=[]
-    for it in items:
-        fs = FormSubmission(form_id=it.get("form_id"), user_id=user.get("sub"),
-                            school_id=school_id, payload_json=it.get("payload"), status="submitted")
-        db.add(fs); db.flush(); ids.append(fs.id)
-    db.commit()
-    return {"ok": True, "synced": ids}
\ No newline at end of file
+async def offline_sync(school_id: int, data: dict, user=Depends(require_roles("applicant","student","parent")), db: AsyncSession = Depends(get_async_db)):
+    """
+    Bulk, retry-safe sync of forms queued while offline: items are {"client_key", "form_id", "payload"}.
+    The batch is inserted with INSERT ... ON CONFLICT (school_id, client_key) DO NOTHING in one transaction,
+    so a retried sync returns the original ids instead of creating duplicates. Results are per item, in order.
+    """
+    items = data.get("items") or []
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="items must be a list.")
+    if len(items) > OFFLINE_SYNC_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {OFFLINE_SYNC_MAX_ITEMS} items per sync.")
+    user_id = user.get("user_id")  # applicant chưa có tài khoản -> None
+
+    # form_id không tồn tại sẽ làm hỏng cả batch (FK trên Postgres) -> kiểm tra trước bằng 1 query
+    form_ids = {it.get("form_id") for it in items if isinstance(it, dict) and isinstance(it.get("form_id"), int)}
+    known_forms = set((await db.execute(select(Form.id).where(Form.id.in_(form_ids)))).scalars()) if form_ids else set()
+
+    results: list = [None] * len(items)
+    keys: list = [None] * len(items)
+    rows, first_index = [], {}
+    for i, it in enumerate(items):
+        err = _item_error(it, known_forms)
+        if err:
+            results[i] = {"client_key": it.get("client_key") if isinstance(it, dict) else None, "status": "invalid", "error": err}
+            continue
+        # Không có key -> server tự sinh (trả về cho client để lần retry sau gửi kèm)
+        key = keys[i] = it.get("client_key") or f"srv-{uuid.uuid4()}"
+        if key in first_index:
+            continue  # trùng key trong cùng batch -> dùng kết quả của item đầu tiên
+        first_index[key] = i
+        rows.append({"form_id": it.get("form_id"), "user_id": user_id, "school_id": school_id,
+                     "payload_json": it["payload"], "status": "submitted", "client_key": key})
+
+    insert_stmt = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+
+    def _insert_batch(s: Session):
+        created = {}
+        for lo in range(0, len(rows), _SYNC_INSERT_CHUNK):
+            stmt = (insert_stmt(FormSubmission).values(rows[lo:lo + _SYNC_INSERT_CHUNK])
+                    .on_conflict_do_nothing(index_elements=["school_id", "client_key"])
+                    .returning(FormSubmission.id, FormSubmission.client_key))
+            created.update({key: sid for sid, key in s.execute(stmt)})
+        # Key đã có từ lần sync trước -> lấy id gốc
+        seen_keys = [k for k in first_index if k not in created]
+        existing = {}
+        if seen_keys:
+            existing = {k: (sid, uid) for sid, k, uid in s.execute(
+                select(FormSubmission.id, FormSubmission.client_key, FormSubmission.user_id)
+                .where(FormSubmission.school_id == school_id, FormSubmission.client_key.in_(seen_keys)))}
+        return created, existing
+
+    try:
+        created, existing = await run_write(db, _insert_batch)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR during offline sync for school {school_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to sync offline submissions.")
+
+    for i in range(len(items)):
+        if results[i] is not None:
+            continue
+        key = keys[i]
+        if key in created and first_index[key] == i:
+            results[i] = {"client_key": key, "status": "created", "id": created[key]}
+        elif key in created:
+            results[i] = {"client_key": key, "status": "duplicate", "id": created[key]}
+        elif key in existing and existing[key][1] == user_id:
+            results[i] = {"client_key": key, "status": "duplicate", "id": existing[key][0]}
+        else:
+            # Key đã thuộc về submission của người khác
+            results[i] = {"client_key": key, "status": "conflict", "error": "client_key already used"}
+    synced = [r["id"] for r in results if r.get("id") is not None]
+    return {"ok": all(r["status"] in ("created", "duplicate") for r in results), "synced": synced, "results": results}
+
+# Khai báo sau cùng: "/{school_slug}" khớp mọi path 1 segment (vd. /forms/my-submissions)
+@router.get("/{school_slug}")
+def list_forms(school_slug: str):
+    return [
+        {"id": 1, "name": "Transcript Request",
+         "schema_json": {"fields":[{"name":"student_id"},{"name":"recipient_email"}]}}
+    ]
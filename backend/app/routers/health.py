@@ -1,6 +1,13 @@
 from fastapi import APIRouter
 from datetime import datetime, timezone
 import os
+from app import rag, transit, intents
+from app.limiter import bedrock_limiter, bedrock_workers, school_admission
+from app.pwhash import password_hasher
+from app.deps import principal_cache, pool_stats
+from app.registry import school_registry
+from app.queries import ticket_facet_cache
+from app.events import ticket_events
 
 router = APIRouter(prefix="/health", tags=["health"])
 
@@ -16,3 +23,24 @@ def health_root():
 def health_ping():
     return {"ok": True}
 
+@router.get("/metrics")
+def health_metrics():
+    return {
+        "singleflight": rag.answer_flight.stats(),
+        "claude_hedge": rag.claude_hedger.stats(),
+        "bedrock_breaker": rag.bedrock_breaker.stats(),
+        "degraded_answers": dict(rag.degraded_answers),
+        "retrieval_fallbacks": dict(rag.retrieval_fallbacks),
+        "bedrock_limiter": bedrock_limiter.stats(),
+        "bedrock_workers": bedrock_workers.stats(),
+        "school_admission": school_admission.stats(),
+        "transit_cache": transit.transit_cache.stats(),
+        "intent_router": intents.stats(),
+        "password_hasher": password_hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "school_registry": school_registry.stats(),
+        "ticket_facets": ticket_facet_cache.stats(),
+        "db_pool": pool_stats(),
+        "ticket_events": ticket_events.stats(),
+    }
+
@@ -1,113 +1,277 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
-from app.deps import get_db
-from app.auth import require_roles
-from app.models import ServiceTicket, User, Message as TicketMessage
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.deps import get_async_db, run_write, resolve_principal, AsyncSessionLocal, Principal, get_principal_optional
+from app.auth import require_roles, create_stream_token, STREAM_TOKEN_SCOPE, STREAM_TOKEN_TTL_S
+from app.models import ServiceTicket, FormSubmission, Message as TicketMessage
+from app.queries import ticket_detail, paginate, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
+from app.events import (
+    ticket_events, publish_ticket_event, ticket_topic, department_topic, now_iso, Subscription,
+    STAFF_ROLES, EVENTS_HEARTBEAT_S,
+)
 
-router = APIRouter(prefix="/tickets", tags=["tickets"])
-
-@router.get("/{department}")
-def list_by_dept(department: str, school_id: int, _=Depends(require_roles("dept_admin","admin","owner")), db: Session = Depends(get_db)):
-    q = db.query(ServiceTicket).filter(ServiceTicket.school_id==school_id, ServiceTicket.department==department).all()
-    return [{"id":t.id,"title":t.title,"status":t.status,"payload":t.payload_json} for t in q]
-
-@router.post("/{ticket_id}/status")
-def update(ticket_id: int, payload: dict, _=Depends(require_roles("dept_admin","admin","owner")), db: Session = Depends(get_db)):
-    t = db.query(ServiceTicket).get(ticket_id)
-    if not t: return {"ok": False, "error": "not_found"}
-    t.status = payload.get("status","open")
-    db.add(t); db.commit()
-    return {"ok": True}
+logger = logging.getLogger(__name__)
 
-class MessageIn(BaseModel):
-    text: str
-    is_internal: Optional[bool] = False
-
-def _get_user_by_email(db: Session, email: str) -> Optional[User]:
-    return db.query(User).filter(User.email == email).first()
+router = APIRouter(prefix="/tickets", tags=["tickets"])
 
-@router.get("/{ticket_id}")
-def get_ticket_detail(
+# Khai báo trước "/{department}" (và chỉ nhận số) để /tickets/123 không bị route department nuốt mất
+@router.get("/{ticket_id:int}")
+async def get_ticket_detail(
     ticket_id: int,
     user_payload: dict = Depends(require_roles("owner", "admin", "dept_admin", "student", "applicant")),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    t = db.query(ServiceTicket).filter(ServiceTicket.id == ticket_id).first()
-    if not t:
+    # Ticket + requester email + payload + messages: 2 query cố định (app/queries.py)
+    found = await ticket_detail(db, ticket_id)
+    if not found:
         raise HTTPException(status_code=404, detail="Ticket not found")
+    requester_id, out = found
 
     # Nếu là student/applicant thì chỉ xem được ticket của mình
     role = user_payload.get("role")
-    sub_email = user_payload.get("sub")
     if role in ("student", "applicant"):
-        u = _get_user_by_email(db, sub_email)
-        if not u or t.user_id != u.id:
+        if user_payload.get("user_id") is None or requester_id != user_payload["user_id"]:
             raise HTTPException(status_code=403, detail="Forbidden")
-
-    # Lấy email requester
-    req_email = db.query(User.email).filter(User.id == t.user_id).scalar()
-
-    # Build detail
-    out = {
-        "id": t.id,
-        "title": t.title,
-        "department": t.department,
-        "status": t.status,
-        "created_at": (t.created_at.isoformat() if t.created_at else None),
-        "updated_at": (t.updated_at.isoformat() if t.updated_at else None),
-        "requester_email": req_email,
-        "payload_json": (t.submission.payload_json if t.submission else None),
-        "messages": [{
-            "id": m.id,
-            "user_id": m.user_id,
-            "staff_id": m.staff_id,
-            "text": m.text,
-            "is_internal": m.is_internal,
-            "created_at": (m.created_at.isoformat() if m.created_at else None),
-        } for m in t.messages],
-    }
     return out
 
+@router.get("/{department}")
+async def list_by_dept(department: str, school_id: int, response: Response,
+                       cursor: Optional[str] = None, limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+                       _=Depends(require_roles("dept_admin","admin","owner")), db: AsyncSession = Depends(get_async_db)):
+    # payload nằm ở form_submissions (service_tickets không có cột payload_json)
+    q = (select(ServiceTicket.id, ServiceTicket.title, ServiceTicket.status, ServiceTicket.created_at,
+                FormSubmission.payload_json)
+         .outerjoin(FormSubmission, FormSubmission.id == ServiceTicket.form_submission_id)
+         .where(ServiceTicket.school_id==school_id, ServiceTicket.department==department))
+    rows, next_cursor = await paginate(db, q, ServiceTicket.created_at, ServiceTicket.id, cursor, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [{"id":t.id,"title":t.title,"status":t.status,"payload":t.payload_json} for t in rows]
+
+@router.post("/{ticket_id}/status")
+async def update(ticket_id: int, payload: dict, _=Depends(require_roles("dept_admin","admin","owner")), db: AsyncSession = Depends(get_async_db)):
+    new_status = payload.get("status","open")
+
+    def _set_status(s: Session) -> Optional[tuple]:
+        t = s.get(ServiceTicket, ticket_id)
+        if not t:
+            return None
+        previous, t.status = t.status, new_status
+        return t.school_id, t.department, previous
+
+    found = await run_write(db, _set_status)
+    if found is None: return {"ok": False, "error": "not_found"}
+    school_id, department, previous = found
+    if previous != new_status:
+        # Sau commit: client đang mở ticket / hàng đợi phòng ban nhận status mới, không cần gọi lại API
+        await publish_ticket_event({"type": "status", "ticket_id": ticket_id, "status": new_status,
+                                    "previous_status": previous, "department": department, "at": now_iso()},
+                                   school_id, department)
+    return {"ok": True}
+
+class MessageIn(BaseModel):
+    text: str
+    is_internal: Optional[bool] = False
+
 @router.post("/{ticket_id}/messages")
-def add_ticket_message(
+async def add_ticket_message(
     ticket_id: int,
     payload: MessageIn,
     user_payload: dict = Depends(require_roles("owner","admin","dept_admin","student","applicant")),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    t = db.query(ServiceTicket).filter(ServiceTicket.id == ticket_id).first()
-    if not t:
-        raise HTTPException(status_code=404, detail="Ticket not found")
-
     role = user_payload.get("role")
-    sub_email = user_payload.get("sub")
-    author = _get_user_by_email(db, sub_email)
-    if not author:
+    author_id = user_payload.get("user_id")
+    if author_id is None:
         raise HTTPException(status_code=400, detail="User not found")
 
     # Student/applicant chỉ gửi public message (is_internal luôn False)
     is_internal = bool(payload.is_internal and role in ("owner","admin","dept_admin"))
 
-    msg = TicketMessage(
-        ticket_id=t.id,
-        text=payload.text.strip(),
-        is_internal=is_internal,
-        staff_id=(author.id if role in ("owner","admin","dept_admin") else None),
-        user_id=(author.id if role in ("student","applicant") else None),
-    )
-    db.add(msg)
-
-    # bump updated_at
-    t.status = t.status  # no-op để kích hoạt onupdate; hoặc cập nhật status nếu muốn
-    db.commit()
-    db.refresh(msg)
-    db.refresh(t)
-
-    return {
-        "id": msg.id,
-        "ok": True,
-        "created_at": (msg.created_at.isoformat() if msg.created_at else None),
-        "is_internal": msg.is_internal,
-    }
+    def _add_message(s: Session) -> Optional[tuple]:
+        t = s.get(ServiceTicket, ticket_id)
+        if not t:
+            return None
+        # messages chỉ có user_id (người gửi, student hoặc staff) - không có cột staff_id
+        msg = TicketMessage(
+            ticket_id=t.id,
+            text=payload.text.strip(),
+            is_internal=is_internal,
+            user_id=author_id,
+        )
+        s.add(msg)
+        # bump updated_at (gán lại cùng status không tạo UPDATE nên onupdate không chạy)
+        t.updated_at = func.now()
+        s.flush()
+        s.refresh(msg)  # created_at do DB sinh (server_default)
+        out = {
+            "id": msg.id,
+            "ok": True,
+            "created_at": (msg.created_at.isoformat() if msg.created_at else None),
+            "is_internal": msg.is_internal,
+        }
+        return out, msg.text, t.school_id, t.department
+
+    found = await run_write(db, _add_message)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    out, text, school_id, department = found
+    # Internal note: chỉ subscriber là staff nhận (events.Subscription.offer)
+    await publish_ticket_event({
+        "type": "message", "ticket_id": ticket_id, "department": department, "internal": is_internal,
+        "message": {"id": out["id"], "user_id": author_id, "staff_id": None, "text": text,
+                    "is_internal": is_internal, "created_at": out["created_at"]},
+        "at": now_iso(),
+    }, school_id, department)
+    return out
+
+
+# ====== Live updates (SSE / WebSocket) ======
+# Thay cho polling: client mở 1 stream cho ticket đang xem và/hoặc hàng đợi phòng ban, rồi áp dụng event
+# status/message/ticket_created (app/events.py). Khi (re)connect client tải lại snapshot 1 lần;
+# event "resync" = client chậm đã mất event -> tải lại 1 lần.
+# Xác thực: JWT đầy đủ qua header Authorization (WebSocket: header hoặc subprotocol "bearer, <jwt>").
+# EventSource không gửi được header -> ?token= chỉ nhận stream token (POST /tickets/stream-token: scope riêng,
+# sống STREAM_TOKEN_TTL_S giây), để JWT dài hạn không nằm trong URL / access log / history trình duyệt.
+# Stream không giữ DB connection: chỉ dùng DB lúc xác thực.
+Credentials = Tuple[Optional[str], Optional[str]]  # (token, scope): scope None = JWT thường, STREAM_TOKEN_SCOPE = stream token
+
+def _credentials_from(authorization: Optional[str], token: Optional[str]) -> Credentials:
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip(), None
+    return token, STREAM_TOKEN_SCOPE
+
+async def _stream_principal(creds: Credentials, db: AsyncSession) -> Principal:
+    token, scope = creds
+    principal = await resolve_principal(token, db, scope=scope) if token else None
+    if principal is None or principal.role is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    return principal
+
+@router.post("/stream-token")
+async def stream_token(
+    _=Depends(require_roles("owner", "admin", "dept_admin", "student", "applicant")),
+    principal: Principal = Depends(get_principal_optional),
+):
+    """Short-lived token for ?token= on the event streams; request a new one for every (re)connect."""
+    return {"token": create_stream_token(principal), "expires_in": STREAM_TOKEN_TTL_S}
+
+async def _open_ticket_stream(ticket_id: int, creds: Credentials) -> Subscription:
+    async with AsyncSessionLocal() as db:
+        principal = await _stream_principal(creds, db)
+        row = (await db.execute(
+            select(ServiceTicket.user_id, ServiceTicket.school_id).where(ServiceTicket.id == ticket_id)
+        )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    staff = principal.role in STAFF_ROLES
+    if staff:
+        if principal.role != "owner" and principal.school_id is not None and principal.school_id != row.school_id:
+            raise HTTPException(status_code=403, detail="Forbidden")
+    elif principal.role in ("student", "applicant"):
+        # Giống GET /tickets/{id}: student/applicant chỉ theo dõi ticket của mình
+        if principal.id is None or row.user_id != principal.id:
+            raise HTTPException(status_code=403, detail="Forbidden")
+    else:
+        raise HTTPException(status_code=403, detail="Operation not permitted for your role")
+    return ticket_events.subscribe([ticket_topic(ticket_id)], staff=staff)
+
+async def _open_queue_stream(departments: List[str], school_id: Optional[int], creds: Credentials) -> Subscription:
+    async with AsyncSessionLocal() as db:
+        principal = await _stream_principal(creds, db)
+    if principal.role not in STAFF_ROLES:
+        raise HTTPException(status_code=403, detail="Operation not permitted for your role")
+    school_id = school_id if school_id is not None else principal.school_id
+    if school_id is None:
+        raise HTTPException(status_code=400, detail="school_id is required")
+    if principal.role != "owner" and principal.school_id is not None and principal.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    departments = [d for d in dict.fromkeys(departments) if d]
+    if not departments:
+        raise HTTPException(status_code=400, detail="At least one department is required")
+    return ticket_events.subscribe([department_topic(school_id, d) for d in departments], staff=True)
+
+
+async def _sse(sub: Subscription, request: Request):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            event = await sub.get(EVENTS_HEARTBEAT_S)
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": ping\n\n"
+                continue
+            yield f"id: {event.get('seq', '')}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+    finally:
+        ticket_events.unsubscribe(sub)
+
+def _sse_response(sub: Subscription, request: Request) -> StreamingResponse:
+    return StreamingResponse(_sse(sub, request), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/{ticket_id:int}/events")
+async def ticket_event_stream(ticket_id: int, request: Request, token: Optional[str] = None):
+    """Server-Sent Events for one ticket: status changes and new messages."""
+    sub = await _open_ticket_stream(ticket_id, _credentials_from(request.headers.get("authorization"), token))
+    return _sse_response(sub, request)
+
+@router.get("/queue/events")
+async def queue_event_stream(request: Request, department: List[str] = Query(...),
+                             school_id: Optional[int] = None, token: Optional[str] = None):
+    """Server-Sent Events for department queues (?department=A&department=B): new tickets, status changes, messages."""
+    sub = await _open_queue_stream(department, school_id, _credentials_from(request.headers.get("authorization"), token))
+    return _sse_response(sub, request)
+
+
+async def _ws_pump(ws: WebSocket, open_stream):
+    # Trình duyệt: new WebSocket(url, ["bearer", jwt]) -> JWT nằm trong Sec-WebSocket-Protocol, không trong URL
+    protocols = ws.scope.get("subprotocols") or []
+    if len(protocols) >= 2 and protocols[0] == "bearer":
+        creds, subprotocol = (protocols[1], None), "bearer"
+    else:
+        creds, subprotocol = _credentials_from(ws.headers.get("authorization"), ws.query_params.get("token")), None
+    try:
+        sub = await open_stream(creds)
+    except HTTPException as e:
+        await ws.close(code=4000 + e.status_code, reason=str(e.detail))
+        return
+    await ws.accept(subprotocol=subprotocol)
+    # Client không cần gửi gì; đọc để biết lúc client ngắt kết nối
+    receiver = asyncio.create_task(ws.receive_text())
+    try:
+        while True:
+            getter = asyncio.create_task(sub.get(EVENTS_HEARTBEAT_S))
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                receiver.result()   # WebSocketDisconnect nếu client đã đóng
+                receiver = asyncio.create_task(ws.receive_text())
+                continue
+            event = getter.result()
+            await ws.send_json(event if event is not None else {"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Ticket event WebSocket error: {e}")
+    finally:
+        receiver.cancel()
+        ticket_events.unsubscribe(sub)
+
+@router.websocket("/{ticket_id:int}/ws")
+async def ticket_event_socket(ws: WebSocket, ticket_id: int):
+    await _ws_pump(ws, lambda creds: _open_ticket_stream(ticket_id, creds))
+
+@router.websocket("/queue/ws")
+async def queue_event_socket(ws: WebSocket):
+    school_id = ws.query_params.get("school_id")
+    departments = ws.query_params.getlist("department")
+    await _ws_pump(ws, lambda creds: _open_queue_stream(
+        departments, int(school_id) if school_id and school_id.isdigit() else None, creds))
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key onto one in-flight computation.
+    The first caller starts the work as its own task; later callers with the same key
+    await that task instead of starting another one. The key is forgotten as soon as
+    the task finishes, so nothing is cached beyond the in-flight window.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0        # tổng số lần gọi do()
+        self.executions = 0   # số lần thực sự chạy fn
+        self.coalesced = 0    # số lần được gộp vào lần chạy đang diễn ra
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.debug(f"[{self.name}] coalesced onto in-flight call for {key!r}")
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        # shield: 1 client ngắt kết nối (cancel) không huỷ kết quả của những người đang chờ khác
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Đánh dấu exception đã được đọc (tránh warning khi mọi caller đã huỷ)
+            logger.debug(f"[{self.name}] in-flight call for {key!r} failed: {task.exception()}")
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,170 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, Session
+from app.limiter import Overloaded
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# Profile cho các deployment nhỏ chạy thẳng trên file SQLite (DATABASE_URL=sqlite:///./local.db):
+#  - WAL: reader không chặn writer và ngược lại (rollback journal: mọi read chờ sau ticket/form write)
+#  - Mọi write transaction đi qua 1 writer duy nhất (1 thread, 1 connection, BEGIN IMMEDIATE), theo thứ tự FIFO,
+#    thay vì nhiều request tranh nhau lock rồi nhận "database is locked"; read vẫn chạy song song trên engine async.
+# Nhiều worker process: mỗi process có writer riêng, tranh chấp giữa các process chờ theo busy_timeout.
+
+# ====== Config ======
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "1") == "1"                 # 0: giữ hành vi mặc định của driver
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")           # WAL + NORMAL: không fsync mỗi commit, DB không hỏng khi mất điện
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "32768"))   # page cache / connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_WRITER = os.getenv("SQLITE_WRITER", "1") == "1"                   # 0: write chạy trên session của request
+SQLITE_WRITE_MAX_PENDING = int(os.getenv("SQLITE_WRITE_MAX_PENDING", "256"))
+SQLITE_WRITE_RETRY_AFTER = float(os.getenv("SQLITE_WRITE_RETRY_AFTER", "1"))
+
+
+def is_sqlite_file(url: str) -> bool:
+    path = url.split("://", 1)[-1].lstrip("/")
+    return url.startswith("sqlite") and path not in ("", ":memory:") and "mode=memory" not in path
+
+
+def install_pragmas(engine: Engine):
+    """Applies the profile's PRAGMAs to every new connection of `engine` (sync engine or AsyncEngine.sync_engine)."""
+    pragmas = [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KB}",   # số âm = KiB
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def install_immediate_begin(engine: Engine):
+    """
+    Write transactions take the write lock up front (BEGIN IMMEDIATE): a deferred transaction that reads
+    and then writes fails with SQLITE_BUSY, without waiting, when another process committed in between.
+    """
+
+    @event.listens_for(engine, "connect")
+    def _manual_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None   # pysqlite không tự BEGIN nữa
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+class SQLiteWriter:
+    """
+    Single writer for SQLite: write jobs (fn(session) -> result) run one at a time, in FIFO order, on one
+    thread and one connection, each in its own transaction. At most `max_pending` jobs wait; beyond that
+    callers get Overloaded immediately instead of queueing.
+    """
+
+    def __init__(self, engine: Engine, max_pending: int = SQLITE_WRITE_MAX_PENDING):
+        self.engine = engine
+        self.max_pending = max(0, max_pending)
+        self._session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.outstanding = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=500)     # giây chờ trong queue
+        self._services = deque(maxlen=500)  # giây giữ write lock
+        self._done_at = deque(maxlen=500)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+            return self._executor
+
+    def start(self):
+        self._get_executor()
+        logger.info(f"SQLite writer started (journal_mode={SQLITE_JOURNAL_MODE}, synchronous={SQLITE_SYNCHRONOUS}).")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)   # để các write đang chờ commit xong
+                self._executor = None
+        self.engine.dispose()
+
+    def _job(self, fn: Callable[[Session], T], submitted: float):
+        started = time.time()
+        with self._session() as session:
+            try:
+                result = fn(session)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        return result, started - submitted, time.time() - started
+
+    async def run(self, fn: Callable[[Session], T]) -> T:
+        """Runs fn(session) in one write transaction on the writer thread and commits; returns fn's result."""
+        with self._lock:
+            if self.outstanding >= 1 + self.max_pending:
+                self.rejected += 1
+                raise Overloaded("SQLite write queue is full", retry_after=SQLITE_WRITE_RETRY_AFTER)
+            self.outstanding += 1
+        try:
+            result, wait, service = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), self._job, fn, time.time())
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.outstanding -= 1
+        with self._lock:
+            self.completed += 1
+            self._waits.append(max(0.0, wait))
+            self._services.append(service)
+            self._done_at.append(time.monotonic())
+        return result
+
+    def stats(self) -> dict:
+        def pct(vals, p):
+            vals = sorted(vals)
+            return round(vals[min(len(vals) - 1, int(round(p / 100 * (len(vals) - 1))))] * 1000, 1) if vals else None
+        with self._lock:
+            waits, services, done = list(self._waits), list(self._services), list(self._done_at)
+            out = {
+                "max_pending": self.max_pending,
+                "queued": max(0, self.outstanding - 1),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+        span = done[-1] - done[0] if len(done) > 1 else 0
+        out.update({
+            "wait_p50_ms": pct(waits, 50), "wait_p95_ms": pct(waits, 95),
+            "service_p50_ms": pct(services, 50), "service_p95_ms": pct(services, 95),
+            "throughput_per_s": round((len(done) - 1) / span, 2) if span > 0 else None,
+        })
+        return out
@@ -0,0 +1,407 @@
+import os
+import re
+import json
+import bisect
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ====== Paths ======
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+DATA_DIR = os.getenv("STRUCTURED_DATA_DIR", os.path.join(_PROJECT_ROOT, "data"))
+
+# data/<school>/normalized/calendar.json:
+#   {"title", "sources": {id: {title, url}}, "events": [{name, start, end, kind, term?, aliases?, notes?, audience?, source}]}
+#   kind: holiday | term | term_start | term_end | deadline | orientation | program_term | event
+#   audience: chỉ áp dụng cho 1 nhóm (vd. "international") -> chỉ trả lời khi câu hỏi nói tới nhóm đó
+# data/<school>/normalized/buildings.json:
+#   {"title", "campus_address", "sources": {...}, "buildings": [{code?, name, aliases, source}],
+#    "places": [{name, aliases, building, room, source}]}
+
+_RANGE_KINDS = {"term", "program_term"}   # cả kỳ học: không liệt kê khi hỏi về 1 ngày/tháng
+# Năm học bắt đầu từ Summer quarter (tháng 7): "Nov 11" không kèm năm = Nov 11 của năm học đang diễn ra
+ACADEMIC_YEAR_START_MONTH = int(os.getenv("ACADEMIC_YEAR_START_MONTH", "7"))
+_MONTHS = {m: i + 1 for i, m in enumerate(
+    ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"])}
+_MONTH_ALT = "|".join(sorted({m for m in _MONTHS} | {m[:3] for m in _MONTHS} | {"sept"}, key=len, reverse=True))
+_ISO_DATE_RGX = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_MONTH_DAY_RGX = re.compile(rf"\b({_MONTH_ALT})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?", re.IGNORECASE)
+_MONTH_ONLY_RGX = re.compile(rf"\b(?:in|during)\s+({_MONTH_ALT})\b(?:\s+(\d{{4}}))?", re.IGNORECASE)
+_TERM_RGX = re.compile(r"\b(summer|fall|autumn|winter|spring)\b(?!\s+break)(?:\s+(?:quarter|term))?(?:\s+(\d{4}))?", re.IGNORECASE)
+_START_RGX = re.compile(r"\b(?:start|starts|begin|begins|beginning|first\s+day|commence|commences)\b", re.IGNORECASE)
+_END_RGX = re.compile(r"\b(?:end|ends|ending|last\s+day|finish|finishes|over)\b", re.IGNORECASE)
+_DEADLINE_RGX = re.compile(r"\b(?:deadline|deadlines|apply|application)\b", re.IGNORECASE)
+_INTERNATIONAL_RGX = re.compile(r"\b(?:international|f-?1|i-?20|student\s+visa)\b", re.IGNORECASE)
+_QUARTER_RGX = re.compile(r"\b(?:quarter|term)\b", re.IGNORECASE)
+_ORIENTATION_RGX = re.compile(r"\borientation\b", re.IGNORECASE)
+_HOLIDAY_RGX = re.compile(r"\b(?:holiday|holidays|closed|no\s+class(?:es)?|day\s+off)\b", re.IGNORECASE)
+_ROOM_RGX = re.compile(r"\b([A-Z]{2,3})\s?(\d{3,4})\b")
+
+
+def _month_num(token: str) -> int:
+    token = token.lower().rstrip(".")
+    return _MONTHS.get(token) or next(n for m, n in _MONTHS.items() if m.startswith(token[:3]))
+
+def _fmt(d: date) -> str:
+    return f"{d:%a, %b} {d.day}, {d.year}"
+
+def _month_end(first: date) -> date:
+    return (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+def _academic_year(d: date) -> int:
+    """Calendar year in which d's academic year starts."""
+    return d.year if d.month >= ACADEMIC_YEAR_START_MONTH else d.year - 1
+
+def _phrase_rgx(phrases, flags=re.IGNORECASE) -> Optional[re.Pattern]:
+    alts = sorted({r"\s+".join(re.escape(w) for w in p.split()) for p in phrases if p}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(alts) + r")\b", flags) if alts else None
+
+
+# ====== Calendar ======
+@dataclass
+class CalendarEvent:
+    name: str
+    start: date
+    end: date
+    kind: str
+    term: Optional[str] = None
+    notes: Optional[str] = None
+    source: Optional[str] = None
+    aliases: List[str] = field(default_factory=list)
+    audience: Optional[str] = None
+
+    def describe(self) -> str:
+        when = _fmt(self.start) if self.start == self.end else f"{_fmt(self.start)} – {_fmt(self.end)}"
+        return f"- **{self.name}**: {when}" + (f" ({self.notes})" if self.notes else "")
+
+
+class CalendarIndex:
+    """Events sorted by start date (date-range lookups via bisect) plus term and name/alias indexes."""
+
+    def __init__(self, doc: dict):
+        self.title = doc.get("title", "Academic calendar")
+        self.sources = doc.get("sources", {})
+        self.events: List[CalendarEvent] = []
+        for e in doc.get("events", []):
+            start = date.fromisoformat(e["start"])
+            self.events.append(CalendarEvent(
+                name=e["name"], start=start, end=date.fromisoformat(e.get("end") or e["start"]),
+                kind=e.get("kind", "event"), term=e.get("term"), notes=e.get("notes"),
+                source=e.get("source"), aliases=[a.lower() for a in e.get("aliases", [])],
+                audience=e.get("audience"),
+            ))
+        self.events.sort(key=lambda ev: (ev.start, ev.end))
+        self._starts = [ev.start for ev in self.events]
+        self._max_span = max(((ev.end - ev.start).days for ev in self.events), default=0)
+        self.by_term: Dict[Tuple[str, int], List[CalendarEvent]] = {}
+        for ev in self.events:
+            if ev.term:
+                season, _, year = ev.term.lower().partition(" ")
+                self.by_term.setdefault((season, int(year or 0)), []).append(ev)
+        # Tên riêng (holiday) + alias của event -> event; alias chung ("orientation") chỉ dùng kèm term
+        self._by_alias: Dict[str, List[CalendarEvent]] = {}
+        for ev in self.events:
+            names = ev.aliases + ([ev.name.lower()] if ev.kind == "holiday" else [])
+            for a in names:
+                self._by_alias.setdefault(a, []).append(ev)
+        self._alias_rgx = _phrase_rgx(a for a, evs in self._by_alias.items() if all(e.kind == "holiday" for e in evs))
+        self.years = sorted({ev.start.year for ev in self.events})
+
+    def overlapping(self, first: date, last: date) -> List[CalendarEvent]:
+        """Events with start <= last and end >= first."""
+        lo = bisect.bisect_left(self._starts, first - timedelta(days=self._max_span))
+        hi = bisect.bisect_right(self._starts, last)
+        return [ev for ev in self.events[lo:hi] if ev.end >= first]
+
+    def term_instance(self, season: str, year: Optional[int], today: date) -> List[CalendarEvent]:
+        season = "fall" if season == "autumn" else season
+        if year:
+            return self.by_term.get((season, year), [])
+        instances = sorted((y, evs) for (s, y), evs in self.by_term.items() if s == season)
+        if not instances:
+            return []
+        # Kỳ đang diễn ra hoặc sắp tới; dữ liệu chỉ còn kỳ đã qua -> không trả lời (RAG có thể có lịch mới hơn)
+        for _, evs in instances:
+            if max(ev.end for ev in evs) >= today:
+                return evs
+        return []
+
+    def aliases_in(self, question: str, today: date) -> List[CalendarEvent]:
+        if not self._alias_rgx:
+            return []
+        out = []
+        for m in self._alias_rgx.finditer(question):
+            for ev in self._by_alias.get(" ".join(m.group(0).lower().split()), []):
+                if ev not in out:
+                    out.append(ev)
+        # Lần đang diễn ra / sắp tới; không có thì lần trong năm học hiện tại (vd. Thanksgiving vừa qua)
+        upcoming = [ev for ev in out if ev.end >= today]
+        if upcoming:
+            return upcoming
+        return [ev for ev in out if _academic_year(ev.start) == _academic_year(today)]
+
+    def _has_events(self, first: date, last: date) -> bool:
+        return any(ev.kind not in _RANGE_KINDS for ev in self.overlapping(first, last))
+
+    def _guess_year(self, month: int, day: int, today: date, whole_month: bool = False) -> Optional[date]:
+        """
+        Year for a date given without one: the next occurrence if the calendar has events then, otherwise
+        the occurrence inside the academic year containing `today` (e.g. "Nov 11" asked in March).
+        With whole_month=True the check covers the whole month instead of the single day.
+        """
+        def span(d: date) -> Tuple[date, date]:
+            return (d, _month_end(d)) if whole_month else (d, d)
+
+        candidates = []
+        for y in sorted(set(self.years) | {today.year - 1, today.year, today.year + 1}):
+            try:
+                candidates.append(date(y, month, day))
+            except ValueError:
+                pass
+        if not candidates:
+            return None
+        upcoming = next((d for d in candidates if span(d)[1] >= today), None)
+        if upcoming and self._has_events(*span(upcoming)):
+            return upcoming
+        in_year = next((d for d in candidates if _academic_year(d) == _academic_year(today)), None)
+        return in_year or upcoming
+
+    def answer(self, question: str, today: Optional[date] = None) -> Optional[Tuple[str, List[CalendarEvent]]]:
+        today = today or date.today()
+
+        # 1) Ngày cụ thể: "Nov 11", "2025-11-11"
+        day = None
+        m = _ISO_DATE_RGX.search(question)
+        if m:
+            try:
+                day = date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            except ValueError:
+                day = None
+        else:
+            m = _MONTH_DAY_RGX.search(question)
+            if m:
+                month, d = _month_num(m.group(1)), int(m.group(2))
+                try:
+                    day = date(int(m.group(3)), month, d) if m.group(3) else self._guess_year(month, d, today)
+                except ValueError:
+                    day = None
+        if day:
+            events = [ev for ev in self.overlapping(day, day) if ev.kind not in _RANGE_KINDS]
+            if events:
+                return f"On {_fmt(day)}:", events
+            return None
+
+        # 2) Tên riêng: "Thanksgiving", "MLK day"
+        events = self.aliases_in(question, today)
+        if events:
+            return "Here are the dates:", events
+
+        # 3) Kỳ học: "when does winter quarter start", "spring 2026 deadline"
+        m = _TERM_RGX.search(question)
+        if m:
+            term_events = self.term_instance(m.group(1).lower(), int(m.group(2)) if m.group(2) else None, today)
+            if not term_events:
+                return None
+            if _DEADLINE_RGX.search(question):
+                kinds = {"deadline"}
+            elif _ORIENTATION_RGX.search(question):
+                kinds = {"orientation"}
+            elif _START_RGX.search(question):
+                kinds = {"term_start"}
+            elif _END_RGX.search(question):
+                kinds = {"term_end"}
+            else:
+                kinds = {"term"}
+            audiences = {"international"} if _INTERNATIONAL_RGX.search(question) else set()
+            events = [ev for ev in term_events if ev.kind in kinds and (ev.audience is None or ev.audience in audiences)]
+            if events:
+                return f"{term_events[0].term}:", events
+            # Vd. chỉ có deadline cho du học sinh mà câu hỏi không nói "international" -> để RAG trả lời
+            return None
+
+        # 3b) "when does the (next) quarter start" -> kỳ sắp tới
+        if _QUARTER_RGX.search(question) and (_START_RGX.search(question) or _END_RGX.search(question)):
+            kind = "term_start" if _START_RGX.search(question) else "term_end"
+            events = [ev for ev in self.events if ev.kind == kind and ev.start >= today][:1]
+            if events:
+                return f"{events[0].term}:", events
+            return None
+
+        # 4) Tháng: "holidays in November"
+        m = _MONTH_ONLY_RGX.search(question)
+        if m:
+            month = _month_num(m.group(1))
+            year = int(m.group(2)) if m.group(2) else (self._guess_year(month, 1, today, whole_month=True) or today).year
+            first = date(year, month, 1)
+            last = _month_end(first)
+            events = [ev for ev in self.overlapping(first, last) if ev.kind not in _RANGE_KINDS]
+            if _HOLIDAY_RGX.search(question):
+                events = [ev for ev in events if ev.kind == "holiday"]
+            if events:
+                return f"{first.strftime('%B %Y')}:", events
+            return None
+
+        # 5) "upcoming holidays"
+        if _HOLIDAY_RGX.search(question):
+            events = [ev for ev in self.events if ev.kind == "holiday" and ev.end >= today][:5]
+            if events:
+                return "Upcoming holidays and closures:", events
+        return None
+
+
+# ====== Buildings ======
+@dataclass
+class Place:
+    name: str
+    code: Optional[str] = None          # mã toà nhà (BE, SAM, ...)
+    building: Optional[str] = None      # với place: mã toà nhà chứa nó
+    room: Optional[str] = None
+    source: Optional[str] = None
+
+
+class BuildingIndex:
+    """Name/alias index (case-insensitive) plus building codes and room numbers (case-sensitive: "BE" vs "be")."""
+
+    def __init__(self, doc: dict):
+        self.title = doc.get("title", "Campus map")
+        self.sources = doc.get("sources", {})
+        self.campus_address = doc.get("campus_address")
+        self.by_code: Dict[str, Place] = {}
+        self._by_alias: Dict[str, Place] = {}
+        for b in doc.get("buildings", []):
+            p = Place(name=b["name"], code=b.get("code"), source=b.get("source"))
+            if p.code:
+                self.by_code[p.code] = p
+            for a in [p.name] + b.get("aliases", []):
+                self._by_alias[a.lower()] = p
+        for pl in doc.get("places", []):
+            p = Place(name=pl["name"], building=pl.get("building"), room=pl.get("room"), source=pl.get("source"))
+            for a in [p.name] + pl.get("aliases", []):
+                self._by_alias[a.lower()] = p
+        self._alias_rgx = _phrase_rgx(self._by_alias)
+        # Mã 1 ký tự ("P") quá dễ khớp nhầm -> chỉ dùng mã >= 2 ký tự
+        self._code_rgx = _phrase_rgx([c for c in self.by_code if len(c) >= 2], flags=0)
+
+    def find(self, question: str) -> List[Tuple[Place, Optional[str]]]:
+        """[(place, room)] mentioned in the question, in order of appearance."""
+        found: List[Tuple[Place, Optional[str]]] = []
+        for m in _ROOM_RGX.finditer(question):
+            if m.group(1) in self.by_code:
+                found.append((self.by_code[m.group(1)], f"{m.group(1)} {m.group(2)}"))
+        if self._alias_rgx:
+            for m in self._alias_rgx.finditer(question):
+                found.append((self._by_alias[" ".join(m.group(0).lower().split())], None))
+        if self._code_rgx and not found:
+            for m in self._code_rgx.finditer(question):
+                found.append((self.by_code[m.group(0)], None))
+        seen, out = set(), []
+        for place, room in found:
+            if (place.name, room) not in seen:
+                seen.add((place.name, room))
+                out.append((place, room))
+        return out
+
+    def describe(self, place: Place, room: Optional[str]) -> str:
+        if place.code is None and place.building:
+            b = self.by_code.get(place.building)
+            where = f"room **{place.room}**" if place.room else "the building"
+            return f"- **{place.name}**: {where} in {b.name + f' ({b.code})' if b else place.building}"
+        label = f"**{place.code}** — {place.name}" if place.code else f"**{place.name}**"
+        return f"- {label}" + (f": room {room} is in this building" if room else "")
+
+
+# ====== Loader (cache theo mtime) ======
+@dataclass
+class SchoolData:
+    version: Tuple[int, int]
+    calendar: Optional[CalendarIndex]
+    buildings: Optional[BuildingIndex]
+
+_cache: Dict[str, SchoolData] = {}
+_lock = threading.Lock()
+
+def _paths(school: str) -> Tuple[str, str]:
+    base = os.path.join(DATA_DIR, school, "normalized")
+    return os.path.join(base, "calendar.json"), os.path.join(base, "buildings.json")
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+def _load_json(path: str) -> Optional[dict]:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None  # slot chưa có dữ liệu
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Could not load structured data {path}: {e}")
+        return None
+
+def load(school: str) -> SchoolData:
+    """Indexes for the school's normalized datasets, rebuilt when either file changes."""
+    cal_path, bld_path = _paths(school)
+    version = (_mtime(cal_path), _mtime(bld_path))
+    data = _cache.get(school)
+    if data is not None and data.version == version:
+        return data
+    with _lock:
+        data = _cache.get(school)
+        if data is None or data.version != version:
+            cal_doc, bld_doc = _load_json(cal_path), _load_json(bld_path)
+            try:
+                data = SchoolData(version, CalendarIndex(cal_doc) if cal_doc else None,
+                                  BuildingIndex(bld_doc) if bld_doc else None)
+            except Exception as e:
+                logger.error(f"Invalid structured data for {school}: {e}")
+                data = SchoolData(version, None, None)
+            _cache[school] = data
+            logger.info(f"Loaded structured data for {school}: "
+                        f"{len(data.calendar.events) if data.calendar else 0} events, "
+                        f"{len(data.buildings._by_alias) if data.buildings else 0} place aliases")
+    return data
+
+
+def _dataset_sources(index, file_name: str, source_ids) -> List[dict]:
+    out = []
+    for sid in dict.fromkeys(source_ids):
+        meta = index.sources.get(sid, {}) if sid else {}
+        out.append({"type": "dataset", "name": meta.get("title") or index.title, "file": file_name, "url": meta.get("url")})
+    return out or [{"type": "dataset", "name": index.title, "file": file_name, "url": None}]
+
+
+def answer_calendar(school: str, question: str) -> Optional[dict]:
+    cal = load(school).calendar
+    if cal is None:
+        return None
+    hit = cal.answer(question)
+    if hit is None:
+        return None
+    heading, events = hit
+    events = events[:8]
+    return {
+        "answer": heading + "\n" + "\n".join(ev.describe() for ev in events),
+        "sources": _dataset_sources(cal, "calendar.json", [ev.source for ev in events]),
+    }
+
+
+def answer_building(school: str, question: str) -> Optional[dict]:
+    bld = load(school).buildings
+    if bld is None:
+        return None
+    found = bld.find(question)
+    if not found:
+        return None
+    lines = [bld.describe(place, room) for place, room in found[:5]]
+    if bld.campus_address:
+        lines.append(f"\nCampus address: {bld.campus_address}")
+    return {
+        "answer": "\n".join(lines),
+        "sources": _dataset_sources(bld, "buildings.json", [p.source for p, _ in found[:5]]),
+    }
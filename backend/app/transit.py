@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from app.fetch import get_http_client
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ====== Config ======
+# Replace with the actual King County Metro API endpoint (or scripts/fake_transit.py khi test local)
+TRANSIT_API_URL = os.getenv("TRANSIT_API_URL", "YOUR_KING_COUNT_METRO_API_ENDPOINT") # e.g., GTFS-realtime feed or REST API
+TRANSIT_API_KEY = os.getenv("TRANSIT_API_KEY", None) # Optional: Store API key in .env
+TRANSIT_TIMEOUT = float(os.getenv("TRANSIT_TIMEOUT", "5"))
+TRANSIT_CACHE_TTL = float(os.getenv("TRANSIT_CACHE_TTL", "60"))           # giây một kết quả được coi là "fresh"
+TRANSIT_REFRESH_AHEAD = float(os.getenv("TRANSIT_REFRESH_AHEAD", "15"))   # refresh nền khi còn chừng này giây là hết hạn
+TRANSIT_STALE_MAX = float(os.getenv("TRANSIT_STALE_MAX", "600"))          # quá mức này thì không phục vụ bản cũ nữa
+TRANSIT_FRESH_WAIT = float(os.getenv("TRANSIT_FRESH_WAIT", "0.5"))        # chờ refresh tối đa chừng này trước khi trả bản cũ
+TRANSIT_IDLE_EVICT = float(os.getenv("TRANSIT_IDLE_EVICT", "1800"))       # ngừng refresh toạ độ không ai hỏi trong chừng này giây
+
+# --- Define Campus Coordinates (Example: Seattle Central) ---
+# Replace with accurate coordinates for each school, maybe store in DB or config
+CAMPUS_COORDINATES = {
+    "seattle-central-college-demo": (47.6158, -122.3214),
+    # Add other schools
+}
+
+Key = Tuple[float, float, int]
+
+
+def is_configured() -> bool:
+    return bool(TRANSIT_API_URL) and TRANSIT_API_URL != "YOUR_KING_COUNT_METRO_API_ENDPOINT"
+
+
+def format_transit(data) -> str:
+    # --- FORMAT THE RESPONSE (CRITICAL - Adapt to actual API data) ---
+    # Example: Assume API returns a list of stops with routes and arrivals
+    if not data or not isinstance(data, list):
+        return "No nearby transit information found via the API."
+
+    formatted_output = "Nearby Transit Options (Live data via API):\n"
+    for stop in data[:3]: # Limit to first 3 stops for brevity
+        stop_name = stop.get("name", "Unknown Stop")
+        routes = stop.get("routes", [])
+        formatted_output += f"\n📍 **{stop_name}**:\n"
+        if routes:
+            for route in routes[:3]: # Limit routes per stop
+                route_name = route.get("name", "N/A")
+                arrivals = route.get("arrivals", []) # List of arrival times (strings or timestamps)
+                arrival_times = ", ".join(arrivals[:2]) if arrivals else "No upcoming arrivals"
+                formatted_output += f"  - Route {route_name}: {arrival_times}\n"
+        else:
+            formatted_output += "  - No route information available.\n"
+    return formatted_output.strip()
+
+
+async def fetch_transit(latitude: float, longitude: float, radius_meters: int = 500) -> str:
+    """One upstream call through the shared pooled AsyncClient. Raises on HTTP/network errors."""
+    headers = {}
+    if TRANSIT_API_KEY:
+        headers["Authorization"] = f"Bearer {TRANSIT_API_KEY}" # Or appropriate auth scheme
+    params = {"lat": latitude, "lon": longitude, "radius": radius_meters, "realtime": "true"}
+    logger.info(f"Fetching transit info from API near ({latitude}, {longitude})")
+    r = await get_http_client().get(TRANSIT_API_URL, params=params, headers=headers, timeout=TRANSIT_TIMEOUT)
+    r.raise_for_status()
+    return format_transit(r.json())
+
+
+@dataclass
+class _Entry:
+    text: str
+    fetched_at: float
+    last_access: float = field(default_factory=time.monotonic)
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+class TransitCache:
+    """
+    Per-coordinate cache with stale-while-revalidate:
+    fresh (< ttl)      -> served from memory
+    stale (< stale_max) -> a refresh is started; if it is not back within `fresh_wait` the stale text is served
+    missing            -> waits for the upstream call (bounded by TRANSIT_TIMEOUT)
+    A background loop refreshes recently used entries shortly before they expire, so hot
+    coordinates rarely go stale at all. Concurrent refreshes for one coordinate share one call.
+    """
+
+    def __init__(self, ttl: float = TRANSIT_CACHE_TTL, refresh_ahead: float = TRANSIT_REFRESH_AHEAD,
+                 stale_max: float = TRANSIT_STALE_MAX, fresh_wait: float = TRANSIT_FRESH_WAIT,
+                 idle_evict: float = TRANSIT_IDLE_EVICT):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.stale_max = stale_max
+        self.fresh_wait = fresh_wait
+        self.idle_evict = idle_evict
+        self._entries: Dict[Key, _Entry] = {}
+        self._refreshing: Dict[Key, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.stale_served = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def _refresh(self, key: Key) -> asyncio.Task:
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._do_refresh(key))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda t, k=key: self._refreshing.pop(k, None))
+        return task
+
+    async def _do_refresh(self, key: Key) -> Optional[str]:
+        self.refreshes += 1
+        try:
+            text = await fetch_transit(*key)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error fetching transit data for {key}: {e}")
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = _Entry(text, time.monotonic())
+        else:
+            entry.text, entry.fetched_at = text, time.monotonic()
+        return text
+
+    async def get(self, latitude: float, longitude: float, radius_meters: int = 500) -> Optional[str]:
+        key = (round(latitude, 5), round(longitude, 5), int(radius_meters))
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+            age = entry.age()
+            if age < self.ttl:
+                self.hits += 1
+                return entry.text
+            if age < self.stale_max:
+                task = self._refresh(key)
+                try:
+                    text = await asyncio.wait_for(asyncio.shield(task), self.fresh_wait)
+                except asyncio.TimeoutError:
+                    text = None
+                if text is None:
+                    self.stale_served += 1
+                    return entry.text
+                return text
+        self.misses += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._refresh(key)), TRANSIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Transit API timed out for {key}")
+            return None
+
+    async def _refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for key, entry in list(self._entries.items()):
+                if now - entry.last_access > self.idle_evict:
+                    del self._entries[key]   # không ai hỏi nữa -> thôi refresh
+                elif entry.age() >= self.ttl - self.refresh_ahead:
+                    self._refresh(key)
+
+    def start(self, prewarm=()):
+        """Starts the background refresher (call from the app startup hook) and prewarms the given coordinates."""
+        if self._loop_task is None or self._loop_task.done():
+            interval = max(1.0, min(self.refresh_ahead, self.ttl) / 2)
+            self._loop_task = asyncio.ensure_future(self._refresh_loop(interval))
+        for lat, lon in prewarm:
+            self._refresh((round(lat, 5), round(lon, 5), 500))
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        for task in list(self._refreshing.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_served": self.stale_served,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "refreshing": len(self._refreshing),
+        }
+
+
+transit_cache = TransitCache()
+
+
+async def get_transit_info(latitude: float, longitude: float, radius_meters: int = 500) -> Optional[str]:
+    """
+    Nearby transit stops / arrivals for a campus, served from the per-coordinate cache.
+    Returns None when the API is not configured or unavailable (caller falls back to RAG).
+    """
+    if not is_configured():
+        logger.warning("Cannot fetch transit info: Transit API URL not configured.")
+        return None # API not configured
+    return await transit_cache.get(latitude, longitude, radius_meters)
+
+
+async def start_transit_refresher():
+    if is_configured():
+        transit_cache.start(prewarm=CAMPUS_COORDINATES.values())
+
+
+async def stop_transit_refresher():
+    await transit_cache.stop()
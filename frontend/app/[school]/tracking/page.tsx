@@ -2,10 +2,12 @@
 
 import React, { useEffect, useMemo, useState, useCallback } from "react";
 import {
-  getMySubmissions,
+  getMySubmissionsPage,
   getAdminTicketDetail,
   sendAdminTicketMessage,
+  subscribeTicketEvents,
 } from "@/lib/api";
+import type { TicketEvent } from "@/lib/api";
 import StatusBadge from "@/components/StatusBadge";
 import Timeline from "@/components/Timeline";
 import MessageList from "@/components/MessageList";
@@ -47,6 +49,16 @@ type TicketDetail = {
   updated_at: string;
 };
 
+const toSummary = (sub: any): SubmissionSummary => ({
+  id: sub.id,
+  ticket_id: sub.ticket_id ?? null,
+  form_name: sub.form_name ?? "Submission",
+  created_at: sub.created_at,
+  status: sub.status ?? "Submitted",
+  dept: sub.dept ?? undefined,
+  timeline: sub.timeline ?? [],
+});
+
 const STATUSES = [
   "All",
   "Submitted",
@@ -65,6 +77,8 @@ export default function TrackingPage({ params }: { params: { school: string } })
   const [detail, setDetail] = useState<TicketDetail | null>(null);
   const [selectedTicketId, setSelectedTicketId] = useState<number | null>(null);
   const [loadingList, setLoadingList] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loadingDetail, setLoadingDetail] = useState(false);
   const [listError, setListError] = useState<string | null>(null);
   const [detailError, setDetailError] = useState<string | null>(null);
@@ -83,25 +97,34 @@ export default function TrackingPage({ params }: { params: { school: string } })
     setSelectedTicketId(null);
     setDetail(null);
     try {
-      const submissions = await getMySubmissions(school);
-      const mappedList: SubmissionSummary[] = submissions.map((sub: any) => ({
-        id: sub.id,
-        ticket_id: sub.ticket_id ?? null,
-        form_name: sub.form_name ?? "Submission",
-        created_at: sub.created_at,
-        status: sub.status ?? "Submitted",
-        dept: sub.dept ?? undefined,
-        timeline: sub.timeline ?? [],
-      }));
-      setList(mappedList);
+      // Trang đầu (mới nhất trước); search / filter status áp dụng trên các trang đã tải
+      const page = await getMySubmissionsPage(school);
+      setList(page.items.map(toSummary));
+      setNextCursor(page.nextCursor);
     } catch (error: any) {
       setListError(error?.message || "Could not load your submissions.");
       setList([]);
+      setNextCursor(null);
     } finally {
       setLoadingList(false);
     }
   }, [school]);
 
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await getMySubmissionsPage(school, nextCursor);
+      const more = page.items.map(toSummary);
+      setList((prev) => [...prev, ...more.filter((s: SubmissionSummary) => !prev.some((p) => p.id === s.id))]);
+      setNextCursor(page.nextCursor);
+    } catch (error: any) {
+      setListError(error?.message || "Could not load more submissions.");
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [school, nextCursor, loadingMore]);
+
   const loadDetail = useCallback(async (ticketId: number) => {
     if (!ticketId) return;
     setLoadingDetail(true);
@@ -117,13 +140,40 @@ export default function TrackingPage({ params }: { params: { school: string } })
     }
   }, []);
 
+  // Áp dụng event server push (status / message) vào state, không tải lại detail
+  const applyTicketEvent = useCallback((ev: TicketEvent) => {
+    if (ev.type === "message" && ev.message) {
+      const m = ev.message;
+      setDetail((d) =>
+        d && d.id === ev.ticket_id && !d.messages?.some((x) => x.id === m.id)
+          ? {
+              ...d,
+              messages: [...(d.messages || []), { ...m, staff_id: m.staff_id ?? undefined }],
+              updated_at: ev.at ?? d.updated_at,
+            }
+          : d
+      );
+    } else if (ev.type === "status" && ev.status) {
+      const status = ev.status;
+      setDetail((d) => (d && d.id === ev.ticket_id ? { ...d, status, updated_at: ev.at ?? d.updated_at } : d));
+      setList((prev) => prev.map((s) => (s.ticket_id === ev.ticket_id ? { ...s, status } : s)));
+    }
+  }, []);
+
   const handleSendMessage = useCallback(
     async (text: string) => {
       if (!selectedTicketId) return;
-      await sendAdminTicketMessage(selectedTicketId, text);
-      await loadDetail(selectedTicketId);
+      const res = await sendAdminTicketMessage(selectedTicketId, text);
+      // Stream cũng gửi lại message này; thêm ngay từ response (trùng id thì bỏ qua)
+      if (res?.id) {
+        applyTicketEvent({
+          type: "message",
+          ticket_id: selectedTicketId,
+          message: { id: res.id, text, is_internal: false, created_at: res.created_at },
+        });
+      }
     },
-    [selectedTicketId, loadDetail]
+    [selectedTicketId, applyTicketEvent]
   );
 
   const handleDocUploaded = useCallback(
@@ -144,6 +194,29 @@ export default function TrackingPage({ params }: { params: { school: string } })
     else setDetail(null);
   }, [selectedTicketId, loadDetail]);
 
+  // Live update cho ticket đang mở (thay cho việc tải lại detail). Mỗi lần stream (re)connect hoặc báo
+  // "resync" thì tải lại detail 1 lần, phòng trường hợp đã lỡ event lúc mất kết nối.
+  useEffect(() => {
+    if (!selectedTicketId) return;
+    let active = true;
+    const refresh = () => {
+      getAdminTicketDetail(school, selectedTicketId)
+        .then((d) => {
+          if (active) setDetail(d);
+        })
+        .catch(() => {}); // giữ detail đang hiển thị
+    };
+    const unsubscribe = subscribeTicketEvents(
+      selectedTicketId,
+      (ev) => (ev.type === "resync" ? refresh() : applyTicketEvent(ev)),
+      refresh
+    );
+    return () => {
+      active = false;
+      unsubscribe();
+    };
+  }, [selectedTicketId, school, applyTicketEvent]);
+
   const filteredList = useMemo(() => {
     let arr = [...list];
     if (filterStatus !== "All") arr = arr.filter((x) => x.status === filterStatus);
@@ -291,6 +364,16 @@ export default function TrackingPage({ params }: { params: { school: string } })
                 ))}
               </div>
             )}
+            {!loadingList && !listError && nextCursor && (
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="w-full p-3 text-sm font-medium text-blue-600 hover:bg-slate-50 disabled:text-slate-400 flex items-center justify-center gap-2 border-t border-slate-100"
+              >
+                {loadingMore && <Loader2 size={14} className="animate-spin" />}
+                {loadingMore ? "Loading…" : "Load more"}
+              </button>
+            )}
           </motion.aside>
 
           <AnimatePresence>
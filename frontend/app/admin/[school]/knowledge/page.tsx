@@ -6,7 +6,7 @@ import { UploadCloud, FileText, Globe, Loader2, FilePen, Trash2, RefreshCw, Aler
 // --- Import react-dropzone ---
 import { useDropzone, FileRejection, Accept } from 'react-dropzone';
 // --- Import API functions ---
-import { listDocuments, deleteDocument, ingestDocument } from "@/lib/api"; // Ensure these functions are correctly defined and exported in lib/api.ts
+import { listDocumentsPage, deleteDocument, ingestDocument } from "@/lib/api"; // Ensure these functions are correctly defined and exported in lib/api.ts
 
 // --- Component IngestForm (SỬ DỤNG REACT-DROPZONE) ---
 function IngestForm({ school, onIngestSuccess }: { school: string; onIngestSuccess: (count: number) => void }) {
@@ -190,22 +190,37 @@ function KnowledgeList({ school, refreshKey }: { school: string; refreshKey: num
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [deletingId, setDeletingId] = useState<number | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  // Fetch documents function (memoized)
+  // Fetch documents function (memoized) - trang đầu; các trang sau qua "Load more" (cursor X-Next-Cursor)
   const fetchDocuments = useCallback(async () => {
     console.log(`Fetching documents for ${school}...`);
     setLoading(true); setError(null);
     try {
-      const data = await listDocuments(school);
-      console.log("Documents received:", data);
-      setDocs(data || []);
+      const page = await listDocumentsPage(school);
+      setDocs(page.items || []);
+      setNextCursor(page.nextCursor);
     } catch (err: any) {
       console.error("Failed to load documents:", err);
       setError(err.message || "Failed to load documents.");
       setDocs([]);
+      setNextCursor(null);
     } finally { setLoading(false); }
   }, [school]);
 
+  const loadMoreDocuments = useCallback(async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await listDocumentsPage(school, nextCursor);
+      setDocs(prev => [...prev, ...page.items.filter((d: DocumentData) => !prev.some(p => p.id === d.id))]);
+      setNextCursor(page.nextCursor);
+    } catch (err: any) {
+      setError(err.message || "Failed to load more documents.");
+    } finally { setLoadingMore(false); }
+  }, [school, nextCursor, loadingMore]);
+
   // Load documents on mount or when refreshKey changes
   useEffect(() => { fetchDocuments(); }, [fetchDocuments, refreshKey]);
 
@@ -309,6 +324,18 @@ function KnowledgeList({ school, refreshKey }: { school: string; refreshKey: num
           </tbody>
         </table>
       </div>
+      {!loading && nextCursor && (
+        <div className="mt-4 flex justify-center">
+          <button
+            onClick={loadMoreDocuments}
+            disabled={loadingMore}
+            className="inline-flex items-center gap-1.5 px-3 py-1.5 rounded-lg border border-slate-300 bg-white text-sm font-medium text-slate-700 hover:bg-slate-50 disabled:opacity-50 transition-colors"
+          >
+            {loadingMore && <Loader2 size={14} className="animate-spin" />}
+            {loadingMore ? "Loading..." : "Load more"}
+          </button>
+        </div>
+      )}
     </motion.div>
   );
 }
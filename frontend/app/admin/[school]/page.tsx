@@ -6,7 +6,7 @@ import {
   BarChart2, Database, Ticket, Users, AlertTriangle, Wifi, Cloud, Zap, Cpu, Clock, Loader2 
 } from "lucide-react";
 import { ResponsiveContainer, BarChart, Bar, XAxis, YAxis, Tooltip, Cell } from 'recharts'; 
-import { apiFetch, getInsightsSummary, listDocuments } from "@/lib/api";
+import { apiFetch, getInsightsSummary, countDocuments } from "@/lib/api";
 
 const COLORS = ["#3b82f6", "#10b981", "#8b5cf6", "#f97316", "#ef4444", "#06b6d4"];
 
@@ -58,8 +58,7 @@ export default function AdminDashboardPage({ params }: { params: { school: strin
       // Fetch Document Count
       setLoadingDocs(true);
       try {
-         const docsData = await listDocuments(school);
-         setDocCount(docsData?.length ?? 0);
+         setDocCount(await countDocuments(school));
       } catch (err: any) { setError(err.message || "Failed to load documents."); }
       finally { setLoadingDocs(false); }
     };
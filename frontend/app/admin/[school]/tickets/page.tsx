@@ -1,11 +1,15 @@
 "use client";
 import React, { useState, useEffect, useMemo, useCallback } from "react";
 import {
-  getAdminTickets,
+  getAdminTicketsPage,
+  getAdminTicketFacets,
   getAdminTicketDetail,
   updateAdminTicketStatus,
   sendAdminTicketMessage,
+  subscribeTicketEvents,
+  subscribeQueueEvents,
 } from "@/lib/api";
+import type { TicketFacets, TicketEvent } from "@/lib/api";
 import { Loader2, AlertTriangle, Inbox, Filter, ChevronRight, MessageSquare } from "lucide-react";
 import StatusBadge from "@/components/StatusBadge";
 import { motion, AnimatePresence } from "framer-motion";
@@ -37,44 +41,86 @@ type TicketDetail = TicketSummary & {
   messages?: TicketMessage[];
 };
 
+const DEPARTMENTS = ["International", "Admissions", "Registrar", "Student Services"];
+
 // --- Trang chính ---
 export default function AdminTicketsPage({ params }: { params: { school: string } }) {
   const { school } = params;
   const [tickets, setTickets] = useState<TicketSummary[]>([]);
   const [selectedTicket, setSelectedTicket] = useState<TicketDetail | null>(null);
   const [loadingList, setLoadingList] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loadingDetail, setLoadingDetail] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [filterStatus, setFilterStatus] = useState("All");
   const [filterDept, setFilterDept] = useState("All");
+  const [facets, setFacets] = useState<TicketFacets | null>(null);
 
   const prettySchool = useMemo(
     () => (school ? school.replace(/-/g, " ").replace(/\b\w/g, (c) => c.toUpperCase()) : "Admin"),
     [school]
   );
 
-  // Load ticket list (LIVE)
+  // Load ticket list (LIVE) - trang đầu; các trang sau qua "Load more" (cursor X-Next-Cursor)
+  const listFilters = useMemo(
+    () => ({
+      status: filterStatus !== "All" ? filterStatus : undefined,
+      department: filterDept !== "All" ? filterDept : undefined,
+    }),
+    [filterStatus, filterDept]
+  );
+
   const loadTickets = useCallback(async () => {
     setLoadingList(true);
     setError(null);
     try {
-      const data = await getAdminTickets(school, {
-        status: filterStatus !== "All" ? filterStatus : undefined,
-        department: filterDept !== "All" ? filterDept : undefined,
-      });
-      setTickets(data || []);
+      const page = await getAdminTicketsPage(school, listFilters);
+      setTickets(page.items || []);
+      setNextCursor(page.nextCursor);
     } catch (err: any) {
       setError(err?.message || "Failed to load tickets.");
       setTickets([]);
+      setNextCursor(null);
     } finally {
       setLoadingList(false);
     }
-  }, [school, filterStatus, filterDept]);
+  }, [school, listFilters]);
+
+  const loadMoreTickets = useCallback(async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await getAdminTicketsPage(school, listFilters, nextCursor);
+      // Ticket mới vào giữa chừng có thể đẩy 1 dòng sang trang sau -> bỏ trùng id
+      setTickets((prev) => [...prev, ...page.items.filter((t: TicketSummary) => !prev.some((p) => p.id === t.id))]);
+      setNextCursor(page.nextCursor);
+    } catch (err: any) {
+      setError(err?.message || "Failed to load more tickets.");
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [school, listFilters, nextCursor, loadingMore]);
 
   useEffect(() => {
     loadTickets();
   }, [loadTickets]);
 
+  // Counts theo filter lấy từ server (list chỉ chứa 1 trang nên không đếm ở client được)
+  useEffect(() => {
+    getAdminTicketFacets(school).then(setFacets).catch(() => setFacets(null));
+  }, [school]);
+
+  const countFor = useCallback(
+    (status: string, dept: string): number | null => {
+      if (!facets) return null;
+      return facets.cells
+        .filter((c) => (status === "All" || c.status === status) && (dept === "All" || c.department === dept))
+        .reduce((sum, c) => sum + c.count, 0);
+    },
+    [facets]
+  );
+
   // Chọn ticket => load detail (LIVE)
   const handleSelectTicket = useCallback(
     async (ticketId: number | null) => {
@@ -97,6 +143,76 @@ export default function AdminTicketsPage({ params }: { params: { school: string
     []
   );
 
+  // Live update (server push sau khi commit) thay cho việc tải lại detail / list sau mỗi thao tác
+  const refreshFacets = useCallback(() => {
+    getAdminTicketFacets(school).then(setFacets).catch(() => {});
+  }, [school]);
+
+  const selectedId = selectedTicket?.id;
+  useEffect(() => {
+    if (!selectedId) return;
+    let active = true;
+    // (Re)connect hoặc "resync": tải lại detail 1 lần phòng trường hợp đã lỡ event
+    const refresh = () => {
+      getAdminTicketDetail(school, selectedId)
+        .then((d) => {
+          if (active) setSelectedTicket(d);
+        })
+        .catch(() => {});
+    };
+    const unsubscribe = subscribeTicketEvents(
+      selectedId,
+      (ev: TicketEvent) => {
+        if (ev.type === "resync") return refresh();
+        setSelectedTicket((t) => {
+          if (!t || t.id !== ev.ticket_id) return t;
+          if (ev.type === "status" && ev.status) return { ...t, status: ev.status, updated_at: ev.at ?? t.updated_at };
+          const m = ev.message;
+          if (ev.type === "message" && m && !t.messages?.some((x) => x.id === m.id)) {
+            return { ...t, messages: [...(t.messages || []), { ...m, staff_id: m.staff_id ?? undefined }], updated_at: ev.at ?? t.updated_at };
+          }
+          return t;
+        });
+      },
+      refresh
+    );
+    return () => {
+      active = false;
+      unsubscribe();
+    };
+  }, [selectedId, school]);
+
+  // Hàng đợi phòng ban đang lọc (All = mọi phòng ban, vẫn chỉ 1 kết nối)
+  useEffect(() => {
+    const departments = filterDept !== "All" ? [filterDept] : DEPARTMENTS;
+    let connected = false;
+    return subscribeQueueEvents(
+      departments,
+      (ev: TicketEvent) => {
+        if (ev.type === "status" && ev.status && filterStatus === "All") {
+          const status = ev.status;
+          setTickets((prev) => prev.map((t) => (t.id === ev.ticket_id ? { ...t, status, updated_at: ev.at ?? t.updated_at } : t)));
+        } else if (ev.type === "message") {
+          setTickets((prev) => prev.map((t) => (t.id === ev.ticket_id ? { ...t, updated_at: ev.at ?? t.updated_at } : t)));
+          return; // counts không đổi
+        } else {
+          // ticket mới / status ra-vào filter hiện tại / resync: tải lại trang đầu của list
+          loadTickets();
+        }
+        refreshFacets();
+      },
+      () => {
+        // Reconnect: event trong lúc mất kết nối không được phát lại -> tải lại list + counts.
+        // Lần mở đầu tiên bỏ qua (effect load list ban đầu đã tải)
+        if (connected) {
+          loadTickets();
+          refreshFacets();
+        }
+        connected = true;
+      }
+    );
+  }, [filterDept, filterStatus, loadTickets, refreshFacets]);
+
   // Format date helper
   const formatDate = (isoString: string | null | undefined): string => {
     if (!isoString) return "N/A";
@@ -142,12 +258,11 @@ export default function AdminTicketsPage({ params }: { params: { school: string
             }}
             className="text-sm border-slate-300 rounded-md shadow-sm focus:ring-blue-500 focus:border-blue-500 py-1.5"
           >
-            <option>All</option>
-            <option>Open</option>
-            <option>In review</option>
-            <option>Needs Info</option>
-            <option>Closed</option>
-            <option>Rejected</option>
+            {["All", "Open", "In review", "Needs Info", "Closed", "Rejected"].map((s) => (
+              <option key={s} value={s}>
+                {s}{facets ? ` (${countFor(s, filterDept)})` : ""}
+              </option>
+            ))}
           </select>
         </div>
 
@@ -164,11 +279,11 @@ export default function AdminTicketsPage({ params }: { params: { school: string
             }}
             className="text-sm border-slate-300 rounded-md shadow-sm focus:ring-blue-500 focus:border-blue-500 py-1.5"
           >
-            <option>All</option>
-            <option>International</option>
-            <option>Admissions</option>
-            <option>Registrar</option>
-            <option>Student Services</option>
+            {["All", ...DEPARTMENTS].map((d) => (
+              <option key={d} value={d}>
+                {d}{facets ? ` (${countFor(filterStatus, d)})` : ""}
+              </option>
+            ))}
           </select>
         </div>
       </motion.div>
@@ -191,7 +306,7 @@ export default function AdminTicketsPage({ params }: { params: { school: string
           className="bg-white rounded-2xl border border-slate-200 shadow-soft h-full flex flex-col"
         >
           <h3 className="text-base font-semibold p-4 border-b border-slate-200 flex-shrink-0">
-            Tickets ({loadingList ? "..." : tickets.length})
+            Tickets ({loadingList ? "..." : countFor(filterStatus, filterDept) ?? tickets.length})
           </h3>
 
           {loadingList ? (
@@ -227,6 +342,16 @@ export default function AdminTicketsPage({ params }: { params: { school: string
                   <div className="text-xs text-slate-400 mt-0.5">Updated: {formatDate(t.updated_at)}</div>
                 </button>
               ))}
+              {nextCursor && (
+                <button
+                  onClick={loadMoreTickets}
+                  disabled={loadingMore}
+                  className="w-full p-3 text-sm font-medium text-blue-600 hover:bg-slate-50 disabled:text-slate-400 flex items-center justify-center gap-2"
+                >
+                  {loadingMore && <Loader2 size={14} className="animate-spin" />}
+                  {loadingMore ? "Loading..." : "Load more"}
+                </button>
+              )}
             </div>
           )}
         </motion.div>
@@ -246,13 +371,25 @@ export default function AdminTicketsPage({ params }: { params: { school: string
                 ticket={selectedTicket}
                 formatDate={formatDate}
                 onStatusChange={async (newStatus) => {
-                  await updateAdminTicketStatus(selectedTicket.id, newStatus);
-                  await handleSelectTicket(selectedTicket.id);
-                  await loadTickets(); // cập nhật lại list
+                  const ticketId = selectedTicket.id;
+                  try {
+                    await updateAdminTicketStatus(ticketId, newStatus);
+                  } catch (err: any) {
+                    setError(err?.message || `Failed to update ticket #${ticketId}.`);
+                    return;
+                  }
+                  // List, counts và các tab khác cập nhật qua event "status" (stream hàng đợi / ticket)
+                  setSelectedTicket((t) => (t && t.id === ticketId ? { ...t, status: newStatus } : t));
                 }}
                 onSendMessage={async (text, isInternal) => {
-                  await sendAdminTicketMessage(selectedTicket.id, text, isInternal);
-                  await handleSelectTicket(selectedTicket.id);
+                  const ticketId = selectedTicket.id;
+                  const res = await sendAdminTicketMessage(ticketId, text, isInternal);
+                  // Stream cũng gửi lại message này; thêm ngay từ response (trùng id thì bỏ qua)
+                  setSelectedTicket((t) =>
+                    t && t.id === ticketId && res?.id && !t.messages?.some((x) => x.id === res.id)
+                      ? { ...t, messages: [...(t.messages || []), { id: res.id, text, is_internal: res.is_internal, created_at: res.created_at }] }
+                      : t
+                  );
                 }}
               />
             </motion.div>
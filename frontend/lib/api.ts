@@ -1,4 +1,4 @@
-import { authHeaders } from "./auth";
+import { authHeaders, getToken } from "./auth";
 
 const DEFAULT_BASE = process.env.NEXT_PUBLIC_BACKEND_URL || "";
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || process.env.NEXT_PUBLIC_BACKEND_URL || '';
@@ -177,14 +177,11 @@ export async function ask(school: string, question: string) {
 }
 
 
-// Lấy danh sách submission của user
-export async function getMySubmissions(schoolSlug: string): Promise<any[]> {
+// Submission của user theo trang (mới nhất trước); truyền nextCursor của trang trước để lấy trang tiếp theo
+export async function getMySubmissionsPage(schoolSlug: string, cursor?: string | null) {
   if (!schoolSlug) throw new Error("School slug required for fetching submissions.");
-  console.log(`Fetching submissions for ${schoolSlug}...`); 
   try {
-      const submissions = await apiFetch(`/forms/my-submissions?school=${encodeURIComponent(schoolSlug)}`);
-      console.log(`Received ${submissions?.length ?? 0} submissions.`); 
-      return submissions || []; 
+      return await apiFetchPage(`/forms/my-submissions?school=${encodeURIComponent(schoolSlug)}`, cursor);
   } catch (error) {
        console.error(`Failed to get submissions for ${schoolSlug}:`, error);
        throw error; 
@@ -197,21 +194,41 @@ export async function getAdminTicketDetail(schoolSlug: string, ticketId: number)
   return apiFetch(`/admin/tickets/${ticketId}?school=${encodeURIComponent(schoolSlug)}`);
 }
 
-export async function getAdminTickets(schoolSlug: string, filters: { status?: string, department?: string } = {}): Promise<any[]> {
+/**
+ * Một trang của API danh sách (keyset pagination): body là mảng, cursor trang sau nằm ở header X-Next-Cursor.
+ */
+export async function apiFetchPage<T = any>(endpoint: string, cursor?: string | null): Promise<{ items: T[]; nextCursor: string | null }> {
+  const url = cursor ? `${endpoint}${endpoint.includes("?") ? "&" : "?"}cursor=${encodeURIComponent(cursor)}` : endpoint;
+  const response = await fetch(`${DEFAULT_BASE}${url}`, { headers: { ...authHeaders() } });
+  if (!response.ok) {
+    throw new Error(`API Error: Request failed with status ${response.status}`);
+  }
+  return { items: await response.json(), nextCursor: response.headers.get("X-Next-Cursor") };
+}
+
+// Ticket admin theo trang (mới nhất trước); truyền nextCursor của trang trước để lấy trang tiếp theo
+export async function getAdminTicketsPage(schoolSlug: string, filters: { status?: string, department?: string } = {}, cursor?: string | null) {
   if (!schoolSlug) throw new Error("School slug required for fetching admin tickets.");
-  console.log(`Fetching admin tickets for ${schoolSlug} with filters:`, filters); // Log
-  try {
-      const queryParams = new URLSearchParams({ school: schoolSlug });
-      if (filters.status && filters.status !== 'All') queryParams.append('status', filters.status);
-      if (filters.department && filters.department !== 'All') queryParams.append('department', filters.department);
+  const queryParams = new URLSearchParams({ school: schoolSlug });
+  if (filters.status && filters.status !== 'All') queryParams.append('status', filters.status);
+  if (filters.department && filters.department !== 'All') queryParams.append('department', filters.department);
+  return apiFetchPage(`/admin/tickets?${queryParams.toString()}`, cursor);
+}
 
-      const tickets = await apiFetch(`/admin/tickets?${queryParams.toString()}`);
-      console.log(`Received ${tickets?.length ?? 0} admin tickets.`); 
-      return tickets || [];
-  } catch (error) {
-      console.error(`Failed to fetch admin tickets for ${schoolSlug}:`, error);
-      throw error; 
-  }
+export type TicketFacets = {
+  total: number;
+  by_status: Record<string, number>;
+  by_department: Record<string, number>;
+  by_age: Record<string, number>;
+  cells: { status: string; department: string; age: string; count: number }[];
+  computed_at: string;
+  cached: boolean;
+};
+
+// Số ticket theo status / department / độ tuổi (server đếm bằng GROUP BY, cache ngắn)
+export async function getAdminTicketFacets(schoolSlug: string): Promise<TicketFacets> {
+  if (!schoolSlug) throw new Error("School slug required for fetching ticket facets.");
+  return apiFetch(`/admin/tickets/facets?school=${encodeURIComponent(schoolSlug)}`);
 }
 
 export async function updateAdminTicketStatus(ticketId: number, status: string): Promise<any> {
@@ -230,6 +247,96 @@ export async function updateAdminTicketStatus(ticketId: number, status: string):
  }
 }
 
+// Live update cho ticket (SSE): server push status / message sau khi commit, thay cho việc gọi lại detail / list.
+// Mỗi lần (re)connect xin stream token mới; onOpen chạy mỗi lần (re)connect -> caller tải snapshot 1 lần rồi áp dụng event.
+export type TicketEvent = {
+  type: "status" | "message" | "ticket_created" | "resync";
+  ticket_id?: number;
+  status?: string;
+  previous_status?: string;
+  department?: string;
+  title?: string;
+  internal?: boolean;
+  message?: {
+    id: number;
+    user_id?: number;
+    staff_id?: number | null;
+    text: string;
+    is_internal?: boolean;
+    created_at: string;
+  };
+  at?: string;
+};
+
+const TICKET_EVENT_TYPES = ["status", "message", "ticket_created", "resync"];
+
+const STREAM_RETRY_MS = 3000;
+
+// Token ngắn hạn, chỉ mở được event stream: EventSource không gửi được header Authorization nên token phải
+// nằm trong URL, và JWT đăng nhập không được xuất hiện ở đó (access log, proxy log, history)
+async function getStreamToken(): Promise<string> {
+  const res = await apiFetch("/tickets/stream-token", { method: "POST" });
+  return res.token;
+}
+
+function openTicketEventStream(path: string, onEvent: (e: TicketEvent) => void, onOpen?: () => void): () => void {
+  if (typeof window === "undefined" || typeof EventSource === "undefined" || !getToken()) return () => {};
+  let es: EventSource | null = null;
+  let closed = false;
+  let retry: ReturnType<typeof setTimeout> | undefined;
+  const handler = (e: MessageEvent) => {
+    try {
+      onEvent(JSON.parse(e.data));
+    } catch (err) {
+      console.error("Bad ticket event:", err);
+    }
+  };
+  const reconnect = () => {
+    if (!closed) retry = setTimeout(connect, STREAM_RETRY_MS);
+  };
+  const connect = async () => {
+    let token: string;
+    try {
+      token = await getStreamToken();
+    } catch {
+      return reconnect();
+    }
+    if (closed) return;
+    const sep = path.includes("?") ? "&" : "?";
+    es = new EventSource(`${DEFAULT_BASE}${path}${sep}token=${encodeURIComponent(token)}`);
+    TICKET_EVENT_TYPES.forEach((t) => es!.addEventListener(t, handler as EventListener));
+    if (onOpen) es.onopen = () => onOpen();
+    // Stream token hết hạn sau ~1 phút -> không để EventSource tự reconnect bằng token cũ
+    es.onerror = () => {
+      es?.close();
+      reconnect();
+    };
+  };
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(retry);
+    es?.close();
+  };
+}
+
+export function subscribeTicketEvents(ticketId: number, onEvent: (e: TicketEvent) => void, onOpen?: () => void) {
+  return openTicketEventStream(`/tickets/${ticketId}/events`, onEvent, onOpen);
+}
+
+// Hàng đợi phòng ban (staff): ticket mới, đổi status, message mới. schoolId mặc định = trường của token
+export function subscribeQueueEvents(
+  departments: string[],
+  onEvent: (e: TicketEvent) => void,
+  onOpen?: () => void,
+  schoolId?: number
+) {
+  const qs = new URLSearchParams();
+  departments.forEach((d) => qs.append("department", d));
+  if (schoolId) qs.set("school_id", String(schoolId));
+  return openTicketEventStream(`/tickets/queue/events?${qs.toString()}`, onEvent, onOpen);
+}
+
 // Gửi tin nhắn vào ticket
 export async function sendAdminTicketMessage(ticketId: number, text: string, isInternal = false) {
   if (!text?.trim()) throw new Error("Message cannot be empty.");
@@ -248,19 +355,26 @@ export async function listFormsForSchool(schoolSlug: string): Promise<any[]> {
 
 // KNOWLEDGE
 /**
- * Lấy danh sách các knowledge documents đã ingest cho trường.
+ * Một trang knowledge documents đã ingest cho trường (mới nhất trước); trang sau qua nextCursor.
  */
-export async function listDocuments(schoolSlug: string): Promise<any[]> { 
+export async function listDocumentsPage(schoolSlug: string, cursor?: string | null) {
   try {
     // Gọi endpoint GET /admin/documents?school=slug
-    const documents = await apiFetch(`/admin/documents?school=${encodeURIComponent(schoolSlug)}`);
-    return documents || []; // Trả về list hoặc mảng rỗng
+    return await apiFetchPage(`/admin/documents?school=${encodeURIComponent(schoolSlug)}`, cursor);
   } catch (error) {
     console.error(`Failed to list documents for ${schoolSlug}:`, error);
     throw error; // Ném lỗi để component UI xử lý
   }
 }
 
+/**
+ * Số knowledge documents của trường (dashboard) - không tải danh sách.
+ */
+export async function countDocuments(schoolSlug: string): Promise<number> {
+  const res = await apiFetch(`/admin/documents/count?school=${encodeURIComponent(schoolSlug)}`);
+  return res?.count ?? 0;
+}
+
 /**
  * Xóa một knowledge document.
  */
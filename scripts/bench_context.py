@@ -0,0 +1,77 @@
+# scripts/bench_context.py
+# So sánh prompt tokens (và latency end-to-end khi online) giữa context nguyên top-k và context đã pack.
+#   python scripts/bench_context.py --school seattle-central-college
+#   python scripts/bench_context.py --school seattle-central-college --questions qs.txt --budget 1200 --answer
+import os, sys, time, argparse, statistics
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from backend.app import rag
+
+DEFAULT_QUESTIONS = [q for _, q in rag.BASIC_QUERIES] + [
+    "When does winter quarter start?",
+    "How much is tuition for international students?",
+    "How do I request an official transcript?",
+    "What are the English proficiency requirements?",
+    "Where can I get counseling services?",
+]
+
+def read_questions(path):
+    if not path:
+        return DEFAULT_QUESTIONS
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def prompt_tokens(school, question, budget):
+    chunks, metas, ctx = rag.retrieve_verified(school, question, k=8, budget_tokens=budget)
+    prompt = rag._build_verified_prompt(school.replace("-", " ").title(), ctx, question)
+    return rag.estimate_tokens(prompt), len(chunks)
+
+def answer_latency_ms(school, question, budget):
+    old = rag.CONTEXT_TOKEN_BUDGET
+    rag.CONTEXT_TOKEN_BUDGET = budget
+    try:
+        t0 = time.perf_counter()
+        rag.answer_verified(school, question)
+        return (time.perf_counter() - t0) * 1000
+    finally:
+        rag.CONTEXT_TOKEN_BUDGET = old
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--school", required=True)
+    ap.add_argument("--questions", help="file with one question per line (default: built-in mix)")
+    ap.add_argument("--budget", type=int, default=rag.CONTEXT_TOKEN_BUDGET, help="packed context budget (tokens)")
+    ap.add_argument("--answer", action="store_true", help="also time answer_verified (calls Bedrock when online)")
+    args = ap.parse_args()
+
+    questions = read_questions(args.questions)
+    rows = []
+    for q in questions:
+        full_tok, full_n = prompt_tokens(args.school, q, 0)
+        packed_tok, packed_n = prompt_tokens(args.school, q, args.budget)
+        row = {"q": q, "full": full_tok, "packed": packed_tok, "full_n": full_n, "packed_n": packed_n}
+        if args.answer:
+            row["full_ms"] = answer_latency_ms(args.school, q, 0)
+            row["packed_ms"] = answer_latency_ms(args.school, q, args.budget)
+        rows.append(row)
+        print(f"{full_tok:6d} -> {packed_tok:6d} tok  {full_n}->{packed_n} chunks"
+              + (f"  {row['full_ms']:7.0f} -> {row['packed_ms']:7.0f} ms" if args.answer else "")
+              + f"  | {q[:60]}")
+
+    if not rows:
+        print("[ERR] No questions.")
+        return
+    full = sum(r["full"] for r in rows)
+    packed = sum(r["packed"] for r in rows)
+    print(f"\n[OK] {len(rows)} question(s), budget={args.budget}, mode={'offline' if rag.OFFLINE else 'online'}")
+    print(f"[OK] prompt tokens: {full} -> {packed} ({(1 - packed / full) * 100 if full else 0:.1f}% saved)")
+    if args.answer:
+        for key in ("full_ms", "packed_ms"):
+            vals = sorted(r[key] for r in rows)
+            p95 = vals[min(len(vals) - 1, int(round(0.95 * (len(vals) - 1))))]
+            print(f"[OK] {key}: mean={statistics.mean(vals):.0f} p50={statistics.median(vals):.0f} p95={p95:.0f}")
+
+if __name__ == "__main__":
+    main()
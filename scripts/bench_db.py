@@ -0,0 +1,229 @@
+# scripts/bench_db.py
+# Requests/sec của các endpoint ticket + document (đường đi DB thuần, không gọi Bedrock).
+# Seed 1 DB SQLite (hoặc dùng DATABASE_URL), chạy uvicorn thật trong subprocess rồi bắn closed loop bằng httpx.
+# So sánh trước/sau: chạy cùng lệnh trên 2 commit (hoặc đổi DB_POOL_SIZE / --workers) và so bảng kết quả.
+#   python scripts/bench_db.py --db /tmp/bench.db --concurrency 32 --duration 10
+#   DB_POOL_SIZE=5 DB_MAX_OVERFLOW=0 python scripts/bench_db.py --db /tmp/bench.db --reuse
+# Mixed workload (read + ticket/form write cùng lúc), SQLite profile (app/sqlite_profile.py) vs rollback journal:
+#   python scripts/bench_db.py --db /tmp/bench.db --reuse --mixed 0.2 --workers 2
+#   SQLITE_PROFILE=0 python scripts/bench_db.py --db /tmp/bench.db --reuse --mixed 0.2 --workers 2 --journal-mode DELETE
+#   python scripts/bench_db.py --base-url http://127.0.0.1:8000 --school my-school --school-id 3 --token $OWNER_TOKEN   # server có sẵn (vd. Postgres)
+import os, sys, time, random, asyncio, logging, argparse, subprocess, tempfile
+from datetime import datetime, timedelta
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--db", default=None, help="SQLite file (ignored when DATABASE_URL is set)")
+ap.add_argument("--reuse", action="store_true", help="skip seeding if the DB already has data")
+ap.add_argument("--tickets", type=int, default=20_000)
+ap.add_argument("--concurrency", type=int, default=32)
+ap.add_argument("--duration", type=float, default=10, help="seconds per endpoint")
+ap.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+ap.add_argument("--port", type=int, default=8765)
+ap.add_argument("--base-url", default=None, help="bench a running server instead of starting one")
+ap.add_argument("--school", default="bench-college")
+ap.add_argument("--school-id", type=int, default=None, help="id of --school (with --base-url)")
+ap.add_argument("--token", default=None, help="owner token (required with --base-url)")
+ap.add_argument("--student-token", default=None, help="student token for POST /forms/submit (with --base-url)")
+ap.add_argument("--mixed", type=float, default=None, metavar="WRITE_FRACTION",
+                help="one mixed phase instead of per-endpoint runs, e.g. 0.2 = 20%% writes")
+ap.add_argument("--journal-mode", default=None, help="set PRAGMA journal_mode on the SQLite file before starting (e.g. DELETE, WAL)")
+args = ap.parse_args()
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(
+        args.db or os.path.join(tempfile.mkdtemp(prefix="scholask-bench-"), "bench.db"))
+os.environ.setdefault("OFFLINE_MODE", "1")
+sys.path.append(BACKEND)
+
+import httpx
+from collections import Counter
+
+logging.getLogger("httpx").setLevel(logging.WARNING)  # app.auth bật INFO cho root logger
+
+DEPARTMENTS = ["Admissions", "International", "Registrar", "Financial Aid", "Advising", "Student Services"]
+STATUSES = ["Open", "In Progress", "Resolved", "Closed"]
+
+def seed():
+    """1 trường, 1 owner, N ticket (mỗi ticket 1 submission, vài message) + N/10 document. Trả về (owner token, ticket ids)."""
+    from sqlalchemy import insert, func
+    from app.deps import ENGINE, SessionLocal
+    from app.models import Base, School, User, FormSubmission, ServiceTicket, Message, Document
+    from app.auth import create_token, hash_password
+    from app.migrations import upgrade
+
+    Base.metadata.create_all(bind=ENGINE)
+    upgrade(ENGINE)
+    db = SessionLocal()
+    has_data = db.query(func.count(ServiceTicket.id)).scalar()
+    school = db.query(School).filter(School.slug == args.school).first()
+    db.close()
+    if has_data and not args.reuse:
+        sys.exit("[ERROR] DB already has tickets; pass --reuse or point --db at a new file.")
+    if not (args.reuse and has_data and school):
+        rnd = random.Random(7)
+        start = datetime(2025, 1, 1)
+        ts = lambda: start + timedelta(seconds=rnd.randrange(300 * 86400))
+        pw = hash_password("scholask")
+        with ENGINE.begin() as conn:
+            school_id = conn.execute(insert(School).returning(School.id), {"name": "Bench College", "slug": args.school}).scalar()
+            conn.execute(insert(User), [{"email": f"owner@{args.school}.edu", "password_hash": pw, "role": "owner", "school_id": school_id}])
+            users = conn.execute(insert(User).returning(User.id), [
+                {"email": f"s{i}@{args.school}.edu", "password_hash": pw, "role": "student", "school_id": school_id}
+                for i in range(max(1, args.tickets // 10))]).scalars().all()
+            for lo in range(0, args.tickets, 5000):
+                n = min(5000, args.tickets - lo)
+                rows = [(rnd.choice(users), ts()) for _ in range(n)]
+                sub_ids = conn.execute(insert(FormSubmission).returning(FormSubmission.id), [
+                    {"user_id": u, "school_id": school_id, "payload_json": {"i": lo + i}, "status": "submitted", "created_at": c}
+                    for i, (u, c) in enumerate(rows)]).scalars().all()
+                t_ids = conn.execute(insert(ServiceTicket).returning(ServiceTicket.id), [
+                    {"school_id": school_id, "user_id": u, "form_submission_id": sid, "department": rnd.choice(DEPARTMENTS),
+                     "title": f"Request {lo + i}", "status": rnd.choice(STATUSES), "created_at": c, "updated_at": c}
+                    for i, ((u, c), sid) in enumerate(zip(rows, sub_ids))]).scalars().all()
+                conn.execute(insert(Message), [{"ticket_id": t, "user_id": rnd.choice(users), "text": f"message {j}"}
+                                               for t in t_ids for j in range(3)])
+            conn.execute(insert(Document), [{"school_id": school_id, "source_type": "text", "file_name": f"doc{i}.pdf",
+                                             "chunk_count": 10, "vector_count": 10, "created_at": ts()}
+                                            for i in range(max(1, args.tickets // 10))])
+        print(f"[OK] seeded {args.tickets:,} tickets into {ENGINE.url.render_as_string(hide_password=True)}")
+    db = SessionLocal()
+    school = db.query(School).filter(School.slug == args.school).first()
+    ids = [i for (i,) in db.query(ServiceTicket.id).filter(ServiceTicket.school_id == school.id).limit(5000)]
+    db.close()
+    return (create_token(f"owner@{args.school}.edu", "owner", school.id),
+            create_token(f"s0@{args.school}.edu", "student", school.id), school.id, ids)
+
+def set_journal_mode():
+    import sqlite3
+    from app.deps import ENGINE
+    ENGINE.dispose()  # rời WAL cần đóng mọi connection khác (kể cả pool của seed())
+    path = os.environ["DATABASE_URL"].split("///", 1)[-1]
+    with sqlite3.connect(path, timeout=30) as conn:
+        mode = conn.execute(f"PRAGMA journal_mode={args.journal_mode}").fetchone()[0]
+    os.environ["SQLITE_JOURNAL_MODE"] = args.journal_mode  # profile (nếu bật) không đổi lại
+    print(f"[INFO] journal_mode={mode}")
+
+def start_server():
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+           "--workers", str(args.workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND, env=os.environ.copy())
+    url = f"http://127.0.0.1:{args.port}"
+    for _ in range(300):
+        try:
+            if httpx.get(url + "/healthz", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            sys.exit("[ERROR] server exited during startup")
+        time.sleep(0.1)
+    proc.terminate()
+    sys.exit("[ERROR] server did not start")
+
+def pct(vals, p):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(p / 100 * (len(vals) - 1))))] if vals else 0.0
+
+async def run_endpoint(client, make_url, headers):
+    lat, errors = [], 0
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            r = await client.get(make_url(), headers=headers)
+            if r.status_code != 200:
+                errors += 1
+            lat.append((time.perf_counter() - t) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - t0
+    return len(lat) / elapsed, pct(lat, 50), pct(lat, 99), errors
+
+async def run_mixed(client, reads, writes):
+    lat = {"read": [], "write": []}
+    errors = {"read": Counter(), "write": Counter()}
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(seed):
+        rnd = random.Random(seed)
+        while time.perf_counter() < deadline:
+            kind = "write" if rnd.random() < args.mixed else "read"
+            method, url, body, headers = rnd.choice(writes if kind == "write" else reads)()
+            t = time.perf_counter()
+            try:
+                r = await client.request(method, url, json=body, headers=headers)
+                if r.status_code >= 300:
+                    errors[kind][r.status_code] += 1
+            except httpx.HTTPError as e:
+                errors[kind][type(e).__name__] += 1
+            lat[kind].append((time.perf_counter() - t) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(args.concurrency)])
+    elapsed = time.perf_counter() - t0
+    print(f"\nmixed: {args.mixed:.0%} writes, concurrency {args.concurrency}, {args.duration:.0f}s, {args.workers} worker(s)")
+    print(f"{'':8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  errors")
+    for kind in ("read", "write"):
+        print(f"{kind + 's':8} {len(lat[kind]) / elapsed:9.1f} {pct(lat[kind], 50):9.1f} {pct(lat[kind], 99):9.1f}  "
+              f"{sum(errors[kind].values())} {dict(errors[kind]) or ''}")
+
+async def bench(url, token, student_token, school_id, ticket_ids):
+    headers = {"Authorization": f"Bearer {token}"}
+    rnd = random.Random(1)
+    cases = [
+        ("GET /admin/tickets", lambda: f"/admin/tickets?school={args.school}"),
+        ("GET /admin/tickets?status", lambda: f"/admin/tickets?school={args.school}&status=Open"),
+        ("GET /tickets/{id}", lambda: f"/tickets/{rnd.choice(ticket_ids)}"),
+        ("GET /tickets/{department}", lambda: f"/tickets/{rnd.choice(DEPARTMENTS)}?school_id={school_id}"),
+        ("GET /admin/documents", lambda: f"/admin/documents?school={args.school}"),
+    ]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        r = await client.get(cases[0][1](), headers=headers)
+        assert r.status_code == 200, (r.status_code, r.text[:200])
+        if args.mixed is not None:
+            reads = [
+                lambda: ("GET", f"/tickets/{rnd.choice(ticket_ids)}", None, headers),
+                lambda: ("GET", f"/admin/tickets?school={args.school}&status=Open", None, headers),
+                lambda: ("GET", f"/tickets/{rnd.choice(DEPARTMENTS)}?school_id={school_id}", None, headers),
+            ]
+            writes = [
+                lambda: ("POST", f"/tickets/{rnd.choice(ticket_ids)}/status", {"status": rnd.choice(STATUSES)}, headers),
+                lambda: ("POST", f"/tickets/{rnd.choice(ticket_ids)}/messages", {"text": "bench"}, headers),
+            ]
+            if student_token:
+                student = {"Authorization": f"Bearer {student_token}"}
+                writes.append(lambda: ("POST", "/forms/submit", {"bench": True}, student))
+            await run_mixed(client, reads, writes)
+            return
+        print(f"\nconcurrency {args.concurrency}, {args.duration:.0f}s per endpoint, {args.workers} worker(s)")
+        print(f"{'endpoint':28} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, make_url in cases:
+            rps, p50, p99, errors = await run_endpoint(client, make_url, headers)
+            print(f"{name:28} {rps:9.1f} {p50:9.1f} {p99:9.1f} {errors:7d}")
+
+def main():
+    if args.base_url:
+        if not (args.token and args.school_id):
+            sys.exit("[ERROR] --token and --school-id are required with --base-url")
+        with httpx.Client(base_url=args.base_url) as c:
+            rows = c.get(f"/admin/tickets?school={args.school}&limit=200",
+                         headers={"Authorization": f"Bearer {args.token}"}).json()
+        asyncio.run(bench(args.base_url, args.token, args.student_token, args.school_id, [t["id"] for t in rows]))
+        return
+    token, student_token, school_id, ticket_ids = seed()
+    if args.journal_mode:
+        set_journal_mode()
+    proc, url = start_server()
+    try:
+        asyncio.run(bench(url, token, student_token, school_id, ticket_ids))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# scripts/bench_pwhash.py
+# Login storm: N lần verify Argon2 đồng thời, so sánh chạy thẳng trên event loop vs process pool (app/pwhash.py).
+# Đo throughput, queue wait, số request bị từ chối và độ trễ event loop (đại diện cho chat request chạy song song).
+#   python scripts/bench_pwhash.py --requests 64 --workers 2 --max-pending 16
+import os, sys, time, asyncio, argparse, statistics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from passlib.context import CryptContext
+from app.limiter import Overloaded
+from app.pwhash import PasswordHasher
+
+ctx = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+
+async def loop_lag(stop: asyncio.Event, out: list):
+    """Ngủ 10 ms liên tục; độ trễ vượt quá 10 ms = thời gian event loop bị block."""
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(0.01)
+        out.append((time.perf_counter() - t - 0.01) * 1000)
+
+def pct(vals, p):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(p / 100 * (len(vals) - 1))))] if vals else 0.0
+
+async def run(label, verify, n):
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.ensure_future(loop_lag(stop, lags))
+    ok = rejected = 0
+    t0 = time.perf_counter()
+
+    async def one():
+        nonlocal ok, rejected
+        try:
+            await verify()
+            ok += 1
+        except Overloaded:
+            rejected += 1
+
+    await asyncio.gather(*[one() for _ in range(n)])
+    wall = time.perf_counter() - t0
+    stop.set()
+    await ticker
+    print(f"{label:14} {ok:4d} ok {rejected:4d} rejected  {ok / wall:7.1f} verify/s  "
+          f"loop lag p50={pct(lags, 50):6.1f} ms p99={pct(lags, 99):7.1f} ms max={max(lags or [0]):7.1f} ms")
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--max-pending", type=int, default=16)
+    args = ap.parse_args()
+
+    hashed = ctx.hash("scholask")
+
+    async def inline():
+        ctx.verify("scholask", hashed)   # như code cũ: Argon2 ngay trên worker phục vụ request
+        await asyncio.sleep(0)
+
+    hasher = PasswordHasher(workers=args.workers, max_pending=args.max_pending)
+    hasher.start()
+    await hasher.verify("scholask", hashed)  # đợi worker spawn xong
+
+    print(f"[INFO] {args.requests} concurrent verifies, cpu={os.cpu_count()}, workers={args.workers}, max_pending={args.max_pending}")
+    await run("inline", inline, args.requests)
+    await run("process pool", lambda: hasher.verify("scholask", hashed), args.requests)
+    s = hasher.stats()
+    print(f"[OK] pool: wait p50={s['wait_p50_ms']} ms p95={s['wait_p95_ms']} ms, "
+          f"service p50={s['service_p50_ms']} ms, throughput={s['throughput_per_s']}/s, rejected={s['rejected']}")
+    hasher.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,12 @@
-import os, sys, argparse, asyncio
+import os, sys, json, time, argparse, asyncio
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from glob import glob
 
 # Cho phép import backend.app.rag khi chạy từ repo root
 sys.path.append(os.getcwd())
+# rag import "app.*" (fetch, ...) -> cần backend/ trong sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
 
 try:
     from backend.app import rag
@@ -53,47 +57,156 @@ def load_all_text(files):
             texts.append(txt)
     return texts
 
-async def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--school", required=True, help="school slug, e.g., seattle-central-college")
-    ap.add_argument("--input", required=True, nargs="+", help="one or more dirs/files to ingest")
-    args = ap.parse_args()
+class BuildError(Exception):
+    pass
 
+async def build_school(school: str, inputs, log_prefix: str = "") -> dict:
+    """Loads, chunks and indexes one school. Returns a summary dict (raises BuildError on empty input)."""
+    t0 = time.perf_counter()
     all_files = []
-    for inp in args.input:
+    for inp in inputs:
         files = collect_files(inp)
-        print(f"[INFO] {inp} → {len(files)} file(s)")
+        print(f"{log_prefix}[INFO] {inp} → {len(files)} file(s)")
         all_files += files
 
     all_files = sorted(list(set(all_files)))
     if not all_files:
-        print(f"[ERR] No files found under {args.input}. Put .md/.txt/.pdf inside these folder(s).")
-        return
+        raise BuildError(f"No files found under {inputs}. Put .md/.txt/.pdf inside these folder(s).")
 
-    print(f"[INFO] Total files: {len(all_files)}")
+    print(f"{log_prefix}[INFO] Total files: {len(all_files)}")
     texts = load_all_text(all_files)
-    print(f"[INFO] Loaded texts: {len(texts)}")
+    print(f"{log_prefix}[INFO] Loaded texts: {len(texts)}")
+    t_load = time.perf_counter()
 
     if not texts:
-        print("[ERR] All files were empty/unreadable.")
-        return
+        raise BuildError("All files were empty/unreadable.")
 
     # Chunking
     chunks = []
     for t in texts:
         chunks.extend(rag.chunk_text(t))
-    print(f"[INFO] Total chunks: {len(chunks)}")
+    print(f"{log_prefix}[INFO] Total chunks: {len(chunks)}")
+    t_chunk = time.perf_counter()
 
     if not chunks:
-        print("[ERR] No chunks produced (input too small?).")
-        return
+        raise BuildError("No chunks produced (input too small?).")
 
     # Build index
-    ids = await rag.embed_and_index(args.school, chunks)
-    print(f"[OK] Indexed {len(ids)} chunk(s) for school='{args.school}'.")
-    print(f"[OK] Output dir: {os.path.join(os.getcwd(), 'indexes', args.school)}")
+    ids = await rag.embed_and_index(school, chunks)
+    t_index = time.perf_counter()
+    print(f"{log_prefix}[OK] Indexed {len(ids)} chunk(s) for school='{school}'.")
+    print(f"{log_prefix}[OK] Output dir: {os.path.join(rag.INDEX_DIR, school)}")
+    return {
+        "school": school,
+        "ok": True,
+        "files": len(all_files),
+        "texts": len(texts),
+        "chunks": len(chunks),
+        "vectors": len(ids),
+        "load_s": round(t_load - t0, 3),
+        "chunk_s": round(t_chunk - t_load, 3),
+        "index_s": round(t_index - t_chunk, 3),
+        "total_s": round(t_index - t0, 3),
+    }
+
+def _build_worker(school: str, inputs, embed_rps: float) -> dict:
+    """Runs in a worker process. Never raises: failures are returned in the summary."""
+    if embed_rps > 0:
+        rag.set_embed_rate_limit(embed_rps)
+    t0 = time.perf_counter()
+    try:
+        return asyncio.run(build_school(school, inputs, log_prefix=f"[{school}] "))
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)  # HTTPException từ embed_and_index
+        print(f"[{school}] [ERR] {detail}")
+        return {"school": school, "ok": False, "error": detail, "total_s": round(time.perf_counter() - t0, 3)}
+
+def load_manifest(path: str):
+    """Manifest = JSON list of {"school": slug, "input": dir | [dirs/files]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("schools", [])
+    jobs = []
+    for entry in data:
+        inputs = entry.get("input") or entry.get("inputs") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not entry.get("school") or not inputs:
+            raise ValueError(f"Manifest entry needs 'school' and 'input': {entry}")
+        if any(school == entry["school"] for school, _ in jobs):
+            # 2 worker cùng ghi 1 index -> mất dữ liệu; gộp input vào 1 entry
+            raise ValueError(f"School '{entry['school']}' appears more than once in the manifest")
+        jobs.append((entry["school"], inputs))
+    return jobs
+
+def run_batch(jobs, workers: int, embed_rps: float, report_path: str) -> dict:
+    """Builds many schools in parallel processes; one failure does not stop the others."""
+    workers = max(1, min(workers, len(jobs)))
+    # Chia đều rate limit embed cho các worker -> tổng không vượt embed_rps
+    per_worker_rps = embed_rps / workers if embed_rps > 0 and not rag.OFFLINE else 0.0
+    print(f"[INFO] Batch build: {len(jobs)} school(s), {workers} worker(s)"
+          + (f", embed limit {embed_rps}/s" if per_worker_rps else ""))
+
+    t0 = time.perf_counter()
+    results = []
+    # spawn: không fork boto3 client / FAISS state của process cha
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        futures = {pool.submit(_build_worker, school, inputs, per_worker_rps): school for school, inputs in jobs}
+        for fut in as_completed(futures):
+            school = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:  # worker process chết (OOM, segfault, ...)
+                res = {"school": school, "ok": False, "error": f"worker crashed: {e}"}
+            results.append(res)
+            status = "OK " if res.get("ok") else "ERR"
+            print(f"[{status}] {school}: {res.get('chunks', 0)} chunk(s) in {res.get('total_s', '?')}s"
+                  + ("" if res.get("ok") else f" — {res.get('error')}"))
+
+    results.sort(key=lambda r: r["school"])
+    report = {
+        "mode": "offline" if rag.OFFLINE else "online",
+        "workers": workers,
+        "embed_rps": embed_rps,
+        "wall_s": round(time.perf_counter() - t0, 3),
+        "succeeded": sum(1 for r in results if r.get("ok")),
+        "failed": sum(1 for r in results if not r.get("ok")),
+        "total_chunks": sum(r.get("chunks", 0) for r in results),
+        "schools": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[OK] {report['succeeded']} succeeded, {report['failed']} failed in {report['wall_s']}s. Report: {report_path}")
+    return report
 
-if __name__ == "__main__":
-    asyncio.run(main())
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--school", help="school slug, e.g., seattle-central-college")
+    ap.add_argument("--input", nargs="+", help="one or more dirs/files to ingest")
+    ap.add_argument("--manifest", help='batch mode: JSON list of {"school": ..., "input": [...]}')
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="batch mode: max parallel builds")
+    ap.add_argument("--embed-rps", type=float, default=0.0, help="batch mode (online): global Bedrock embed calls/sec, 0 = unlimited")
+    ap.add_argument("--report", default=os.path.join(rag.INDEX_DIR, "_build_report.json"), help="batch mode: summary JSON path")
+    args = ap.parse_args()
 
+    if args.manifest:
+        jobs = load_manifest(args.manifest)
+        if not jobs:
+            print(f"[ERR] No schools in manifest {args.manifest}.")
+            return
+        report = run_batch(jobs, args.workers, args.embed_rps, args.report)
+        if report["failed"]:
+            sys.exit(1)
+        return
 
+    if not args.school or not args.input:
+        ap.error("--school and --input are required (or use --manifest)")
+    try:
+        await build_school(args.school, args.input)
+    except BuildError as e:
+        print(f"[ERR] {e}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+# scripts/check_ticket_queries.py
+# Kiểm tra số SQL query của các endpoint ticket KHÔNG tăng theo số ticket / message (chống N+1).
+# Chạy trên SQLite tạm, thoát mã 1 nếu số query thay đổi giữa 2 kích thước dữ liệu.
+#   python scripts/check_ticket_queries.py --small 5x2 --large 500x50
+import os, sys, argparse, tempfile
+
+def parse_size(s):
+    tickets, messages = s.lower().split("x")
+    return int(tickets), int(messages)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--small", type=parse_size, default=(5, 2), help="tickets x messages per ticket")
+ap.add_argument("--large", type=parse_size, default=(500, 50))
+args = ap.parse_args()
+
+# DB tạm phải được set trước khi import app (deps đọc DATABASE_URL lúc import)
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="scholask-q-"), "check.db")
+os.environ.setdefault("OFFLINE_MODE", "1")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from app.main import app
+from app.deps import ENGINE, ASYNC_ENGINE, SessionLocal
+from app.migrations import init_schema
+from app.auth import create_token, hash_password
+from app.models import School, User, FormSubmission, ServiceTicket, Message
+
+statements = []
+# Router chạy trên engine async -> lắng nghe sync_engine bên dưới của nó
+event.listen(ASYNC_ENGINE.sync_engine, "before_cursor_execute", lambda conn, cur, stmt, *a: statements.append(stmt))
+
+def seed(slug, n_tickets, n_messages):
+    db = SessionLocal()
+    school = School(name=slug.title(), slug=slug)
+    db.add(school); db.flush()
+    staff = User(email=f"staff@{slug}.edu", password_hash=hash_password("x"), role="admin", school_id=school.id)
+    db.add(staff); db.flush()
+    for i in range(n_tickets):
+        # Mỗi ticket 1 requester riêng: lazy-load requester sẽ thành 1 query/ticket
+        student = User(email=f"student{i}@{slug}.edu", password_hash=staff.password_hash, role="student", school_id=school.id)
+        db.add(student); db.flush()
+        fs = FormSubmission(user_id=student.id, school_id=school.id, payload_json={"i": i})
+        db.add(fs); db.flush()
+        t = ServiceTicket(school_id=school.id, user_id=student.id, form_submission_id=fs.id,
+                          department="Admissions", title=f"Ticket {i}")
+        db.add(t); db.flush()
+        db.add_all([Message(ticket_id=t.id, user_id=(student.id if j % 2 else staff.id), text=f"m{j}")
+                    for j in range(n_messages)])
+    db.commit()
+    ids = school.id, t.id, create_token(staff.email, "admin", school.id), create_token(student.email, "student", school.id)
+    db.close()
+    return ids
+
+def count(client, url, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get(url, headers=headers)  # warm-up: principal cache + school registry
+    statements.clear()
+    r = client.get(url, headers=headers)
+    assert r.status_code == 200, (url, r.status_code, r.text)
+    return len(statements)
+
+def measure(client, slug, size):
+    _school_id, ticket_id, staff_tok, student_tok = seed(slug, *size)
+    return {
+        "GET /admin/tickets": count(client, f"/admin/tickets?school={slug}", staff_tok),
+        "GET /admin/tickets/{id}": count(client, f"/admin/tickets/{ticket_id}?school={slug}", staff_tok),
+        "GET /tickets/{id} (staff)": count(client, f"/tickets/{ticket_id}", staff_tok),
+        "GET /tickets/{id} (student)": count(client, f"/tickets/{ticket_id}", student_tok),
+    }
+
+def main():
+    init_schema(ENGINE)  # seed() chạy trước startup của app
+    with TestClient(app) as client:
+        small = measure(client, "small-u", args.small)
+        large = measure(client, "large-u", args.large)
+    ok = True
+    print(f"{'endpoint':30} {'x'.join(map(str, args.small)):>10} {'x'.join(map(str, args.large)):>10}")
+    for name in small:
+        flag = "" if small[name] == large[name] else "  <-- grows with data"
+        ok &= not flag
+        print(f"{name:30} {small[name]:>10} {large[name]:>10}{flag}")
+    print("[OK] query counts are constant" if ok else "[FAIL] N+1 detected")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
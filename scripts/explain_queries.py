@@ -0,0 +1,198 @@
+# scripts/explain_queries.py
+# Seed dữ liệu lớn (mặc định 1M ticket + 1M submission) rồi in query plan + thời gian của query chính mỗi API danh sách.
+# Query được bắt từ chính endpoint (TestClient), nên plan là của SQL thật mà API chạy (trang đầu và trang sâu).
+#   python scripts/explain_queries.py                          # SQLite tạm, 1M dòng
+#   python scripts/explain_queries.py --db /tmp/big.db --reuse # seed 1 lần, chạy lại nhiều lần
+#   python scripts/explain_queries.py --legacy-indexes         # so sánh với index 1 cột cũ
+#   DATABASE_URL=postgresql://... python scripts/explain_queries.py --rows 1000000
+import os, sys, time, random, argparse, tempfile, statistics
+from datetime import datetime, timedelta
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--rows", type=int, default=1_000_000, help="service tickets (and form submissions)")
+ap.add_argument("--schools", type=int, default=20)
+ap.add_argument("--users", type=int, default=50_000)
+ap.add_argument("--db", default=None, help="SQLite file (ignored when DATABASE_URL is set)")
+ap.add_argument("--reuse", action="store_true", help="skip seeding if the DB already has data")
+ap.add_argument("--legacy-indexes", action="store_true", help="swap composite indexes for the old single-column ones")
+ap.add_argument("--repeat", type=int, default=5)
+args = ap.parse_args()
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + (args.db or os.path.join(tempfile.mkdtemp(prefix="scholask-explain-"), "big.db"))
+os.environ.setdefault("OFFLINE_MODE", "1")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from sqlalchemy import event, insert, text, func
+from fastapi.testclient import TestClient
+from app.main import app
+from app.deps import ENGINE, ASYNC_ENGINE, SessionLocal
+from app.auth import create_token, hash_password
+from app.models import School, User, FormSubmission, ServiceTicket, Document
+from app.migrations import COMPOSITE_INDEXES, SUPERSEDED_INDEXES, init_schema
+from app.queries import encode_cursor
+
+STATUSES = ["Open", "In Progress", "Resolved", "Closed", "Rejected"]
+DEPARTMENTS = ["Admissions", "International", "Registrar", "Financial Aid", "Advising", "Student Services"]
+BATCH = 50_000
+
+def seed():
+    rnd = random.Random(42)
+    t0 = time.perf_counter()
+    start = datetime(2025, 1, 1)
+    ts = lambda: start + timedelta(seconds=rnd.randrange(365 * 86400))
+    pw = hash_password("scholask")
+    with ENGINE.begin() as conn:
+        conn.execute(insert(School), [{"id": i, "name": f"School {i}", "slug": f"school-{i}"} for i in range(1, args.schools + 1)])
+        conn.execute(insert(User), [{"id": 1, "email": "owner@school-1.edu", "password_hash": pw, "role": "owner", "school_id": 1}])
+        conn.execute(insert(User), [{"id": i, "email": f"student{i}@example.edu", "password_hash": pw, "role": "student",
+                                     "school_id": 1 + i % args.schools} for i in range(2, args.users + 2)])
+    # Mỗi submission có 1 ticket (form_submission_id unique); trường 1 đông nhất (~1/4 dữ liệu) để trang sâu có ý nghĩa
+    school_of = lambda: 1 if rnd.random() < 0.25 else rnd.randint(2, args.schools)
+    for lo in range(0, args.rows, BATCH):
+        subs, tickets = [], []
+        for i in range(lo + 1, min(args.rows, lo + BATCH) + 1):
+            school, user, created = school_of(), rnd.randint(2, args.users + 1), ts()
+            subs.append({"id": i, "form_id": None, "user_id": user, "school_id": school, "payload_json": {"i": i},
+                         "status": "submitted", "created_at": created})
+            tickets.append({"id": i, "school_id": school, "user_id": user, "form_submission_id": i,
+                            "department": rnd.choice(DEPARTMENTS), "title": f"Request {i}",
+                            "status": rnd.choice(STATUSES), "created_at": created, "updated_at": created})
+        with ENGINE.begin() as conn:
+            conn.execute(insert(FormSubmission), subs)
+            conn.execute(insert(ServiceTicket), tickets)
+        print(f"  seeded {min(args.rows, lo + BATCH):,}/{args.rows:,} rows ({time.perf_counter() - t0:.0f}s)", end="\r")
+    docs = [{"school_id": school_of(), "source_type": "text", "file_name": f"doc{i}.pdf", "chunk_count": 10,
+             "vector_count": 10, "created_at": ts()} for i in range(args.rows // 10)]
+    with ENGINE.begin() as conn:
+        for lo in range(0, len(docs), BATCH):
+            conn.execute(insert(Document), docs[lo:lo + BATCH])
+        if conn.dialect.name == "postgresql":
+            # id được chèn tay -> đẩy sequence lên để insert sau này không trùng khoá
+            for table in ("users", "schools", "form_submissions", "service_tickets"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+        conn.execute(text("ANALYZE"))
+    print(f"\n[OK] seeded in {time.perf_counter() - t0:.0f}s")
+
+def use_legacy_indexes():
+    legacy = [("ix_service_tickets_school_id", "service_tickets", "school_id"),
+              ("ix_service_tickets_status", "service_tickets", "status"),
+              ("ix_service_tickets_department", "service_tickets", "department"),
+              ("ix_documents_school_id", "documents", "school_id"),
+              ("ix_form_submissions_school_id", "form_submissions", "school_id"),
+              ("ix_messages_ticket_id", "messages", "ticket_id")]
+    with ENGINE.begin() as conn:
+        for name, _table, _cols in COMPOSITE_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        for name, table, col in legacy:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({col})"))
+        conn.execute(text("ANALYZE"))
+    print("[INFO] using legacy single-column indexes:", ", ".join(SUPERSEDED_INDEXES))
+
+captured = []
+event.listen(ASYNC_ENGINE.sync_engine, "before_cursor_execute",  # SQL của router (engine async)
+              lambda conn, cur, stmt, params, *a: captured.append((stmt, params)))
+
+def cursor_at(model, depth, *criteria):
+    """Cursor of the row `depth` positions into (created_at DESC, id DESC) order — a deep page.
+
+    depth is capped at half of the matching rows, so a small --rows still gets a (shallower) deep page;
+    None only when nothing matches.
+    """
+    db = SessionLocal()
+    total = db.query(func.count(model.id)).filter(*criteria).scalar()
+    row = (db.query(model.created_at, model.id).filter(*criteria)
+           .order_by(model.created_at.desc(), model.id.desc()).offset(min(depth, total // 2)).first())
+    db.close()
+    return encode_cursor(row.created_at, row.id) if row else None
+
+def deep_url(base, cursor):
+    # Không có cursor (không có dòng nào khớp) -> bỏ case, không gửi "cursor=None"
+    return f"{base}&cursor={cursor}" if cursor else None
+
+def explain(stmt, params):
+    with ENGINE.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            plan = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + stmt, params).fetchall()
+            return [r[0] for r in plan]
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + stmt, params).fetchall()
+        return [r[-1] for r in plan]
+
+def time_sql(stmt, params):
+    samples = []
+    with ENGINE.connect() as conn:
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            conn.exec_driver_sql(stmt, params).fetchall()
+            samples.append((time.perf_counter() - t) * 1000)
+    return statistics.median(samples)
+
+def run_case(client, name, url, token):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    client.get(url, headers=headers)  # warm-up (principal cache, registry, page cache)
+    http = []
+    for _ in range(args.repeat):
+        captured.clear()
+        t = time.perf_counter()
+        r = client.get(url, headers=headers)
+        http.append((time.perf_counter() - t) * 1000)
+        assert r.status_code == 200, (url, r.status_code, r.text[:200])
+    listing = [c for c in captured if "ORDER BY" in c[0]]
+    print(f"\n=== {name}\n    {url}")
+    print(f"    http p50 {statistics.median(http):8.1f} ms   rows {len(r.json())}   queries/request {len(captured)}")
+    for stmt, params in listing:
+        print(f"    sql  p50 {time_sql(stmt, params):8.1f} ms")
+        for line in explain(stmt, params):
+            print(f"      {line}")
+
+def main():
+    init_schema(ENGINE)  # seed() / query chạy trước startup của app
+    db = SessionLocal()
+    has_data = db.query(func.count(ServiceTicket.id)).scalar()
+    db.close()
+    if not (args.reuse and has_data):
+        if has_data:
+            sys.exit("[ERROR] DB already has tickets; pass --reuse or point --db at a new file.")
+        print(f"[INFO] seeding {args.rows:,} tickets into {ENGINE.url.render_as_string(hide_password=True)}")
+        seed()
+    if args.legacy_indexes:
+        use_legacy_indexes()
+
+    owner = create_token("owner@school-1.edu", "owner", 1)
+    db = SessionLocal()
+    student = db.query(User).filter(User.school_id == 1, User.role == "student").first()
+    db.close()
+    student_tok = create_token(student.email, "student", 1)
+    deep = 20_000  # trần; cursor_at hạ xuống theo số dòng đã seed
+
+    T, D, F = ServiceTicket, Document, FormSubmission
+    cases = [
+        ("admin tickets, first page", "/admin/tickets?school=school-1", owner),
+        ("admin tickets, deep page", deep_url("/admin/tickets?school=school-1", cursor_at(T, deep, T.school_id == 1)), owner),
+        ("admin tickets status=Open, deep", deep_url("/admin/tickets?school=school-1&status=Open",
+                                                     cursor_at(T, deep // 5, T.school_id == 1, T.status == 'Open')), owner),
+        ("admin tickets status+department", "/admin/tickets?school=school-1&status=Open&department=Registrar", owner),
+        ("tickets by department, deep", deep_url("/tickets/Admissions?school_id=1",
+                                                 cursor_at(T, deep // 6, T.school_id == 1, T.department == 'Admissions')), owner),
+        ("documents, first page", "/admin/documents?school=school-1", owner),
+        ("documents, deep page", deep_url("/admin/documents?school=school-1", cursor_at(D, deep // 2, D.school_id == 1)), owner),
+        ("my submissions (student)", "/forms/my-submissions?school=school-1", student_tok),
+        ("submissions (anonymous), deep", deep_url("/forms/my-submissions?school=school-1",
+                                                   cursor_at(F, deep, F.school_id == 1)), None),
+    ]
+    with TestClient(app) as client:
+        for name, url, token in cases:
+            if url is None:
+                print(f"\n=== {name}\n    [SKIP] no matching rows for a deep cursor")
+                continue
+            run_case(client, name, url, token)
+
+    # users(email): principal cache miss / login
+    stmt = "SELECT id FROM users WHERE email = " + ("%(e)s" if ENGINE.dialect.name == "postgresql" else "?")
+    params = {"e": student.email} if ENGINE.dialect.name == "postgresql" else (student.email,)
+    print(f"\n=== users by email (login / principal cache miss)\n    sql  p50 {time_sql(stmt, params):8.3f} ms")
+    for line in explain(stmt, params):
+        print(f"      {line}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# scripts/fake_bedrock.py
+# Fake bedrock-runtime cho load test / benchmark offline (không cần AWS, không cần mạng).
+# Hỗ trợ đúng 2 API backend dùng:
+#   POST /model/{modelId}/invoke                       (Titan embed + Claude messages)
+#   POST /model/{modelId}/invoke-with-response-stream  (Claude messages, AWS event-stream)
+#
+#   python scripts/fake_bedrock.py --port 8899 --claude-latency lognormal:800,0.4 --tokens-per-sec 60 --throttle-rate 0.05
+#
+# Backend trỏ vào fake server:
+#   BEDROCK_ENDPOINT_URL=http://127.0.0.1:8899 AWS_ACCESS_KEY_ID=fake AWS_SECRET_ACCESS_KEY=fake OFFLINE_MODE=0 uvicorn app.main:app
+#
+# Đổi cấu hình lúc đang chạy (vd. giả lập sự cố):  curl -XPOST localhost:8899/_admin/config -d '{"error_rate": 1.0}'
+# Thống kê:                                        curl localhost:8899/_admin/stats
+import os, re, json, time, math, base64, random, asyncio, hashlib, argparse, binascii, struct
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+app = FastAPI(title="Fake bedrock-runtime")
+
+CONFIG = {
+    "embed_dim": 1024,
+    "embed_latency": "fixed:30",       # ms
+    "claude_latency": "lognormal:600,0.3",  # ms tới token đầu tiên (median, sigma)
+    "tokens_per_sec": 80.0,            # tốc độ sinh token của Claude
+    "throttle_rate": 0.0,              # xác suất trả ThrottlingException
+    "error_rate": 0.0,                 # xác suất trả 500 ModelErrorException
+    "max_concurrency": 0,              # >0: vượt số request đồng thời này -> throttle
+    "seed": 0,
+}
+STATS = {"embed": 0, "claude": 0, "stream": 0, "throttled": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+_rng = random.Random(0)
+
+# ====== Latency distributions ======
+def sample_ms(spec: str) -> float:
+    """'fixed:200' | 'uniform:100,400' | 'normal:300,50' | 'lognormal:300,0.5' (median ms, sigma)."""
+    kind, _, args = spec.partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()]
+    if kind == "fixed":
+        return vals[0]
+    if kind == "uniform":
+        return _rng.uniform(vals[0], vals[1])
+    if kind == "normal":
+        return max(0.0, _rng.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        return vals[0] * math.exp(_rng.gauss(0.0, vals[1]))
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+# ====== Deterministic outputs ======
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def fake_embedding(text: str, dim: int) -> list:
+    """Hashed bag-of-words: deterministic, and texts sharing words get similar vectors (retrieval still makes sense)."""
+    v = np.zeros(dim, dtype=np.float32)
+    for w in _WORD.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "little")
+        v[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    if not v.any():
+        v[0] = 1.0
+    return (v / np.linalg.norm(v)).round(6).tolist()
+
+def count_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+def prompt_text(payload: dict) -> str:
+    parts = [payload.get("system") or ""]
+    for m in payload.get("messages", []):
+        content = m.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(c.get("text", "") for c in content or [] if isinstance(c, dict))
+    return "\n".join(p for p in parts if p)
+
+def fake_answer(prompt: str, max_tokens: int) -> str:
+    """Cites the first context chunks like the real prompt asks: '<first sentence> [#n]'."""
+    context = prompt.rsplit("Context:", 1)[-1]  # bỏ phần hướng dẫn (cũng chứa ví dụ "[#1]")
+    blocks = re.findall(r"\[#(\d+)\][^\n]*\n(.+?)(?=\n\n---\n\n|\n---\n\nQuestion:|\Z)", context, re.S)
+    lines = []
+    for n, txt in blocks[:3]:
+        first = re.split(r"(?<=[.!?])\s", txt.strip(), maxsplit=1)[0][:200]
+        lines.append(f"- {first} [#{n}]")
+    q = re.search(r"Question:\s*(.+)", prompt)
+    head = f"Here is what I found about \"{q.group(1).strip()[:120]}\":" if q else "Claude OK"
+    text = head + ("\n" + "\n".join(lines) if lines else "")
+    return text[: max_tokens * 4]
+
+# ====== Errors ======
+def aws_error(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse({"message": message}, status_code=status, headers={"x-amzn-ErrorType": f"{code}:http://internal.amazon.com/coral/com.amazon.bedrock/"})
+
+def injected_error():
+    if CONFIG["max_concurrency"] and STATS["in_flight"] > CONFIG["max_concurrency"]:
+        STATS["throttled"] += 1
+        return aws_error(429, "ThrottlingException", "Too many requests, please wait before trying again.")
+    if _rng.random() < CONFIG["throttle_rate"]:
+        STATS["throttled"] += 1
+        return aws_error(429, "ThrottlingException", "Too many requests, please wait before trying again.")
+    if _rng.random() < CONFIG["error_rate"]:
+        STATS["errors"] += 1
+        return aws_error(500, "ModelErrorException", "The model encountered an internal error.")
+    return None
+
+# ====== AWS event-stream encoding (application/vnd.amazon.eventstream) ======
+def _header(name: str, value: str) -> bytes:
+    n, v = name.encode(), value.encode()
+    return struct.pack(">B", len(n)) + n + b"\x07" + struct.pack(">H", len(v)) + v
+
+def event_message(payload: bytes, event_type: str = "chunk") -> bytes:
+    headers = _header(":event-type", event_type) + _header(":content-type", "application/json") + _header(":message-type", "event")
+    total = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack(">II", total, len(headers))
+    prelude += struct.pack(">I", binascii.crc32(prelude) & 0xFFFFFFFF)
+    body = prelude + headers + payload
+    return body + struct.pack(">I", binascii.crc32(body) & 0xFFFFFFFF)
+
+def chunk_event(obj: dict) -> bytes:
+    return event_message(json.dumps({"bytes": base64.b64encode(json.dumps(obj).encode()).decode()}).encode())
+
+# ====== Routes ======
+@app.middleware("http")
+async def track_in_flight(request: Request, call_next):
+    STATS["in_flight"] += 1
+    STATS["max_in_flight"] = max(STATS["max_in_flight"], STATS["in_flight"])
+    try:
+        return await call_next(request)
+    finally:
+        STATS["in_flight"] -= 1
+
+@app.post("/model/{model_id:path}/invoke")
+async def invoke(model_id: str, request: Request):
+    payload = json.loads(await request.body() or b"{}")
+    err = injected_error()
+    if "embed" in model_id:
+        STATS["embed"] += 1
+        await asyncio.sleep(sample_ms(CONFIG["embed_latency"]) / 1000)
+        if err:
+            return err
+        text = payload.get("inputText", "")
+        dim = int(payload.get("dimensions") or CONFIG["embed_dim"])
+        return JSONResponse({"embedding": fake_embedding(text, dim), "inputTextTokenCount": count_tokens(text)},
+                            headers={"X-Amzn-Bedrock-Input-Token-Count": str(count_tokens(text))})
+
+    STATS["claude"] += 1
+    prompt = prompt_text(payload)
+    answer = fake_answer(prompt, int(payload.get("max_tokens", 1000)))
+    out_tokens = count_tokens(answer)
+    # Không stream: chờ cả thời gian tới token đầu + thời gian sinh toàn bộ token
+    await asyncio.sleep(sample_ms(CONFIG["claude_latency"]) / 1000 + out_tokens / CONFIG["tokens_per_sec"])
+    if err:
+        return err
+    return JSONResponse({
+        "id": "msg_fake_" + hashlib.sha1(prompt.encode()).hexdigest()[:16],
+        "type": "message",
+        "role": "assistant",
+        "model": model_id,
+        "content": [{"type": "text", "text": answer}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": count_tokens(prompt), "output_tokens": out_tokens},
+    }, headers={"X-Amzn-Bedrock-Input-Token-Count": str(count_tokens(prompt)),
+                "X-Amzn-Bedrock-Output-Token-Count": str(out_tokens)})
+
+@app.post("/model/{model_id:path}/invoke-with-response-stream")
+async def invoke_stream(model_id: str, request: Request):
+    payload = json.loads(await request.body() or b"{}")
+    STATS["stream"] += 1
+    err = injected_error()
+    if err:
+        return err
+    prompt = prompt_text(payload)
+    answer = fake_answer(prompt, int(payload.get("max_tokens", 1000)))
+    words = re.findall(r"\S+\s*", answer)
+    in_tokens = count_tokens(prompt)
+
+    async def gen():
+        await asyncio.sleep(sample_ms(CONFIG["claude_latency"]) / 1000)
+        yield chunk_event({"type": "message_start", "message": {"id": "msg_fake", "type": "message", "role": "assistant",
+                                                                 "model": model_id, "content": [],
+                                                                 "usage": {"input_tokens": in_tokens, "output_tokens": 1}}})
+        yield chunk_event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for w in words:
+            await asyncio.sleep(count_tokens(w) / CONFIG["tokens_per_sec"])
+            yield chunk_event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": w}})
+        yield chunk_event({"type": "content_block_stop", "index": 0})
+        yield chunk_event({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": count_tokens(answer)}})
+        yield chunk_event({"type": "message_stop", "amazon-bedrock-invocationMetrics": {"inputTokenCount": in_tokens,
+                                                                                        "outputTokenCount": count_tokens(answer)}})
+
+    return StreamingResponse(gen(), media_type="application/vnd.amazon.eventstream",
+                             headers={"X-Amzn-Bedrock-Content-Type": "application/json"})
+
+@app.get("/_admin/stats")
+def admin_stats():
+    return {"config": CONFIG, "stats": STATS}
+
+@app.post("/_admin/config")
+async def admin_config(request: Request):
+    updates = json.loads(await request.body() or b"{}")
+    unknown = set(updates) - set(CONFIG)
+    if unknown:
+        return JSONResponse({"error": f"unknown keys: {sorted(unknown)}"}, status_code=400)
+    CONFIG.update(updates)
+    return {"config": CONFIG}
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake AWS bedrock-runtime for offline load testing.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8899)
+    ap.add_argument("--embed-dim", type=int, default=CONFIG["embed_dim"])
+    ap.add_argument("--embed-latency", default=CONFIG["embed_latency"], help="fixed:MS | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA")
+    ap.add_argument("--claude-latency", default=CONFIG["claude_latency"], help="time to first token, same syntax")
+    ap.add_argument("--tokens-per-sec", type=float, default=CONFIG["tokens_per_sec"])
+    ap.add_argument("--throttle-rate", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--max-concurrency", type=int, default=0, help="throttle requests beyond this many in flight (0 = off)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    CONFIG.update({
+        "embed_dim": args.embed_dim,
+        "embed_latency": args.embed_latency,
+        "claude_latency": args.claude_latency,
+        "tokens_per_sec": args.tokens_per_sec,
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+        "max_concurrency": args.max_concurrency,
+        "seed": args.seed,
+    })
+    _rng.seed(args.seed)
+    sample_ms(CONFIG["embed_latency"]); sample_ms(CONFIG["claude_latency"])  # validate specs early
+    print(f"[INFO] Fake bedrock-runtime on http://{args.host}:{args.port}  config={CONFIG}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# scripts/fake_transit.py
+# Stub transit API để test cache transit (app/transit.py) mà không cần API thật.
+# Trả về danh sách stop theo đúng format backend đang đọc: [{name, routes: [{name, arrivals: [..]}]}]
+#
+#   python scripts/fake_transit.py --port 8898 --latency 200
+#   TRANSIT_API_URL=http://127.0.0.1:8898/stops uvicorn app.main:app
+#
+# Giả lập upstream chậm / lỗi lúc đang chạy:  curl -XPOST localhost:8898/_admin/config -d '{"latency_ms": 3000}'
+# Thống kê (số call thật tới upstream):       curl localhost:8898/_admin/stats
+import json, random, asyncio, argparse
+from datetime import datetime, timedelta
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake transit API")
+
+CONFIG = {"latency_ms": 100.0, "error_rate": 0.0}
+STATS = {"calls": 0, "errors": 0}
+ROUTES = ["8", "49", "60", "Link 1 Line", "Streetcar"]
+
+@app.get("/stops")
+async def stops(lat: float, lon: float, radius: int = 500, realtime: str = "true"):
+    STATS["calls"] += 1
+    await asyncio.sleep(CONFIG["latency_ms"] / 1000)
+    if random.random() < CONFIG["error_rate"]:
+        STATS["errors"] += 1
+        return JSONResponse({"error": "upstream unavailable"}, status_code=503)
+    now = datetime.now()
+    rng = random.Random(f"{lat:.4f},{lon:.4f}")
+    out = []
+    for s in range(3):
+        routes = []
+        for name in rng.sample(ROUTES, 2):
+            first = rng.randint(1, 12)
+            routes.append({"name": name, "arrivals": [(now + timedelta(minutes=first + 10 * j)).strftime("%H:%M") for j in range(2)]})
+        out.append({"name": f"Stop {s + 1} near ({lat:.4f}, {lon:.4f})", "routes": routes})
+    return out
+
+@app.get("/_admin/stats")
+def admin_stats():
+    return {"config": CONFIG, "stats": STATS}
+
+@app.post("/_admin/config")
+async def admin_config(request: Request):
+    updates = json.loads(await request.body() or b"{}")
+    unknown = set(updates) - set(CONFIG)
+    if unknown:
+        return JSONResponse({"error": f"unknown keys: {sorted(unknown)}"}, status_code=400)
+    CONFIG.update(updates)
+    return {"config": CONFIG}
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake transit stops API for local testing.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8898)
+    ap.add_argument("--latency", type=float, default=CONFIG["latency_ms"], help="ms per call")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    CONFIG.update({"latency_ms": args.latency, "error_rate": args.error_rate})
+    print(f"[INFO] Fake transit API on http://{args.host}:{args.port}/stops  config={CONFIG}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 # scripts/ingest_crawl.py
-import os, json, re
+import os, sys, json, re
 from pathlib import Path
-from bs4 import BeautifulSoup
-from html import unescape
 
 try:
     from pdfminer.high_level import extract_text as extract_pdf_text
@@ -12,13 +10,9 @@ except Exception:
 ROOT = Path(__file__).resolve().parent
 DATA = ROOT.parent / "data"
 
-def clean_html(html_bytes):
-    soup = BeautifulSoup(html_bytes, "html.parser")
-    for s in soup(["script","style","noscript","header","footer","nav","form"]):
-        s.decompose()
-    text = soup.get_text("\n")
-    text = re.sub(r"\n{2,}", "\n\n", text)
-    return unescape(text).strip()
+# Dùng chung cleaner với URL ingest của backend (app.fetch.clean_html)
+sys.path.append(str(ROOT.parent / "backend"))
+from app.fetch import clean_html
 
 def chunk_text(t, size=1200, overlap=150):
     t = t.replace("\r\n","\n")
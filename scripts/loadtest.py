@@ -0,0 +1,295 @@
+# scripts/loadtest.py
+# Load test cho /chat/ask, /chat/stream (WebSocket) và (tuỳ chọn) traffic admin: ingest + tickets.
+#
+# Closed loop, 32 client song song trong 60 s:
+#   python scripts/loadtest.py --base-url http://127.0.0.1:8000 --schools seattle-central-college --concurrency 32 --duration 60
+# Open loop (Poisson), 20 req/s, 30% qua WebSocket, câu hỏi lấy từ JSONL:
+#   python scripts/loadtest.py --rate 20 --stream-fraction 0.3 --questions requests.jsonl --duration 60
+# Tìm điểm bão hoà (chạy lần lượt từng mức concurrency):
+#   python scripts/loadtest.py --sweep 1,2,4,8,16,32,64 --duration 20
+# Mixed workload (cần token owner/admin):
+#   python scripts/loadtest.py --concurrency 16 --mixed --token $ADMIN_TOKEN --ingest-rate 0.2 --ticket-rate 5
+#
+# So sánh 1 worker vs N worker: chạy backend với `uvicorn app.main:app --workers N` rồi chạy lại cùng lệnh --sweep.
+# Kết hợp scripts/fake_bedrock.py để load test online mode không cần AWS.
+import os, sys, json, time, random, asyncio, argparse, statistics
+from collections import defaultdict
+
+import httpx
+import websockets
+
+DEFAULT_QUESTIONS = [
+    "When does winter quarter start?",
+    "How much is tuition for international students?",
+    "How do I request an official transcript?",
+    "What are the English proficiency requirements?",
+    "Where can I get counseling services?",
+    "What is the deadline to apply for spring quarter?",
+    "How do I pay my tuition?",
+    "What documents do I need for an F-1 visa?",
+]
+
+def read_questions(path):
+    """Plain text (1 câu/dòng) hoặc JSONL với field question | title | body."""
+    if not path:
+        return DEFAULT_QUESTIONS
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                obj = json.loads(line)
+                q = obj.get("question") or obj.get("title") or obj.get("body")
+                if q:
+                    out.append(q)
+            else:
+                out.append(line)
+    return out or DEFAULT_QUESTIONS
+
+def parse_mix(spec: str):
+    """'a:3,b:1' -> ([a, b], [3, 1])"""
+    names, weights = [], []
+    for part in spec.split(","):
+        name, _, w = part.strip().partition(":")
+        if name:
+            names.append(name)
+            weights.append(float(w or 1))
+    return names, weights
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)   # endpoint -> [ms] (chỉ request thành công)
+        self.ttft = defaultdict(list)      # endpoint -> [ms] time to first message/token
+        self.ok = defaultdict(int)
+        self.errors = defaultdict(lambda: defaultdict(int))  # endpoint -> kind -> count
+
+    def success(self, endpoint, ms, ttft_ms=None):
+        self.ok[endpoint] += 1
+        self.latency[endpoint].append(ms)
+        if ttft_ms is not None:
+            self.ttft[endpoint].append(ttft_ms)
+
+    def failure(self, endpoint, kind):
+        self.errors[endpoint][kind] += 1
+
+    def summary(self, wall_s):
+        out = {}
+        for ep in sorted(set(self.ok) | set(self.errors)):
+            lat = sorted(self.latency[ep])
+            total = self.ok[ep] + sum(self.errors[ep].values())
+            row = {
+                "requests": total,
+                "ok": self.ok[ep],
+                "error_rate": round(1 - self.ok[ep] / total, 4) if total else 0.0,
+                "errors": dict(self.errors[ep]),
+                "throughput_rps": round(self.ok[ep] / wall_s, 2) if wall_s else 0.0,
+                "p50_ms": percentile(lat, 50), "p95_ms": percentile(lat, 95), "p99_ms": percentile(lat, 99),
+                "mean_ms": statistics.mean(lat) if lat else None,
+            }
+            if self.ttft[ep]:
+                tt = sorted(self.ttft[ep])
+                row.update({"ttft_p50_ms": percentile(tt, 50), "ttft_p95_ms": percentile(tt, 95), "ttft_p99_ms": percentile(tt, 99)})
+            out[ep] = {k: (round(v, 1) if isinstance(v, float) else v) for k, v in row.items()}
+        return out
+
+
+# ====== Request kinds ======
+async def do_ask(client, rec, school, question):
+    t0 = time.perf_counter()
+    try:
+        r = await client.post("/chat/ask", json={"school": school, "question": question})
+    except httpx.HTTPError as e:
+        rec.failure("ask", type(e).__name__)
+        return
+    ms = (time.perf_counter() - t0) * 1000
+    if r.status_code == 200:
+        rec.success("ask", ms)
+    else:
+        rec.failure("ask", f"http_{r.status_code}")
+
+async def do_stream(ws_url, rec, school, question, timeout):
+    t0 = time.perf_counter()
+    try:
+        async with websockets.connect(ws_url, open_timeout=timeout) as ws:
+            await ws.send(json.dumps({"school": school, "question": question}))
+            first = await asyncio.wait_for(ws.recv(), timeout)
+            ttft = (time.perf_counter() - t0) * 1000
+            msg = json.loads(first)
+            # Hiện tại server gửi 1 message/answer; nếu có streaming theo token thì đọc tới khi "done"
+            while msg.get("delta") is not None and not msg.get("done"):
+                msg = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+        rec.failure("stream", type(e).__name__)
+        return
+    if msg.get("error"):
+        rec.failure("stream", "busy" if msg.get("retry_after") else "app_error")
+    else:
+        rec.success("stream", (time.perf_counter() - t0) * 1000, ttft_ms=ttft)
+
+async def do_ingest(client, rec, school, headers):
+    text = f"Load test note {random.randint(0, 10**9)}: the library is open 8am-8pm on weekdays."
+    t0 = time.perf_counter()
+    try:
+        r = await client.post("/admin/documents/ingest", data={"school": school, "text": text}, headers=headers)
+    except httpx.HTTPError as e:
+        rec.failure("ingest", type(e).__name__)
+        return
+    if r.status_code == 200:
+        rec.success("ingest", (time.perf_counter() - t0) * 1000)
+    else:
+        rec.failure("ingest", f"http_{r.status_code}")
+
+async def do_tickets(client, rec, school, headers):
+    t0 = time.perf_counter()
+    try:
+        r = await client.get("/admin/tickets", params={"school": school}, headers=headers)
+    except httpx.HTTPError as e:
+        rec.failure("tickets", type(e).__name__)
+        return
+    if r.status_code == 200:
+        rec.success("tickets", (time.perf_counter() - t0) * 1000)
+    else:
+        rec.failure("tickets", f"http_{r.status_code}")
+
+
+# ====== Drivers ======
+async def run_step(args, concurrency, rate, questions, schools, weights):
+    rec = Recorder()
+    ws_url = args.base_url.replace("http", "ws", 1).rstrip("/") + "/chat/stream"
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=max(concurrency, 64), max_keepalive_connections=max(concurrency, 64))
+    deadline = time.perf_counter() + args.duration
+    sent = 0
+
+    async def one_chat():
+        school = random.choices(schools, weights)[0]
+        question = random.choice(questions)
+        if random.random() < args.stream_fraction:
+            await do_stream(ws_url, rec, school, question, args.timeout)
+        else:
+            await do_ask(client, rec, school, question)
+
+    def budget_left():
+        return time.perf_counter() < deadline and (not args.requests or sent < args.requests)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        background = []
+        if args.mixed:
+            async def poisson(fn, per_sec):
+                while time.perf_counter() < deadline:
+                    await asyncio.sleep(random.expovariate(per_sec))
+                    asyncio.ensure_future(fn(client, rec, random.choices(schools, weights)[0], headers))
+            if args.ingest_rate > 0:
+                background.append(asyncio.ensure_future(poisson(do_ingest, args.ingest_rate)))
+            if args.ticket_rate > 0:
+                background.append(asyncio.ensure_future(poisson(do_tickets, args.ticket_rate)))
+
+        t0 = time.perf_counter()
+        if rate:
+            # Open loop: đến theo Poisson, không chờ request trước xong (đo được queueing thật)
+            inflight = set()
+            while budget_left():
+                await asyncio.sleep(random.expovariate(rate))
+                sent += 1
+                task = asyncio.ensure_future(one_chat())
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+            if inflight:
+                await asyncio.wait(inflight, timeout=args.timeout)
+        else:
+            # Closed loop: `concurrency` client, mỗi client gửi liên tục
+            async def worker():
+                nonlocal sent
+                while budget_left():
+                    sent += 1
+                    await one_chat()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - t0
+        for b in background:
+            b.cancel()
+    return rec.summary(wall), wall
+
+def print_summary(label, summary, wall):
+    print(f"\n=== {label} ({wall:.1f}s) ===")
+    print(f"{'endpoint':10} {'req':>6} {'ok':>6} {'err%':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft50':>8} {'ttft95':>8}")
+    for ep, r in summary.items():
+        def f(v):
+            return f"{v:8.0f}" if isinstance(v, (int, float)) else f"{'-':>8}"
+        print(f"{ep:10} {r['requests']:6d} {r['ok']:6d} {r['error_rate'] * 100:6.1f} {r['throughput_rps']:8.2f}"
+              f"{f(r['p50_ms'])}{f(r['p95_ms'])}{f(r['p99_ms'])}{f(r.get('ttft_p50_ms'))}{f(r.get('ttft_p95_ms'))}")
+        if r["errors"]:
+            print(f"{'':10} errors: {r['errors']}")
+
+def chat_totals(summary):
+    rps = sum(summary[ep]["throughput_rps"] for ep in ("ask", "stream") if ep in summary)
+    p95 = max((summary[ep]["p95_ms"] or 0) for ep in ("ask", "stream") if ep in summary) if summary else 0
+    return rps, p95
+
+async def main():
+    ap = argparse.ArgumentParser(description="Load test for the Scholask chat and admin endpoints.")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--schools", default="seattle-central-college", help="school mix, e.g. 'scc:3,other:1'")
+    ap.add_argument("--questions", help="questions file: plain text or JSONL (question/title/body)")
+    ap.add_argument("--concurrency", type=int, default=8, help="closed-loop clients")
+    ap.add_argument("--rate", type=float, default=0.0, help="open-loop arrivals/sec (overrides --concurrency)")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per run / per sweep step")
+    ap.add_argument("--requests", type=int, default=0, help="stop after N chat requests (0 = duration only)")
+    ap.add_argument("--stream-fraction", type=float, default=0.0, help="share of chat requests sent over /chat/stream")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--sweep", help="comma-separated concurrency (or rate with --rate) levels to find saturation")
+    ap.add_argument("--mixed", action="store_true", help="add concurrent ingest + ticket traffic")
+    ap.add_argument("--token", default=os.getenv("LOADTEST_TOKEN"), help="owner/admin JWT for --mixed")
+    ap.add_argument("--ingest-rate", type=float, default=0.2, help="--mixed: ingests/sec")
+    ap.add_argument("--ticket-rate", type=float, default=5.0, help="--mixed: ticket list requests/sec")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--report", help="write JSON results here")
+    args = ap.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    questions = read_questions(args.questions)
+    schools, weights = parse_mix(args.schools)
+    print(f"[INFO] {len(questions)} question(s), schools={dict(zip(schools, weights))}, target={args.base_url}")
+
+    results = []
+    levels = [float(x) for x in args.sweep.split(",")] if args.sweep else [args.rate or args.concurrency]
+    for level in levels:
+        conc, rate = (args.concurrency, level) if args.rate else (int(level), 0.0)
+        label = f"rate={rate}/s" if rate else f"concurrency={conc}"
+        summary, wall = await run_step(args, conc, rate, questions, schools, weights)
+        print_summary(label, summary, wall)
+        results.append({"level": level, "mode": "open" if rate else "closed", "wall_s": round(wall, 2), "endpoints": summary})
+
+    if len(results) > 1:
+        # Điểm bão hoà: mức cuối cùng còn tăng throughput >= 10% so với mức trước
+        print("\n=== Sweep ===")
+        best, prev_rps = None, 0.0
+        for r in results:
+            rps, p95 = chat_totals(r["endpoints"])
+            print(f"level={r['level']:>6g}  chat rps={rps:8.2f}  worst p95={p95:8.0f} ms")
+            if rps >= prev_rps * 1.1:
+                best = r["level"]
+            prev_rps = max(prev_rps, rps)
+        print(f"[OK] Throughput stops scaling after level ≈ {best:g}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            # Không ghi JWT ra file report
+            report_args = {k: v for k, v in vars(args).items() if k != "token"}
+            report_args["token"] = "***" if args.token else None
+            json.dump({"args": report_args, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"[OK] Report: {args.report}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,8 +6,9 @@ load_dotenv()
 REGION = os.getenv("BEDROCK_REGION","us-west-2")
 CLAUDE = os.getenv("BEDROCK_CLAUDE_MODEL_ID","anthropic.claude-3-5-sonnet-20240620-v1:0")
 EMBED  = os.getenv("BEDROCK_EMBED_MODEL_ID","amazon.titan-embed-text-v2:0")
+ENDPOINT = os.getenv("BEDROCK_ENDPOINT_URL") or None  # scripts/fake_bedrock.py khi test offline
 
-br = boto3.client("bedrock-runtime", region_name=REGION)
+br = boto3.client("bedrock-runtime", region_name=REGION, endpoint_url=ENDPOINT)
 
 def test_embed():
     body = {"inputText": "Hello from Scholask", "dimensions": 1024}  # dimensions hợp lệ cho V2
@@ -42,6 +43,8 @@ def test_claude():
 
 if __name__=="__main__":
     print("Region:", REGION)
+    if ENDPOINT:
+        print("Endpoint:", ENDPOINT)
     print("Claude model:", CLAUDE)
     print("Embed model:", EMBED)
     try: